@@ -0,0 +1,520 @@
+import hashlib
+import json
+import sys
+import threading
+from datetime import datetime
+from functools import lru_cache
+
+from .time_utils import TimeUtils
+from .utils import debugprint
+
+# Day names as they appear in the feed, upper-cased. Their position is the
+# day index used everywhere in the compiled model; any other name the feed
+# uses is appended the first time it is seen.
+DAY_NAMES = ["SUNDAY", "MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY"]
+DAY_INDEX = {name: i for i, name in enumerate(DAY_NAMES)}
+_day_lock = threading.Lock()
+
+_DATE_FORMATS = ["%Y-%m-%d", "%d-%m-%Y", "%Y/%m/%d", "%d/%m/%Y"]
+
+# Weekly occupancy bitmasks: one bit per SLOT_MINUTES of the week, day by day
+# (bit day * SLOTS_PER_DAY + minute // SLOT_MINUTES). Two sections clash
+# exactly when their masks share a bit.
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+
+def day_index(name):
+    """Index of a day name from the feed, registering names not seen before."""
+    name = name.upper()
+    index = DAY_INDEX.get(name)
+    if index is None:
+        with _day_lock:
+            index = DAY_INDEX.get(name)
+            if index is None:
+                index = len(DAY_NAMES)
+                DAY_NAMES.append(sys.intern(name))
+                DAY_INDEX[DAY_NAMES[index]] = index
+    return index
+
+
+def day_mask(names):
+    """Bitmask of the given day names; names the feed never used are ignored."""
+    mask = 0
+    for name in names:
+        index = DAY_INDEX.get(str(name).upper())
+        if index is not None:
+            mask |= 1 << index
+    return mask
+
+
+def mask_days(mask):
+    """Day names in a bitmask, sorted alphabetically (as the legacy day lists were)."""
+    return sorted(DAY_NAMES[i] for i in range(len(DAY_NAMES)) if mask >> i & 1)
+
+
+def _date_ordinal(date_str):
+    """Ordinal of an exam date in any of the accepted formats, or None."""
+    if not date_str or not isinstance(date_str, str):
+        return None
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(date_str, fmt).toordinal()
+        except ValueError:
+            continue
+    return None
+
+
+def _exam_minutes(time_str):
+    """Minutes after midnight of an exam time such as "09:00:00".
+
+    Mirrors the exam comparison the routine engine has always used: the
+    hour and minute before/after the first colon, None when they are not
+    plain numbers (so "9:00AM" counts as unknown, as before).
+    """
+    if not isinstance(time_str, str) or ":" not in time_str:
+        return None
+    parts = time_str.strip().split(":")
+    try:
+        return int(parts[0]) * 60 + int(parts[1])
+    except (ValueError, IndexError):
+        return None
+
+
+def _exam(schedule, kind):
+    """(date ordinal, start minute, end minute) of the mid or final exam, or None."""
+    ordinal = _date_ordinal(schedule.get(f"{kind}ExamDate"))
+    if ordinal is None:
+        return None
+    start = _exam_minutes((schedule.get(f"{kind}ExamStartTime") or "").replace(" ", ""))
+    end = _exam_minutes((schedule.get(f"{kind}ExamEndTime") or "").replace(" ", ""))
+    return (ordinal, start, end)
+
+
+@lru_cache(maxsize=4096)
+def _minutes(time_str):
+    # The feed repeats a few dozen distinct times across thousands of sections
+    return TimeUtils.time_to_minutes(time_str)
+
+
+def _meetings(schedules):
+    """(day index or None, start minute, end minute, has times) per schedule entry."""
+    meetings = []
+    for schedule in schedules:
+        if not isinstance(schedule, dict):
+            continue
+        day = schedule.get("day") or ""
+        start_time = schedule.get("startTime") or ""
+        end_time = schedule.get("endTime") or ""
+        meetings.append((
+            day_index(day) if day else None,
+            _minutes(start_time),
+            _minutes(end_time),
+            bool(start_time and end_time),
+        ))
+    return tuple(meetings)
+
+
+def _lab_schedules(raw):
+    """Raw lab schedule entries, in either the list or {classSchedules: [...]} shape."""
+    labs = raw.get("labSchedules")
+    if isinstance(labs, list):
+        return labs
+    if isinstance(labs, dict) and isinstance(labs.get("classSchedules"), list):
+        return labs["classSchedules"]
+    return []
+
+
+def _flat_labs(raw, schedules):
+    """Lab schedules with the room and faculty filled in, as get_lab_schedules_flat returns them."""
+    room = raw.get("labRoomName")
+    faculty = raw.get("labFaculties") or "TBA"
+    return tuple(
+        {**schedule, "room": room or schedule.get("room") or "TBA", "faculty": faculty}
+        for schedule in schedules
+    )
+
+
+def _occupancy(intervals):
+    """(bitmask, exact) of the slots covered by (day, start, end) intervals.
+
+    `exact` is False when some interval cannot be represented on the slot
+    grid (off the 5-minute grid, empty or reversed, outside the day); such
+    sections are compared interval by interval instead.
+    """
+    mask = 0
+    exact = True
+    for day, start, end in intervals:
+        if not (0 <= start < end <= 24 * 60) or start % SLOT_MINUTES or end % SLOT_MINUTES:
+            exact = False
+            continue
+        first = day * SLOTS_PER_DAY + start // SLOT_MINUTES
+        mask |= ((1 << ((end - start) // SLOT_MINUTES)) - 1) << first
+    return mask, exact
+
+
+def _has_internal_conflict(intervals):
+    """True if two of a section's own meetings overlap on the same day."""
+    prev_day = prev_end = None
+    for day, start, end in intervals:
+        if day == prev_day and start < prev_end:
+            return True
+        prev_end = max(prev_end, end) if day == prev_day else end
+        prev_day = day
+    return False
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Section:
+    """One course section compiled from the feed for the routine engine.
+
+    Built once per snapshot; the engine only reads these fields and goes
+    back to `raw` (the feed dict) when it builds a response.
+    """
+
+    __slots__ = (
+        "raw",
+        "catalog",  # the Catalog this section belongs to, None for sections sent by the client
+        "index",  # position in Catalog.sections, None for sections sent by the client
+        "course",
+        "name",
+        "section_id",
+        "faculty",
+        "free_seats",
+        "class_meetings",  # ((day, start, end, has_times), ...)
+        "lab_meetings",
+        "lab_schedules",  # flattened lab schedule dicts, see get_lab_schedules_flat
+        "intervals",  # class and lab (day, start, end) sorted, entries without a day left out
+        "days",  # bitmask of the days this section meets on
+        "blank_day",  # True if some schedule entry has no day at all
+        "has_schedules",
+        "internal_conflict",  # True if two of its own meetings overlap
+        "occupancy",  # weekly bitmask of the slots its classes and labs cover
+        "lab_occupancy",  # the same for its labs only
+        "occupancy_exact",  # False if some interval is off the slot grid, see _occupancy
+        "mid_exam",  # (date ordinal, start minute, end minute) or None
+        "final_exam",
+        "schedule_class",  # id shared by the catalog's sections with the same course, timetable and exams
+    )
+
+    def __init__(self, raw, index=None):
+        self.raw = raw
+        self.catalog = None
+        self.index = index
+        self.course = _intern(raw.get("courseCode"))
+        self.name = raw.get("sectionName")
+        self.section_id = raw.get("sectionId")
+        self.faculty = _intern(raw.get("faculties"))
+        try:
+            self.free_seats = (raw.get("capacity") or 0) - (raw.get("consumedSeat") or 0)
+        except TypeError:
+            self.free_seats = 0
+
+        schedule = raw.get("sectionSchedule")
+        if not isinstance(schedule, dict):
+            schedule = {}
+        self.class_meetings = _meetings(schedule.get("classSchedules") or [])
+        labs = _lab_schedules(raw)
+        self.lab_meetings = _meetings(labs)
+        self.lab_schedules = _flat_labs(raw, labs)
+
+        days = 0
+        blank_day = False
+        intervals = []
+        for day, start, end, _ in self.class_meetings + self.lab_meetings:
+            if day is None:
+                blank_day = True
+            else:
+                days |= 1 << day
+                intervals.append((day, start, end))
+        intervals.sort()
+        self.intervals = tuple(intervals)
+        self.occupancy, self.occupancy_exact = _occupancy(self.intervals)
+        lab_intervals = [(day, start, end) for day, start, end, _ in self.lab_meetings if day is not None]
+        self.lab_occupancy, labs_exact = _occupancy(lab_intervals)
+        self.occupancy_exact = self.occupancy_exact and labs_exact
+        self.days = days
+        self.blank_day = blank_day
+        self.has_schedules = bool(self.class_meetings or self.lab_meetings)
+        self.internal_conflict = _has_internal_conflict(self.intervals)
+        self.mid_exam = _exam(schedule, "mid")
+        self.final_exam = _exam(schedule, "final")
+        self.schedule_class = None
+
+    @property
+    def schedule_key(self):
+        """What the routine engine sees of a section: course, meetings and exam slots."""
+        return (self.course, self.class_meetings, self.lab_meetings, self.mid_exam, self.final_exam)
+
+    def __repr__(self):
+        return f"<Section {self.course} {self.name}>"
+
+
+def _exams_overlap(exam1, exam2):
+    if exam1 is None or exam2 is None or exam1[0] != exam2[0]:
+        return False
+    _, start1, end1 = exam1
+    _, start2, end2 = exam2
+    if start1 is None or start2 is None:
+        return False
+    if end1 is None or end2 is None:
+        # Exams without an end time are taken to last two hours
+        end1 = start1 + 120
+        end2 = start2 + 120
+    return max(start1, start2) < min(end1, end2)
+
+
+def _intervals_overlap(intervals1, intervals2):
+    for day1, start1, end1 in intervals1:
+        for day2, start2, end2 in intervals2:
+            if day1 == day2 and start1 < end2 and start2 < end1:
+                return True
+    return False
+
+
+def _shared_catalog(section1, section2):
+    """The catalog whose compatibility table covers this pair, or None."""
+    catalog = section1.catalog
+    if catalog is not None and catalog is section2.catalog and section1.course != section2.course:
+        return catalog
+    return None
+
+
+def time_conflict(section1, section2):
+    """True if any class or lab of one section overlaps one of the other's."""
+    catalog = _shared_catalog(section1, section2)
+    if catalog is not None:
+        return bool(catalog.time_conflicts[section1.index] >> section2.index & 1)
+    if section1.occupancy_exact and section2.occupancy_exact:
+        return bool(section1.occupancy & section2.occupancy)
+    if not section1.days & section2.days:
+        return False
+    return _intervals_overlap(section1.intervals, section2.intervals)
+
+
+def lab_conflict(section1, section2):
+    """True if a lab of one section overlaps a lab of the other."""
+    if section1.occupancy_exact and section2.occupancy_exact:
+        return bool(section1.lab_occupancy & section2.lab_occupancy)
+    return _intervals_overlap(
+        [meeting[:3] for meeting in section1.lab_meetings if meeting[0] is not None],
+        [meeting[:3] for meeting in section2.lab_meetings if meeting[0] is not None],
+    )
+
+
+def combine_occupancy(sections):
+    """Accumulated occupancy of sections that must not overlap, or None if two do.
+
+    Adding a section is one AND and one OR on the running mask; sections
+    whose mask is not exact are checked interval by interval against the
+    rest. A section whose own meetings overlap makes the whole set invalid.
+    """
+    occupied = 0
+    exact = []
+    inexact = []
+    for section in sections:
+        if section.internal_conflict:
+            return None
+        if section.occupancy_exact:
+            if occupied & section.occupancy:
+                return None
+            occupied |= section.occupancy
+            exact.append(section)
+        else:
+            inexact.append(section)
+    for i, section in enumerate(inexact):
+        for other in exact + inexact[i + 1:]:
+            if time_conflict(section, other):
+                return None
+    return occupied
+
+
+def exam_conflict(section1, section2):
+    """True if the mid or final exams of two sections overlap."""
+    catalog = _shared_catalog(section1, section2)
+    if catalog is not None:
+        return bool(catalog.exam_conflicts[section1.index] >> section2.index & 1)
+    if section1.section_id == section2.section_id:
+        return False
+    return (
+        _exams_overlap(section1.mid_exam, section2.mid_exam)
+        or _exams_overlap(section1.final_exam, section2.final_exam)
+    )
+
+
+def _overlap_bits(groups, overlaps):
+    """For each key of `groups` (key -> bitset of sections), the OR of the
+    bitsets of every key it overlaps according to `overlaps(key1, key2)`."""
+    keys = list(groups)
+    result = {}
+    for key in keys:
+        bits = 0
+        for other in keys:
+            if overlaps(key, other):
+                bits |= groups[other]
+        result[key] = bits
+    return result
+
+
+def _id_key(section):
+    try:
+        hash(section.section_id)
+    except TypeError:  # unhashable value in the feed: never equal to another
+        return ("unhashable", section.index)
+    return section.section_id
+
+
+def _conflict_tables(sections):
+    """Per-section bitsets of the sections of other courses it clashes with.
+
+    Returns (time_conflicts, exam_conflicts), lists indexed like `sections`
+    where bit j of entry i is set if sections i and j conflict. Sections
+    that share a meeting interval or an exam slot are grouped first, so
+    the overlap tests run over the few distinct intervals and exam slots in
+    the feed rather than over every pair of sections.
+    """
+    course_bits = {}
+    id_bits = {}
+    by_interval = {}
+    by_exam = {"mid": {}, "final": {}}
+    for section in sections:
+        bit = 1 << section.index
+        course_bits[section.course] = course_bits.get(section.course, 0) | bit
+        id_bits[_id_key(section)] = id_bits.get(_id_key(section), 0) | bit
+        for interval in section.intervals:
+            by_interval[interval] = by_interval.get(interval, 0) | bit
+        for kind, exam in (("mid", section.mid_exam), ("final", section.final_exam)):
+            if exam is not None:
+                by_exam[kind][exam] = by_exam[kind].get(exam, 0) | bit
+
+    # Same-day strict overlap, as in time_conflict
+    interval_bits = _overlap_bits(
+        by_interval,
+        lambda a, b: a[0] == b[0] and a[1] < b[2] and b[1] < a[2],
+    )
+    exam_bits = {kind: _overlap_bits(groups, _exams_overlap) for kind, groups in by_exam.items()}
+
+    time_conflicts = []
+    exam_conflicts = []
+    for section in sections:
+        other_courses = ~course_bits[section.course]
+        bits = 0
+        for interval in set(section.intervals):
+            bits |= interval_bits[interval]
+        time_conflicts.append(bits & other_courses)
+        bits = 0
+        if section.mid_exam is not None:
+            bits |= exam_bits["mid"][section.mid_exam]
+        if section.final_exam is not None:
+            bits |= exam_bits["final"][section.final_exam]
+        # Two entries with the same sectionId never conflict, see exam_conflict
+        exam_conflicts.append(bits & other_courses & ~id_bits[_id_key(section)])
+    return time_conflicts, exam_conflicts
+
+
+class Catalog:
+    """The compiled sections of one snapshot, in feed order, plus lookup indexes.
+
+    The indexes are built with the sections so endpoints never scan the
+    feed: by course code, by sectionId, by (course code, section name) and
+    by faculty. Where a key is shared the first section in feed order wins,
+    as the linear searches they replace did.
+
+    Sections of a course that meet at the same times and sit the same exams
+    differ only in name, faculty and seats; they share a `schedule_class`
+    so the search can try one of them for all.
+
+    It also holds the compatibility table of the snapshot: for every section
+    a bitset (over section indexes) of the sections of other courses whose
+    classes/labs or exams overlap its own. time_conflict() and
+    exam_conflict() answer pairs of sections from one catalog with a bit
+    lookup; pairs within a course or involving a client-sent section are
+    still compared directly.
+    """
+
+    def __init__(self, data):
+        sections = []
+        for index, raw in enumerate(data or []):
+            if not isinstance(raw, dict):
+                continue
+            try:
+                sections.append(Section(raw, len(sections)))
+            except Exception as e:
+                debugprint(f"Skipping section {index} that could not be compiled: {e}")
+        self.sections = sections
+
+        by_course = {}
+        by_faculty = {}
+        self.by_id = {}
+        self.by_course_name = {}  # (course code, str(section name)) -> Section
+        self.by_name = {}  # section name -> first Section with it, any course
+        self.by_section_field = {}  # legacy "section" field -> Section
+        for section in sections:
+            by_course.setdefault(section.course, []).append(section)
+            if section.faculty:
+                by_faculty.setdefault(section.faculty, []).append(section)
+            _index_first(self.by_id, section.section_id, section)
+            _index_first(self.by_course_name, (section.course, str(section.name)), section)
+            _index_first(self.by_name, section.name, section)
+            _index_first(self.by_section_field, section.raw.get("section"), section)
+        # Tuples, so a caller cannot change the shared index by accident
+        self.by_course = {code: tuple(group) for code, group in by_course.items()}
+        self.by_faculty = {name: tuple(group) for name, group in by_faculty.items()}
+
+        self.time_conflicts, self.exam_conflicts = _conflict_tables(sections)
+        classes = {}
+        for section in sections:
+            section.catalog = self
+            section.schedule_class = classes.setdefault(section.schedule_key, len(classes))
+        self.schedule_classes = len(classes)
+        self._course_versions = {}
+
+    def __len__(self):
+        return len(self.sections)
+
+    def course_sections(self, course_code):
+        """Sections of one course, in feed order."""
+        try:
+            return self.by_course.get(course_code, ())
+        except TypeError:  # unhashable code from a request body
+            return ()
+
+    def course_version(self, course_code):
+        """A digest of the feed entries of one course's sections, seats included.
+
+        It changes only when something about that course changes, so results
+        computed from its sections can be reused across snapshots until then.
+        """
+        version = self._course_versions.get(course_code)
+        if version is None:
+            feed = json.dumps([section.raw for section in self.course_sections(course_code)],
+                              sort_keys=True, default=str)
+            version = self._course_versions[course_code] = hashlib.blake2b(feed.encode(), digest_size=16).hexdigest()
+        return version
+
+    def find_section(self, reference):
+        """Section a client referred to by its "section" field, name or sectionId."""
+        try:
+            return (
+                self.by_section_field.get(reference)
+                or self.by_name.get(reference)
+                or self.by_id.get(reference)
+            )
+        except TypeError:
+            return None
+
+    def section_by_name(self, course_code, section_name):
+        """The section of a course with the given name (compared as strings)."""
+        return self.by_course_name.get((course_code, str(section_name)))
+
+
+def _index_first(index, key, section):
+    if key is None:
+        return
+    try:
+        index.setdefault(key, section)
+    except TypeError:  # unhashable value in the feed
+        pass
@@ -1,66 +1,112 @@
 import requests
-import json
+import threading
 import time
+from . import http_client
 from .config import DATA_URL
+from .feed_parser import iter_sections
 from .utils import debugprint
+from .snapshot import Snapshot, SnapshotManager, NOT_MODIFIED
 
-# Initialize data as None
-data = None
+# Bytes handed to the streaming parser per read
+FEED_CHUNK_SIZE = 64 * 1024
 
-def load_data():
-    """Load course data from the API with retry logic."""
+class _counted:
+    """Wrap a chunk iterator and count the bytes that pass through it."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.bytes_read = 0
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            self.bytes_read += len(chunk)
+            yield chunk
+
+def fetch_feed(url, previous=None):
+    """Fetch and parse a schedule feed with retry logic.
+
+    When `previous` (the snapshot currently being served) carries ETag or
+    Last-Modified validators they are sent back upstream; a 304 answer
+    returns NOT_MODIFIED so the caller keeps the already-parsed snapshot.
+    Returns a new Snapshot, NOT_MODIFIED, or None if every attempt failed.
+    """
     try:
-        debugprint(f"\n=== Loading Fresh Data from {DATA_URL} ===")
+        debugprint(f"\n=== Loading Fresh Data from {url} ===")
         
         # Add retry logic
         max_retries = 3
         retry_delay = 2  # seconds
+        headers = previous.conditional_headers() if previous is not None else {}
         
         for attempt in range(max_retries):
             try:
                 debugprint(f"Attempt {attempt + 1}/{max_retries}...")
-                response = requests.get(DATA_URL, timeout=30)  # Increased timeout
-                response.raise_for_status()
-                raw_json = response.json()
-                
-                debugprint(f"Raw response type: {type(raw_json)}")
-                
-                # Handle both direct list and {data: [...]} formats
-                if isinstance(raw_json, dict) and "data" in raw_json:
-                    debugprint("Response is a dict with 'data' key")
-                    fresh_data = raw_json["data"]
-                else:
-                    debugprint("Response is a direct list")
-                    fresh_data = raw_json  # If it's already a list
-                
-                if not isinstance(fresh_data, list):
-                    debugprint(f"Warning: Expected list data, got {type(fresh_data)}")
-                    continue
-                
-                # Count sections by course
-                course_counts = {}
-                for section in fresh_data:
-                    course = section.get("courseCode")
-                    if course:
-                        course_counts[course] = course_counts.get(course, 0) + 1
+                # Stream the body and decode one section at a time to keep peak memory low
+                response = http_client.get(url, headers=headers, stream=True)  # Pooled keep-alive session, per-host timeouts
+                with response:
+                    if response.status_code == 304:
+                        http_client.finish_timing(response, 0)
+                        if previous is None:
+                            # Nothing to reuse, and a 304 has no body to parse
+                            debugprint("Upstream answered 304 to an unconditional request")
+                            return None
+                        debugprint("Upstream feed not modified, reusing current snapshot")
+                        return NOT_MODIFIED
+                    response.raise_for_status()
+                    chunks = _counted(response.iter_content(chunk_size=FEED_CHUNK_SIZE))
+                    fresh_data = []
+                    course_counts = {}
+                    for section in iter_sections(chunks):
+                        fresh_data.append(section)
+                        # Count sections by course
+                        course = section.get("courseCode")
+                        if course:
+                            course_counts[course] = course_counts.get(course, 0) + 1
+                    http_client.finish_timing(response, chunks.bytes_read)
                 
                 debugprint(f"Successfully loaded {len(fresh_data)} total sections")
                 debugprint("Sections per course:")
                 for course, count in sorted(course_counts.items()):
                     debugprint(f"  {course}: {count} sections")
                 
-                return fresh_data
+                return Snapshot(
+                    fresh_data,
+                    etag=response.headers.get("ETag"),
+                    last_modified=response.headers.get("Last-Modified"),
+                )
             except requests.exceptions.RequestException as e:
                 debugprint(f"Error on attempt {attempt + 1}: {e}")
                 if attempt < max_retries - 1:  # Don't sleep on the last attempt
                     time.sleep(retry_delay)
-            except json.JSONDecodeError as e:
-                debugprint(f"JSON decode error on attempt {attempt + 1}: {e}")
+            except ValueError as e:  # includes json.JSONDecodeError
+                debugprint(f"Malformed feed on attempt {attempt + 1}: {e}")
                 if attempt < max_retries - 1:
                     time.sleep(retry_delay)
         
         debugprint("All retry attempts failed")
         return None
     except Exception as e:
-        debugprint(f"Critical error in load_data: {e}")
-        return None
\ No newline at end of file
+        debugprint(f"Critical error in fetch_feed: {e}")
+        return None
+
+def fetch_data(previous=None):
+    """Fetch course data from the configured DATA_URL."""
+    return fetch_feed(DATA_URL, previous)
+
+# Process-wide cache of the feed, shared by every request of the routinez app. Made on
+# first use so importing fetch_feed does not load (and compile) the saved feed.
+_snapshots = None
+_snapshots_lock = threading.Lock()
+
+def get_snapshots():
+    """The SnapshotManager of the feed, created on first call."""
+    global _snapshots
+    with _snapshots_lock:
+        if _snapshots is None:
+            _snapshots = SnapshotManager(fetch_data, name="connect.json")
+        return _snapshots
+
+def load_data():
+    """Return the cached course data, refreshing it once the TTL has passed."""
+    snapshot = get_snapshots().get()
+    return snapshot.data if snapshot else None
\ No newline at end of file
@@ -1,3 +1,4 @@
+from .catalog import Section
 from .utils import debugprint, normalize_date
 
 def exam_schedules_overlap(exam1, exam2):
@@ -147,17 +148,44 @@ def check_exam_conflicts(section1, section2):
 
     return conflicts
 
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
 class ExamConflictChecker:
-    @staticmethod
-    def check_conflicts(sections):
+    """Exam conflict checks for sections picked from a snapshot.
+
+    Sections are looked up in `catalog` (by sectionId for section dicts, by
+    name or id otherwise); sections it does not know are used as sent. Pairs
+    are compared with check_exam_conflicts(), which reads 12-hour times and
+    gives every exam two hours, rather than with the catalog's compatibility
+    table, whose exam slots follow the routine engine's rules.
+    """
+
+    def __init__(self, catalog=None):
+        self.catalog = catalog
+
+    def _section(self, section):
+        found = None
+        if self.catalog is not None:
+            if isinstance(section, dict):
+                found = self.catalog.by_id.get(section.get("sectionId")) if _hashable(section.get("sectionId")) else None
+            else:
+                found = self.catalog.find_section(section)
+        if found is None and isinstance(section, dict):
+            found = Section(section)
+        return found
+
+    def check_conflicts(self, sections):
         """Check for conflicts between mid-term and final exams of sections."""
+        compiled = [section for section in map(self._section, sections) if section is not None]
         exam_conflicts = []
-        for i, section1 in enumerate(sections):
-            for j in range(i + 1, len(sections)):
-                section2 = sections[j]
-                conflicts = check_exam_conflicts(section1, section2)
-                if conflicts:
-                    exam_conflicts.extend(conflicts)
+        for i, section1 in enumerate(compiled):
+            for j in range(i + 1, len(compiled)):
+                exam_conflicts.extend(check_exam_conflicts(section1.raw, compiled[j].raw))
         return exam_conflicts
 
     @staticmethod
@@ -0,0 +1,122 @@
+import codecs
+import json
+import sys
+
+# Whitespace allowed between JSON tokens
+_WHITESPACE = " \t\n\r"
+
+_decoder = json.JSONDecoder()
+
+
+def _compact(value):
+    """Intern the strings of a decoded section so repeats share one object.
+
+    Every section repeats the same keys ("courseCode", "faculties", ...) and
+    many of the same values (course codes, days, times, rooms); the JSON
+    decoder allocates a fresh string for each, interning collapses them.
+    """
+    if isinstance(value, dict):
+        return {sys.intern(k): _compact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_compact(v) for v in value]
+    if isinstance(value, str) and len(value) <= 64:
+        return sys.intern(value)
+    return value
+
+
+class _Reader:
+    """Text buffer over an iterable of byte chunks, refilled on demand."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read one more chunk into the buffer; False once the stream is done."""
+        if self.eof:
+            return False
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        for chunk in self._chunks:
+            if chunk:
+                self.buf += self._utf8.decode(chunk)
+                return True
+        self.buf += self._utf8.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    def peek(self):
+        """Next non-whitespace character, or "" at end of stream."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of feed buffer")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value, reading more data as needed."""
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A scalar that stops at the end of the buffer may continue in the
+            # next chunk (e.g. a number split in two), so only trust it at EOF.
+            if end == len(self.buf) and not self.eof and self.fill():
+                continue
+            self.pos = end
+            return obj
+
+
+def iter_sections(chunks):
+    """Yield the sections of a schedule feed one at a time.
+
+    `chunks` is an iterable of raw bytes (e.g. response.iter_content()). The
+    feed is either a JSON array of sections or an object whose "data" key
+    holds that array. Only one section is decoded at a time, so the whole
+    body and the full raw object tree are never held in memory together.
+    Raises ValueError if the feed has neither shape or is malformed.
+    """
+    reader = _Reader(chunks)
+    first = reader.peek()
+    if first == "{":
+        reader.pos += 1
+        while True:
+            if reader.peek() == "}":
+                raise ValueError("Feed object has no 'data' list")
+            key = reader.value()
+            reader.expect(":")
+            if key == "data":
+                break
+            reader.value()  # skip metadata next to the sections
+            if reader.peek() == ",":
+                reader.pos += 1
+    elif first != "[":
+        raise ValueError("Feed is neither a list nor an object with 'data'")
+
+    reader.expect("[")
+    if reader.peek() == "]":
+        return
+    while True:
+        yield _compact(reader.value())
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or ']' between sections, got {separator!r}")
+
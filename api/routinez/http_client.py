@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .config import HTTP_POOL_SIZE, HTTP_DEFAULT_TIMEOUT, HTTP_HOST_TIMEOUTS
+from .utils import debugprint
+
+# Connect (TCP + TLS) time spent by the current thread's in-progress request
+_local = threading.local()
+
+# Most recent upstream fetch timings, newest last
+_recent_timings = deque(maxlen=50)
+_timings_lock = threading.Lock()
+
+
+def _add_connect_time(seconds):
+    _local.connect_seconds = getattr(_local, "connect_seconds", 0.0) + seconds
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _add_connect_time(time.perf_counter() - started)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _add_connect_time(time.perf_counter() - started)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled connections report how long connecting took."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+class FetchTiming:
+    """Where the time went for one upstream request."""
+
+    def __init__(self, url, status, connect_seconds, wait_seconds):
+        self.url = url
+        self.status = status
+        self.connect_seconds = connect_seconds  # TCP + TLS setup, 0 on a reused connection
+        self.wait_seconds = wait_seconds  # request sent -> response headers, excluding connect
+        self.transfer_seconds = None  # response headers -> body fully read
+        self.bytes = None
+        self.finished_at = None
+
+    @property
+    def reused_connection(self):
+        return self.connect_seconds == 0.0
+
+    def as_dict(self):
+        return {
+            "url": self.url,
+            "status": self.status,
+            "connectMs": round(self.connect_seconds * 1000, 1),
+            "waitMs": round(self.wait_seconds * 1000, 1),
+            "transferMs": round(self.transfer_seconds * 1000, 1) if self.transfer_seconds is not None else None,
+            "bytes": self.bytes,
+            "reusedConnection": self.reused_connection,
+            "finishedAt": self.finished_at,
+        }
+
+
+# One adapter (and therefore one set of keep-alive pools) for the whole process.
+# Sessions are per thread because requests.Session itself is not thread-safe;
+# the urllib3 pools underneath are, so every thread shares the same connections.
+_adapter = TimedHTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+
+
+def get_session():
+    """Return this thread's Session, wired to the shared connection pools."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.mount("http://", _adapter)
+        session.mount("https://", _adapter)
+        session.headers["Accept-Encoding"] = "gzip, deflate"
+        session.headers["Connection"] = "keep-alive"
+        _local.session = session
+    return session
+
+
+def timeout_for(url):
+    """(connect, read) timeout for the host of `url`."""
+    return HTTP_HOST_TIMEOUTS.get(urlsplit(url).hostname, HTTP_DEFAULT_TIMEOUT)
+
+
+def get(url, headers=None, timeout=None, stream=False):
+    """GET `url` through the pooled session and record its timing.
+
+    With stream=False the body is read before returning and the timing is
+    complete. With stream=True the caller reads the body and then calls
+    finish_timing(response, nbytes) so the transfer time is recorded.
+    """
+    _local.connect_seconds = 0.0
+    started = time.perf_counter()
+    response = get_session().get(url, headers=headers, timeout=timeout or timeout_for(url), stream=True)
+    headers_at = time.perf_counter()
+    connect_seconds = _local.connect_seconds
+    response.timing = FetchTiming(
+        url,
+        response.status_code,
+        connect_seconds,
+        max(0.0, headers_at - started - connect_seconds),
+    )
+    response.timing_started = headers_at
+    if not stream:
+        finish_timing(response, len(response.content))
+    return response
+
+
+def finish_timing(response, nbytes=None):
+    """Record the transfer time of a response whose body has been consumed."""
+    timing = response.timing
+    timing.transfer_seconds = time.perf_counter() - response.timing_started
+    timing.bytes = nbytes
+    timing.finished_at = time.time()
+    with _timings_lock:
+        _recent_timings.append(timing)
+    debugprint(
+        f"Fetched {timing.url} [{timing.status}]: connect {timing.connect_seconds * 1000:.0f}ms, "
+        f"wait {timing.wait_seconds * 1000:.0f}ms, transfer {timing.transfer_seconds * 1000:.0f}ms, "
+        f"{nbytes} bytes"
+    )
+    return timing
+
+
+def recent_timings(limit=10):
+    """The latest upstream fetch timings as dicts, newest last."""
+    with _timings_lock:
+        timings = list(_recent_timings)[-limit:]
+    return [timing.as_dict() for timing in timings]
@@ -3,7 +3,7 @@ import os
 
 from .config import DEBUG
 from .utils import debugprint
-from .data_loader import load_data
+from .data_loader import get_snapshots, load_data
 from .ai_service import initialize_ai
 from .routes import app as flask_app
 
@@ -23,6 +23,9 @@ def create_app():
     else:
         debugprint("Failed to preload course data")
     
+    # Keep the feed fresh off the request path from here on
+    get_snapshots().start_background_refresh()
+    
     # Return the Flask app instance from routes.py
     return flask_app
 
@@ -0,0 +1,84 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+from collections import namedtuple
+
+from .catalog import DAY_NAMES
+from .config import ROUTINE_CURSOR_SECRET
+
+# Request fields that may change from one page to the next
+PAGE_FIELDS = ("cursor", "pageSize", "timeBudgetMs")
+
+# What a page cursor holds: the snapshot generation and course versions the
+# routines were ranked on, the request they belong to and the search
+# position of solver.routine_page()
+Cursor = namedtuple("Cursor", ["generation", "courses", "request", "position"])
+
+
+def request_digest(request_data):
+    """A short digest of a routine request, leaving out the fields that only shape one page."""
+    canonical = {key: value for key, value in request_data.items() if key not in PAGE_FIELDS}
+    text = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def courses_digest(catalog, courses):
+    """A short digest of the Catalog.course_version() of every course, in sorted order."""
+    versions = ",".join(catalog.course_version(course) for course in sorted(set(courses)))
+    return hashlib.sha256(versions.encode()).hexdigest()[:16]
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _signature(payload, secret):
+    return hmac.new(secret, payload, hashlib.sha256).digest()[:16]
+
+
+def encode_cursor(cursor, secret=ROUTINE_CURSOR_SECRET):
+    """The opaque text handed to clients for a Cursor, signed with `secret`."""
+    payload = json.dumps({"g": cursor.generation, "v": cursor.courses, "r": cursor.request, "p": list(cursor.position)},
+                         separators=(",", ":")).encode()
+    return f"{_b64encode(payload)}.{_b64encode(_signature(payload, secret))}"
+
+
+def decode_cursor(text, secret=ROUTINE_CURSOR_SECRET):
+    """The Cursor encoded in `text` by encode_cursor(), or None if it is not one.
+
+    Cursors not signed with `secret` are refused, and so are positions no
+    search could have stopped at.
+    """
+    if not isinstance(text, str) or text.count(".") != 1:
+        return None
+    try:
+        encoded, signature = text.split(".")
+        payload = _b64decode(encoded)
+        if not hmac.compare_digest(_b64decode(signature), _signature(payload, secret)):
+            return None
+        data = json.loads(payload)
+        cursor = Cursor(data["g"], data["v"], data["r"], data["p"])
+        fewest, most, tier, start = cursor.position
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        return None
+    # At most one tier per number of campus days, from 0 to every day of the week
+    days = range(len(DAY_NAMES) + 1)
+    if not isinstance(tier, int) or isinstance(tier, bool) or tier not in days:
+        return None
+    if not all(count is None or isinstance(count, int) and not isinstance(count, bool) and count in days
+               for count in (fewest, most)):
+        return None
+    if fewest is None and most is not None:
+        return None
+    if start is not None:
+        if not isinstance(start, list) or not all(
+                isinstance(index, int) and not isinstance(index, bool) and index >= 0 for index in start):
+            return None
+        start = tuple(start)
+    return cursor._replace(position=(fewest, most, tier, start))
@@ -0,0 +1,190 @@
+import concurrent.futures
+import multiprocessing
+import pickle
+import threading
+import time
+
+from .config import ROUTINE_TIME_BUDGET_MS, SEARCH_WORKERS
+from .solver import Deadline, _Problem
+from .utils import debugprint
+
+# Compiled catalogs a worker process has been sent, by snapshot generation
+_worker_catalogs = {}
+# Catalogs kept per worker: the current snapshot and the one searches may still be finishing on
+WORKER_CATALOGS = 2
+
+
+def _worker_catalog(generation, catalog_blob):
+    catalog = _worker_catalogs.get(generation)
+    if catalog is None and catalog_blob is not None:
+        catalog = _worker_catalogs[generation] = pickle.loads(catalog_blob)
+        for old in sorted(_worker_catalogs)[:-WORKER_CATALOGS]:
+            del _worker_catalogs[old]
+    return catalog
+
+
+def _search_piece(generation, catalog_blob, domains, var, position, mode, n, deadline_at):
+    """Run one piece of a split search in a worker process.
+
+    `domains` hold indexes into the catalog of snapshot `generation`;
+    course `var` is fixed to its section at `position`. `catalog_blob` is
+    that catalog pickled, or None when the worker is expected to hold it
+    already. Returns (found, deadline reached) where found holds product
+    index keys in "first" mode and (days, key) pairs in "fewest" mode, so no
+    Section has to be sent back, or None if the catalog has to be sent.
+    """
+    catalog = _worker_catalog(generation, catalog_blob)
+    if catalog is None:
+        return None
+    sections = catalog.sections
+    problem = _Problem([[sections[index] for index in domain] for domain in domains])
+    problem.domains[var] = [entry for entry in problem.domains[var] if entry[0] == position]
+    deadline = Deadline(deadline_at)
+    if mode == "first":
+        found = [key for key, _ in problem.in_order(n, deadline=deadline)]
+    else:
+        found = [(days, key) for days, key, _ in problem.fewest_days(n, deadline=deadline)]
+    return found, deadline.reached
+
+
+class SearchPool:
+    """Routine searches split across a persistent pool of worker processes.
+
+    Routine generation is pure Python and holds the GIL, so one heavy
+    request would stall every other thread of the server. Here the search
+    tree is split by the sections of the most constrained course and the
+    pieces run in worker processes. Workers are started once with the
+    forkserver method (spawn where that is missing), so they do not
+    inherit the server's threads and locks, and live across snapshots:
+    pieces name their snapshot generation, and a worker that does not hold
+    that catalog yet asks for it, is sent it once and keeps it.
+
+    Each method mirrors the serial function of routinez.solver and returns
+    the same routines, or the best found by all workers together when the
+    shared `deadline` passes. Its time limit goes to every worker; its
+    cancel check is polled here, and pieces not started yet are dropped
+    when it fires while running ones stop at the time limit.
+    """
+
+    def __init__(self, workers=SEARCH_WORKERS):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._blob = None  # (generation, pickled catalog) last sent to the workers
+
+    @property
+    def available(self):
+        return self.workers > 0
+
+    def _executor_for(self):
+        with self._lock:
+            if self._executor is None:
+                methods = multiprocessing.get_all_start_methods()
+                method = "forkserver" if "forkserver" in methods else "spawn"
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(method),
+                )
+                debugprint(f"Started {self.workers} search workers ({method})")
+            return self._executor
+
+    def _catalog_blob(self, snapshot):
+        with self._lock:
+            if self._blob is None or self._blob[0] != snapshot.generation:
+                self._blob = (snapshot.generation, pickle.dumps(snapshot.catalog, pickle.HIGHEST_PROTOCOL))
+            return self._blob[1]
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _split(self, snapshot, domains, section_fits, combination_valid, collapse=True):
+        """The problem (collapsed if `collapse`) and the course to split on, or None if it cannot be sent."""
+        if not self.available:
+            return None
+        problem = _Problem(domains, section_fits=section_fits, combination_valid=combination_valid)
+        # is_valid_combination stays in this process, and workers only know catalog sections
+        if problem.combination_valid is not None or any(
+                section.catalog is not snapshot.catalog for domain in problem.domains for _, section in domain):
+            return None
+        if collapse:
+            problem = problem.collapsed()
+        branching = [var for var, domain in enumerate(problem.domains) if len(domain) > 1]
+        if not branching or any(not domain for domain in problem.domains):
+            return None
+        var = min(branching, key=lambda v: (len(problem.domains[v]), v))
+        return problem, var
+
+    def _run(self, snapshot, problem, var, mode, n, deadline):
+        """Fan the pieces out and return what every piece found, or None on failure."""
+        indexes = [[section.index for _, section in domain] for domain in problem.domains]
+        try:
+            executor = self._executor_for()
+
+            def submit(position, catalog_blob=None):
+                future = executor.submit(_search_piece, snapshot.generation, catalog_blob,
+                                         indexes, var, position, mode, n, deadline.at)
+                positions[future] = position
+                return future
+
+            positions = {}
+            pending = {submit(position) for position in range(len(indexes[var]))}
+            found = []
+            while pending:
+                done, pending = concurrent.futures.wait(pending, timeout=0.1)
+                for future in done:
+                    result = future.result()
+                    if result is None:
+                        # This worker has not seen the snapshot yet
+                        pending.add(submit(positions[future], self._catalog_blob(snapshot)))
+                        continue
+                    items, reached = result
+                    found.extend(items)
+                    deadline.reached = deadline.reached or reached
+                # Workers stop at the time limit themselves; the grace covers getting their results back
+                if pending and (deadline.cancelled is not None and deadline.cancelled()
+                                or deadline.at is not None and time.time() > deadline.at + 1.0):
+                    for future in pending:
+                        future.cancel()
+                    deadline.reached = True
+                    break
+            return found
+        except Exception as e:
+            debugprint(f"Parallel search failed, searching in-process: {e}")
+            self.shutdown()
+            return None
+
+    def _combinations(self, problem, keys):
+        return [tuple(problem.domains[var][position][1] for var, position in enumerate(key)) for key in keys]
+
+    def backtracking_search(self, snapshot, domains, section_fits, combination_valid, limit=1000, deadline=None):
+        """Parallel solver.backtracking_search(), or None to search in-process."""
+        split = self._split(snapshot, domains, section_fits, combination_valid, collapse=False)
+        if split is None:
+            return None
+        problem, var = split
+        deadline = deadline if deadline is not None else Deadline.after(ROUTINE_TIME_BUDGET_MS / 1000)
+        # Each piece returns its first routines in product order; together they hold the first overall
+        keys = self._run(snapshot, problem, var, "first", limit, deadline)
+        if keys is None:
+            return None
+        keys.sort()
+        debugprint(f"Parallel backtracking search found {min(len(keys), limit)} routines")
+        return self._combinations(problem, keys[:limit])
+
+    def fewest_days_search(self, snapshot, domains, section_fits, combination_valid, k=1, deadline=None):
+        """Parallel solver.fewest_days_search(), or None to search in-process."""
+        # With k > 1 routines that only differ in the section of a schedule class all count
+        split = self._split(snapshot, domains, section_fits, combination_valid, collapse=k == 1)
+        if split is None:
+            return None
+        problem, var = split
+        deadline = deadline if deadline is not None else Deadline.after(ROUTINE_TIME_BUDGET_MS / 1000)
+        found = self._run(snapshot, problem, var, "fewest", k, deadline)
+        if found is None:
+            return None
+        found.sort()
+        debugprint(f"Parallel fewest campus days: {found[0][0] if found else None}")
+        return self._combinations(problem, [key for _, key in found[:k]])
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from .config import ROUTINE_CACHE_SIZE
+from .utils import debugprint
+
+# Response header telling how /api/routine was answered: "HIT" from the cache, "SHARED" from
+# an identical request searched at the same time, "MISS" by its own search
+ROUTINE_CACHE_HEADER = "X-Routine-Cache"
+
+
+def routine_cache_key(request_data, k=None):
+    """A canonical digest of a routine request, or None if it must not be cached.
+
+    Returns (key, course codes). Both request formats of "courses" (codes or
+    objects with faculty filters) give the same key for the same request.
+    Course order is kept: it decides which of equally good routines is
+    picked and the order of the sections in the answer. Requests by section
+    name, for AI routines or with malformed courses are not cached.
+    """
+    if not isinstance(request_data, dict) or request_data.get("useAI") or "courses" not in request_data:
+        return None
+    courses = []
+    for course in request_data.get("courses") or []:
+        if isinstance(course, str):
+            course = {"course": course, "sections": {}}
+        if not isinstance(course, dict) or not isinstance(course.get("course"), str):
+            return None
+        courses.append({"course": course["course"], "sections": course.get("sections") or {}})
+    if not courses:
+        return None
+    canonical = {
+        "courses": courses,
+        "days": request_data.get("days", []),
+        "times": request_data.get("times", []),
+        "commutePreference": request_data.get("commutePreference", ""),
+        "engine": request_data.get("engine", "product"),
+        "k": k,
+    }
+    try:
+        text = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha256(text.encode()).hexdigest(), tuple(course["course"] for course in courses)
+
+
+class RoutineCache:
+    """Bounded LRU cache of /api/routine answers shared by every request.
+
+    Entries are keyed by routine_cache_key() and remember the
+    Catalog.course_version() of each requested course. A snapshot with new
+    seat counts or timetables for a course therefore only invalidates the
+    entries that involve it; the rest keep being served across snapshots.
+    Only complete answers should be stored, not ones cut short by a
+    deadline.
+    """
+
+    def __init__(self, capacity=ROUTINE_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = OrderedDict()  # key -> (course versions, body, status)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def get(self, key, catalog):
+        """The cached (body, status) for `key` if its courses are unchanged in `catalog`, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+        # Hashing a course's feed entries the first time it is asked for is slow; not under the lock
+        current = entry is not None and all(
+            catalog.course_version(course) == version for course, version in entry[0])
+        with self._lock:
+            if entry is not None and self._entries.get(key) is entry:
+                if current:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1], entry[2]
+                del self._entries[key]
+                self.invalidated += 1
+            elif current:
+                # Replaced or evicted meanwhile; the answer read is still valid
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+            return None
+
+    def put(self, key, catalog, courses, body, status):
+        if self.capacity <= 0:
+            return
+        versions = tuple((course, catalog.course_version(course)) for course in dict.fromkeys(courses))
+        with self._lock:
+            self._entries[key] = (versions, body, status)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        debugprint(f"Cached routine answer for {', '.join(courses)}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidated": self.invalidated,
+            }
+
+
+class _Flight:
+    __slots__ = ("done", "result", "ok")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.ok = False
+
+
+class SingleFlight:
+    """Let concurrent callers with the same key share one computation.
+
+    The first caller for a key runs `compute`; callers arriving while it
+    runs wait for it and get its result instead of starting their own, as
+    SnapshotManager does for feed refreshes. If the first caller fails,
+    each waiting caller computes on its own. A caller with a `deadline`
+    (a solver.Deadline) waits no longer than it allows; it then runs its
+    own `compute`, which finds the deadline passed and answers as such.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> _Flight of the running computation
+        self.coalesced = 0
+
+    def run(self, key, compute, deadline=None):
+        """Returns (result, shared) where shared is True if another caller computed it."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            debugprint("Waiting for an identical routine request in flight")
+            timeout = None
+            if deadline is not None and deadline.at is not None:
+                timeout = max(0.0, deadline.at - time.time())
+            if not flight.done.wait(timeout):
+                debugprint("Identical routine request still running at our deadline")
+                deadline.reached = True
+                return compute(), False
+            if flight.ok:
+                return flight.result, True
+            return compute(), False
+
+        try:
+            flight.result = compute()
+            flight.ok = True
+            return flight.result, False
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
@@ -4,16 +4,23 @@ import json
 
 from .config import DEBUG
 from .utils import debugprint
-from .data_loader import load_data
+from .data_loader import get_snapshots, load_data
+from .http_client import recent_timings
+from .snapshot import SNAPSHOT_AGE_HEADER
 from .ai_service import check_ai_availability, generate_ai_response
 from .exam_utils import ExamConflictChecker
 
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=[SNAPSHOT_AGE_HEADER])
 
-# Store data globally
-data = None
+@app.after_request
+def add_snapshot_age(response):
+    """Tell clients how old the course data behind this response is."""
+    age = get_snapshots().age()
+    if age is not None:
+        response.headers[SNAPSHOT_AGE_HEADER] = str(int(age))
+    return response
 
 @app.route('/api/connapi-status', methods=['GET'])
 def connapi_status():
@@ -25,7 +32,8 @@ def connapi_status():
         "status": "online",
         "ai_available": ai_available,
         "ai_message": ai_message,
-        "debug_mode": DEBUG
+        "debug_mode": DEBUG,
+        "upstream_timings": recent_timings(5)
     })
 
 @app.route('/api/test', methods=['GET'])
@@ -36,11 +44,8 @@ def test_endpoint():
 @app.route('/api/courses', methods=['GET'])
 def get_courses():
     """Get all courses data."""
-    global data
-    
-    # Load data if not already loaded
-    if data is None:
-        data = load_data()
+    # Served from the shared snapshot cache; only refetched once the TTL expires
+    data = load_data()
     
     # If data is still None after trying to load, return error
     if data is None:
@@ -51,14 +56,10 @@ def get_courses():
 @app.route('/api/check-conflicts', methods=['POST'])
 def check_conflicts():
     """Check for conflicts between selected course sections."""
-    global data
-    
-    # Load data if not already loaded
-    if data is None:
-        data = load_data()
+    snapshot = get_snapshots().get()
     
     # If data is still None after trying to load, return error
-    if data is None:
+    if snapshot is None:
         return jsonify({"error": "Failed to load course data"}), 500
     
     try:
@@ -68,8 +69,9 @@ def check_conflicts():
         if not selected_sections:
             return jsonify({"error": "No sections provided"}), 400
         
-        # Create conflict checker instance
-        conflict_checker = ExamConflictChecker(data)
+        # Create conflict checker instance; sections are looked up in the snapshot and compared with
+        # check_exam_conflicts (12-hour times, two-hour exams), not the routine engine's table
+        conflict_checker = ExamConflictChecker(snapshot.catalog)
         
         # Check for conflicts
         conflicts = conflict_checker.check_conflicts(selected_sections)
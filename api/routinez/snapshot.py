@@ -0,0 +1,322 @@
+import marshal
+import os
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+from .catalog import Catalog
+from .config import SNAPSHOT_TTL_SECONDS, SNAPSHOT_REFRESH_SECONDS, SNAPSHOT_CACHE_DIR
+from .utils import debugprint
+
+# Response header carrying the age (seconds) of the snapshot a request was served from
+SNAPSHOT_AGE_HEADER = "X-Snapshot-Age"
+# Response header carrying the generation of the snapshot a request was served from
+SNAPSHOT_GENERATION_HEADER = "X-Snapshot-Generation"
+
+# Returned by a fetch function when the upstream answered 304 Not Modified
+NOT_MODIFIED = object()
+
+
+_generation_lock = threading.Lock()
+_last_generation = 0
+
+
+def _next_generation():
+    """A process-wide, strictly increasing snapshot id.
+
+    Seeded from the clock (milliseconds) so ids handed out after a restart
+    do not repeat the ones clients may still hold from the previous process.
+    """
+    global _last_generation
+    with _generation_lock:
+        _last_generation = max(_last_generation + 1, time.time_ns() // 1_000_000)
+        return _last_generation
+
+
+class Snapshot:
+    """One parsed copy of the upstream schedule feed.
+
+    Snapshots are never modified once built: a refresh creates a new one and
+    the manager publishes it with a single reference swap, so a request that
+    holds a snapshot sees the same data (and generation) until it finishes.
+    Anything derived from a snapshot can be cached under its `generation`.
+    The section dicts in `data` are shared by every request and must be
+    copied, not edited, by code that wants to decorate them.
+    """
+
+    __slots__ = ("data", "fetched_at", "etag", "last_modified", "catalog", "generation")
+
+    def __init__(self, data, fetched_at=None, etag=None, last_modified=None):
+        setattr_ = object.__setattr__
+        setattr_(self, "data", data)
+        setattr_(self, "fetched_at", fetched_at if fetched_at is not None else time.time())
+        # HTTP validators from the response this snapshot was parsed from
+        setattr_(self, "etag", etag)
+        setattr_(self, "last_modified", last_modified)
+        # Compiled sections for the routine engine, built once per snapshot
+        setattr_(self, "catalog", Catalog(data))
+        setattr_(self, "generation", _next_generation())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshot is immutable; build a new one instead")
+
+    def age(self, now=None):
+        """Seconds since this snapshot was fetched from upstream."""
+        return max(0.0, (now if now is not None else time.time()) - self.fetched_at)
+
+    def conditional_headers(self):
+        """Request headers that let the upstream answer 304 if nothing changed."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+# On-disk format: magic line, then a zlib-compressed marshal dump. marshal is
+# compact and fast to load and, unlike pickle, cannot run code; its format is
+# tied to the interpreter version, so files from another Python are ignored.
+_DISK_MAGIC = f"RZSNAP1 py{sys.version_info[0]}.{sys.version_info[1]}\n".encode()
+
+
+def save_snapshot(snapshot, path, validated_at=None):
+    """Atomically write `snapshot` to `path` (temp file + rename)."""
+    payload = {
+        "data": snapshot.data,
+        "fetched_at": snapshot.fetched_at,
+        "validated_at": validated_at if validated_at is not None else snapshot.fetched_at,
+        "etag": snapshot.etag,
+        "last_modified": snapshot.last_modified,
+    }
+    blob = _DISK_MAGIC + zlib.compress(marshal.dumps(payload), 1)
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_snapshot(path):
+    """Read a snapshot written by save_snapshot().
+
+    Returns (snapshot, validated_at), or (None, None) if the file is missing,
+    from another Python version or unreadable.
+    """
+    try:
+        with open(path, "rb") as f:
+            blob = f.read()
+            modified = os.fstat(f.fileno()).st_mtime
+        if not blob.startswith(_DISK_MAGIC):
+            debugprint(f"Ignoring snapshot file {path}: unknown format")
+            return None, None
+        payload = marshal.loads(zlib.decompress(blob[len(_DISK_MAGIC):]))
+        snapshot = Snapshot(
+            payload["data"],
+            fetched_at=payload["fetched_at"],
+            etag=payload.get("etag"),
+            last_modified=payload.get("last_modified"),
+        )
+        # SnapshotManager touches the file when the upstream revalidates it (304)
+        return snapshot, max(payload.get("validated_at", snapshot.fetched_at), modified)
+    except FileNotFoundError:
+        return None, None
+    except Exception as e:
+        debugprint(f"Ignoring unreadable snapshot file {path}: {e}")
+        return None, None
+
+
+class SnapshotManager:
+    """Keep one snapshot of the course feed in memory and refresh it on a TTL.
+
+    `fetch` is called with the snapshot currently held (or None) and returns
+    a new Snapshot, NOT_MODIFIED when the upstream confirmed the current one
+    is still valid, or None when it could not be reached. A 304 keeps the
+    same Snapshot object, so nothing derived from it is rebuilt.
+
+    Only one fetch runs at a time: callers that arrive while a refresh is in
+    flight wait for it and share its result instead of starting their own.
+    After a failed refresh the old snapshot keeps being served for another
+    TTL before the next attempt.
+
+    With `start_background_refresh()` the fetches move to a daemon thread and
+    `get()` becomes stale-while-revalidate: it always returns the last good
+    snapshot immediately and only blocks when nothing has been loaded yet.
+
+    Every new snapshot is also written to `cache_dir` and read back when the
+    manager is created, so a restarted process serves the last known good
+    data straight away (and its validators usually turn the first refresh
+    into a 304). Pass cache_dir=None or "" to keep snapshots in memory only.
+    """
+
+    def __init__(self, fetch, ttl=SNAPSHOT_TTL_SECONDS, name="courses", cache_dir=SNAPSHOT_CACHE_DIR):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.name = name
+        self._snapshot = None
+        self._validated_at = None  # last time the upstream confirmed or replaced the snapshot
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._inflight = None  # threading.Event set when the running refresh finishes
+        self._refresher = None
+        self._stop = threading.Event()
+        self.cache_path = os.path.join(cache_dir, f"{name}.snapshot") if cache_dir else None
+        if self.cache_path:
+            self._load_persisted()
+
+    def _load_persisted(self):
+        started = time.time()
+        snapshot, validated_at = load_snapshot(self.cache_path)
+        if snapshot is None:
+            return
+        self._snapshot = snapshot
+        self._validated_at = validated_at
+        self._expires_at = validated_at + self.ttl
+        debugprint(
+            f"[{self.name}] Loaded {len(snapshot.data)} sections from {self.cache_path} "
+            f"in {(time.time() - started) * 1000:.0f}ms (aged {time.time() - validated_at:.0f}s)"
+        )
+
+    def _persist(self, snapshot):
+        if not self.cache_path:
+            return
+        try:
+            save_snapshot(snapshot, self.cache_path, validated_at=self._validated_at)
+        except Exception as e:
+            debugprint(f"[{self.name}] Could not write snapshot to {self.cache_path}: {e}")
+
+    def _touch_persisted(self):
+        # A 304 only moves validated_at, which load_snapshot() reads from the file's mtime
+        if not self.cache_path:
+            return
+        try:
+            os.utime(self.cache_path, (self._validated_at, self._validated_at))
+        except FileNotFoundError:
+            self._persist(self._snapshot)
+        except OSError as e:
+            debugprint(f"[{self.name}] Could not touch snapshot file {self.cache_path}: {e}")
+
+    @property
+    def snapshot(self):
+        """The current snapshot without triggering a refresh (may be None)."""
+        return self._snapshot
+
+    def is_fresh(self, now=None):
+        """True while the current snapshot is inside its TTL."""
+        now = now if now is not None else time.time()
+        return self._snapshot is not None and now < self._expires_at
+
+    @property
+    def background(self):
+        """True while the background refresher thread is running."""
+        return self._refresher is not None and self._refresher.is_alive()
+
+    def age(self):
+        """Seconds since the upstream last confirmed the current snapshot, or None."""
+        if self._snapshot is None or self._validated_at is None:
+            return None
+        return max(0.0, time.time() - self._validated_at)
+
+    def get(self):
+        """Return a snapshot no older than the TTL, refreshing it if needed.
+
+        If the refresh fails the previous snapshot is served as-is, so callers
+        only get None when nothing has ever been loaded. When the background
+        refresher is running the current snapshot is returned without waiting.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and (self.background or self.is_fresh()):
+            return snapshot
+        return self.refresh()
+
+    def refresh(self, force=False):
+        """Fetch a new snapshot, or wait for the fetch another thread started."""
+        with self._lock:
+            if not force and self.is_fresh():
+                return self._snapshot
+            inflight = self._inflight
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight = threading.Event()
+
+        if not leader:
+            debugprint(f"[{self.name}] Waiting for in-flight refresh")
+            inflight.wait()
+            return self._snapshot
+
+        result = None
+        try:
+            started = time.time()
+            result = self._fetch(self._snapshot)
+            if result is NOT_MODIFIED:
+                if self._snapshot is not None:
+                    self._validated_at = time.time()
+                    debugprint(f"[{self.name}] Snapshot still current (304) after {time.time() - started:.2f}s")
+                    self._touch_persisted()  # so a restart does not see the snapshot as stale
+                else:
+                    debugprint(f"[{self.name}] Upstream answered 304 with no snapshot to keep")
+                    result = None
+            elif result is not None:
+                self._snapshot = result  # the atomic publish: readers see the old or the new snapshot
+                self._validated_at = result.fetched_at
+                debugprint(f"[{self.name}] Refreshed snapshot with {len(result.data)} sections in {time.time() - started:.2f}s")
+                self._persist(result)
+        except Exception as e:
+            debugprint(f"[{self.name}] Error refreshing snapshot: {e}")
+        finally:
+            if result is None and self._snapshot is not None:
+                debugprint(f"[{self.name}] Refresh failed, serving snapshot aged {self._snapshot.age():.0f}s")
+            self._expires_at = time.time() + self.ttl
+            with self._lock:
+                self._inflight = None
+            inflight.set()
+        return self._snapshot
+
+    def start_background_refresh(self, interval=SNAPSHOT_REFRESH_SECONDS):
+        """Refetch the feed every `interval` seconds on a daemon thread.
+
+        Safe to call more than once; a running refresher is reused. An interval
+        of 0 or less leaves the manager in plain TTL mode.
+        """
+        if interval <= 0:
+            return None
+        with self._lock:
+            if self.background:
+                return self._refresher
+            self._stop.clear()
+            self._refresher = threading.Thread(
+                target=self._refresh_loop,
+                args=(interval,),
+                name=f"snapshot-refresh-{self.name}",
+                daemon=True,
+            )
+            self._refresher.start()
+        debugprint(f"[{self.name}] Background refresh every {interval}s")
+        return self._refresher
+
+    def stop_background_refresh(self):
+        """Ask the refresher thread to exit after its current fetch."""
+        self._stop.set()
+
+    def _refresh_loop(self, interval):
+        while not self._stop.is_set():
+            age = self.age()
+            if age is None or age >= interval:
+                self.refresh(force=True)
+                delay = interval
+            else:
+                # Already fresh (e.g. preloaded just before the thread started)
+                delay = interval - age
+            self._stop.wait(delay)
@@ -0,0 +1,654 @@
+import copy
+import heapq
+import itertools
+import time
+from collections import Counter
+
+from .catalog import DAY_NAMES, exam_conflict, time_conflict
+from .utils import debugprint
+
+# Why a search found no routine, in the order the routine pipeline reports them
+EXAM_CONFLICTS = "exam"
+TIME_CONFLICTS = "time"
+PREFERENCE_MISMATCH = "preference"
+
+
+class Deadline:
+    """When a search has to give up: a point in time and/or a cancel check.
+
+    Searches poll passed() as they go; once it returns True they stop and
+    return the best they have, and `reached` tells the caller that the
+    result may be incomplete. `cancelled` is a callable returning True when
+    the result is no longer wanted (e.g. waitress.client_disconnected); it
+    is only polled every CANCEL_CHECK_INTERVAL calls since it is slower
+    than reading the clock.
+    """
+
+    CANCEL_CHECK_INTERVAL = 256
+
+    def __init__(self, at=None, cancelled=None):
+        self.at = at  # time.time() value
+        self.cancelled = cancelled
+        self.reached = False
+        self._calls = 0
+
+    @classmethod
+    def after(cls, seconds, cancelled=None):
+        return cls(time.time() + seconds, cancelled)
+
+    def passed(self):
+        if not self.reached:
+            self._calls += 1
+            if self.at is not None and time.time() > self.at:
+                self.reached = True
+            elif (self.cancelled is not None and self._calls % self.CANCEL_CHECK_INTERVAL == 0
+                    and self.cancelled()):
+                self.reached = True
+        return self.reached
+
+
+def _class_key(section):
+    if section.schedule_class is not None:
+        return (id(section.catalog), section.schedule_class)
+    return section.schedule_key
+
+
+def _first_of_each_class(domain):
+    seen = set()
+    representatives = []
+    for entry in domain:
+        key = _class_key(entry[1])
+        if key not in seen:
+            seen.add(key)
+            representatives.append(entry)
+    return representatives
+
+
+class _Problem:
+    """The courses of one routine request as a constraint problem.
+
+    Each domain is the list of candidate Sections for one course. Two
+    sections of different courses must not have overlapping exams and, when
+    `times` is set, must not overlap in class or lab time. Sections failing
+    `section_fits` (the day/time preferences) are removed up front.
+
+    The time constraint follows is_valid_combination, which skips a section
+    when an earlier one in the combination has the same course and faculty.
+    That only matters when a course appears in more than one domain, so such
+    sections are not pruned on time; `combination_valid` checks the full
+    combination instead.
+    """
+
+    def __init__(self, domains, times=True, section_fits=None, combination_valid=None):
+        self.domains = [
+            [(index, section) for index, section in enumerate(domain)
+             if section.course is not None and (section_fits is None or section_fits(section))]
+            for domain in domains
+        ]
+        self.times = times
+        courses = Counter(course for domain in domains for course in {section.course for section in domain})
+        self.unique = {course for course, count in courses.items() if count == 1}
+        self.combination_valid = combination_valid if times and len(self.unique) < len(courses) else None
+        if times and len(domains) > 1:
+            # A section whose own meetings overlap can never be part of a valid routine
+            # (is_valid_combination lets a lone section through unchecked)
+            self.domains = [
+                [(index, section) for index, section in domain
+                 if not (section.internal_conflict and section.course in self.unique)]
+                for domain in self.domains
+            ]
+
+    def collapsed(self):
+        """This problem with one section per schedule class in each domain, or None.
+
+        Sections of a class conflict with exactly the same sections and fit
+        the same preferences, so a routine using one of them exists for
+        each of them; the first in domain order stands for the class. Not
+        possible when a course is in several domains, since
+        is_valid_combination then tells sections apart by faculty.
+        """
+        if self.combination_valid is not None:
+            return None
+        problem = copy.copy(self)
+        problem.domains = [_first_of_each_class(domain) for domain in self.domains]
+        return problem
+
+    def compatible(self, section1, section2):
+        # Sections of one snapshot are answered from its compatibility table
+        return not (
+            section1.course != section2.course and exam_conflict(section1, section2)
+            or self.times
+            and section1.course in self.unique
+            and section2.course in self.unique
+            and time_conflict(section1, section2)
+        )
+
+    def solve(self, limit, deadline=None):
+        """Up to `limit` solutions as (product index key, combination).
+
+        Variables are picked by smallest remaining domain (MRV) and every
+        assignment prunes the remaining domains (forward checking). Once
+        `deadline` (a Deadline) has passed the search returns what it
+        found so far.
+        """
+        solutions = []
+        if any(not domain for domain in self.domains):
+            return solutions
+        count = len(self.domains)
+        assignment = [None] * count
+
+        def search(remaining):
+            if deadline is not None and deadline.passed():
+                return True
+            if not remaining:
+                combination = tuple(section for _, section in assignment)
+                if self.combination_valid is None or self.combination_valid(combination):
+                    solutions.append((tuple(index for index, _ in assignment), combination))
+                return len(solutions) >= limit
+            var = min(remaining, key=lambda v: (len(remaining[v]), v))
+            candidates = remaining.pop(var)
+            for index, section in candidates:
+                pruned = {}
+                for other, options in remaining.items():
+                    options = [option for option in options if self.compatible(section, option[1])]
+                    if not options:
+                        break
+                    pruned[other] = options
+                else:
+                    assignment[var] = (index, section)
+                    if search(pruned):
+                        return True
+            return False
+
+        search({var: domain for var, domain in enumerate(self.domains)})
+        return solutions
+
+    def in_order(self, limit, deadline=None):
+        """The first `limit` solutions in itertools.product order, as (key, combination).
+
+        Courses are assigned in request order with forward checking. When
+        the sections of a schedule class are interchangeable (see
+        collapsed()), the routines below a section are only searched for
+        the first section of its class at that point; the others reuse
+        them with their own section swapped in. Past `deadline` the
+        solutions found so far are returned.
+        """
+        if any(not domain for domain in self.domains):
+            return []
+        count = len(self.domains)
+        shared = self.combination_valid is None
+        assignment = [None] * count
+
+        def search(var, remaining, wanted):
+            # Up to `wanted` completions of the assignment so far, as tuples of (index, section)
+            if deadline is not None and deadline.passed():
+                return []
+            if var == count:
+                if self.combination_valid is None or self.combination_valid(
+                        tuple(section for _, section in assignment)):
+                    return [()]
+                return []
+            found = []
+            searched = {}  # schedule class -> completions below its first section
+            for index, section in remaining.pop(var):
+                if len(found) >= wanted or deadline is not None and deadline.reached:
+                    break
+                key = _class_key(section) if shared else None
+                if key in searched:
+                    completions = searched[key]
+                else:
+                    completions = []
+                    pruned = {}
+                    for other, options in remaining.items():
+                        options = [option for option in options if self.compatible(section, option[1])]
+                        if not options:
+                            break
+                        pruned[other] = options
+                    else:
+                        assignment[var] = (index, section)
+                        completions = search(var + 1, pruned, wanted - len(found))
+                    if shared and not (deadline is not None and deadline.reached):
+                        # Fewer than asked for means all of them; later sections never ask for more
+                        searched[key] = completions
+                entry = (index, section)
+                found.extend((entry,) + rest for rest in completions[:wanted - len(found)])
+            return found
+
+        completions = search(0, {var: domain for var, domain in enumerate(self.domains)}, limit)
+        return [(tuple(index for index, _ in entries), tuple(section for _, section in entries))
+                for entries in completions]
+
+
+    def fewest_days(self, k=1, deadline=None, improved=None):
+        """The `k` routines meeting on the fewest days, best first.
+
+        Ties go to the earlier routine in itertools.product order. Branch
+        and bound over the union of the routine's day bitmasks: once k
+        routines are held, a partial routine is dropped as soon as its days,
+        plus the days every remaining course must add at the least, reach
+        the worst of them. Returns a list of (days, key, combination); past
+        `deadline` the best found so far. `improved`, if given, is called
+        with that list each time a routine joins it during the search.
+        """
+        if any(not domain for domain in self.domains):
+            return []
+        count = len(self.domains)
+        assignment = [None] * count
+        kept = []  # heap of (-days, -order, key, combination), worst on top
+        order = 0
+
+        def search(var, remaining, days):
+            nonlocal order
+            if deadline is not None and deadline.passed():
+                return
+            if var == count:
+                combination = tuple(section for _, section in assignment)
+                if (len(kept) < k or _popcount(days) < -kept[0][0]) and (
+                        self.combination_valid is None or self.combination_valid(combination)):
+                    order += 1
+                    entry = (-_popcount(days), -order, tuple(index for index, _ in assignment), combination)
+                    if len(kept) < k:
+                        heapq.heappush(kept, entry)
+                    else:
+                        heapq.heapreplace(kept, entry)
+                    if improved is not None:
+                        improved(best())
+                return
+            if len(kept) == k:
+                # Days the remaining courses add at the least, whichever sections they take
+                needed = max(min(_popcount(section.days & ~days) for _, section in options)
+                             for options in remaining.values())
+                if _popcount(days) + needed >= -kept[0][0]:
+                    return
+            for index, section in remaining.pop(var):
+                pruned = {}
+                for other, options in remaining.items():
+                    options = [option for option in options if self.compatible(section, option[1])]
+                    if not options:
+                        break
+                    pruned[other] = options
+                else:
+                    assignment[var] = (index, section)
+                    search(var + 1, pruned, days | section.days)
+
+        def best():
+            return [(-days, key, combination) for days, _, key, combination in sorted(kept, reverse=True)]
+
+        search(0, {var: domain for var, domain in enumerate(self.domains)}, 0)
+        return best()
+
+    def with_days(self, allowed, limit, start=None, deadline=None):
+        """Up to `limit` solutions meeting on a number of days in `allowed`.
+
+        Courses are assigned in request order, so solutions come out in
+        itertools.product order, from the first key at or past `start` (a
+        product index key or a prefix of one). A partial routine is dropped
+        once it meets on more days than allowed, or when all the sections
+        left could not add enough. Returns (solutions as (key, combination),
+        where the rest of the search starts or None if nothing is left);
+        past `deadline` the search stops and the rest starts there.
+        """
+        solutions = []
+        if any(not domain for domain in self.domains):
+            return solutions, None
+        start = tuple(start or ())
+        count = len(self.domains)
+        assignment = [None] * count
+        fewest, most = min(allowed), max(allowed)
+        rest = None
+
+        def search(var, remaining, days, resuming):
+            nonlocal rest
+            if deadline is not None and deadline.passed():
+                # Every routine before this partial one has been looked at
+                rest = start if resuming else tuple(index for index, _ in assignment[:var])
+                return True
+            if _popcount(days) > most:
+                return False
+            if var == count:
+                combination = tuple(section for _, section in assignment)
+                if _popcount(days) in allowed and (
+                        self.combination_valid is None or self.combination_valid(combination)):
+                    key = tuple(index for index, _ in assignment)
+                    solutions.append((key, combination))
+                    if len(solutions) >= limit:
+                        rest = key[:-1] + (key[-1] + 1,)
+                        return True
+                return False
+            reachable = days
+            for options in remaining.values():
+                for _, section in options:
+                    reachable |= section.days
+            if _popcount(reachable) < fewest:
+                return False
+            for index, section in remaining.pop(var):
+                if resuming and index < start[var]:
+                    continue
+                pruned = {}
+                for other, options in remaining.items():
+                    options = [option for option in options if self.compatible(section, option[1])]
+                    if not options:
+                        break
+                    pruned[other] = options
+                else:
+                    assignment[var] = (index, section)
+                    if search(var + 1, pruned, days | section.days,
+                              resuming and index == start[var] and var + 1 < len(start)):
+                        return True
+            return False
+
+        search(0, {var: domain for var, domain in enumerate(self.domains)}, 0, bool(start))
+        return solutions, rest
+
+
+def _popcount(mask):
+    return bin(mask).count("1")
+
+
+def arc_consistency(domains, section_fits):
+    """Remove the sections that cannot be part of any valid routine.
+
+    A section goes when it fails `section_fits` (the day/time preferences)
+    on its own, or when no remaining section of some other course is
+    compatible with it; removals are propagated (AC-3) until nothing
+    changes. Returns (reduced domains, emptied) where emptied is None, or
+    (course position, reason, other course position or None) for the first
+    course left without sections, reason being EXAM_CONFLICTS,
+    TIME_CONFLICTS or PREFERENCE_MISMATCH.
+    """
+    problem = _Problem(domains)
+    fitting = [[entry for entry in domain if section_fits(entry[1])] for domain in problem.domains]
+    emptied = None
+    for var, domain in enumerate(problem.domains):
+        if domain and not fitting[var] and emptied is None:
+            emptied = (var, PREFERENCE_MISMATCH, None)
+    # Sections of a schedule class stay or go together, so only the first of each is checked
+    reduced = [_first_of_each_class(domain) for domain in fitting]
+
+    count = len(reduced)
+    queue = [(var, other) for var in range(count) for other in range(count) if var != other]
+    queued = set(queue)
+    while queue and emptied is None:
+        var, other = queue.pop(0)
+        queued.discard((var, other))
+        supports = reduced[other]
+        kept = [entry for entry in reduced[var]
+                if any(problem.compatible(entry[1], support[1]) for support in supports)]
+        if len(kept) == len(reduced[var]):
+            continue
+        if not kept:
+            exam_only = _Problem(domains, times=False)
+            reason = TIME_CONFLICTS if any(
+                exam_only.compatible(entry[1], support[1])
+                for entry in reduced[var] for support in supports
+            ) else EXAM_CONFLICTS
+            emptied = (var, reason, other)
+        reduced[var] = kept
+        # Sections that relied on a removed one must be checked again
+        for neighbour in range(count):
+            if neighbour != var and neighbour != other and (neighbour, var) not in queued:
+                queue.append((neighbour, var))
+                queued.add((neighbour, var))
+
+    if emptied is not None:
+        debugprint(f"Arc consistency emptied course #{emptied[0] + 1}: {emptied[1]}")
+    kept = [{_class_key(section) for _, section in domain} for domain in reduced]
+    return [
+        [section for _, section in domain if _class_key(section) in kept[var]]
+        for var, domain in enumerate(fitting)
+    ], emptied
+
+
+def classify_failure(domains, combination_valid, deadline=None):
+    """Which stage of the product pipeline rejects every combination of `domains`.
+
+    Exam conflicts are checked on every combination first, then time
+    conflicts on the exam-compatible ones, then day/time preferences, so
+    the first stage that leaves nothing is the one reported. Returns None
+    if `deadline` passes before that is known.
+    """
+    exam_compatible = _Problem(domains, times=False).solve(1, deadline=deadline)
+    if deadline is not None and deadline.reached:
+        return None
+    if not exam_compatible:
+        return EXAM_CONFLICTS
+    time_compatible = _Problem(domains, combination_valid=combination_valid).solve(1, deadline=deadline)
+    if deadline is not None and deadline.reached:
+        return None
+    if not time_compatible:
+        return TIME_CONFLICTS
+    return PREFERENCE_MISMATCH
+
+
+def minimal_conflict(domains, section_fits, combination_valid, reason=None, deadline=None):
+    """A smallest set of courses of `domains` that cannot be taken together, and why.
+
+    The stages are those of classify_failure(): exam conflicts alone, then
+    time conflicts too, then the day/time preferences (`section_fits`)
+    too. `reason` is the first stage without any routine if already known,
+    else it is found here. The courses are then cut down to a set that
+    still has no routine at that stage while any one fewer would: single
+    courses and pairs are tried first, answered from the pairwise
+    compatibility table, and only otherwise are courses dropped one at a
+    time. Nothing is enumerated.
+
+    Returns (course positions, reason), or None when every stage has a
+    routine or `deadline` passes before the reason is known; if it passes
+    later, the set blocks but may not be the smallest.
+    """
+    stages = {
+        EXAM_CONFLICTS: lambda chosen: _Problem(chosen, times=False),
+        TIME_CONFLICTS: lambda chosen: _Problem(chosen, combination_valid=combination_valid),
+        PREFERENCE_MISMATCH: lambda chosen: _Problem(
+            chosen, section_fits=section_fits, combination_valid=combination_valid),
+    }
+
+    def has_routine(stage, courses):
+        return bool(stages[stage]([domains[var] for var in courses]).solve(1, deadline=deadline))
+
+    def out_of_time():
+        return deadline is not None and deadline.reached
+
+    everything = list(range(len(domains)))
+    if reason is None:
+        for stage in (EXAM_CONFLICTS, TIME_CONFLICTS, PREFERENCE_MISMATCH):
+            possible = has_routine(stage, everything)
+            if out_of_time():
+                return None
+            if not possible:
+                reason = stage
+                break
+        else:
+            return None
+
+    for size in (1, 2):
+        for courses in itertools.combinations(everything, size):
+            possible = has_routine(reason, courses)
+            if out_of_time():
+                return everything, reason
+            if not possible:
+                debugprint(f"Courses {courses} cannot be taken together: {reason}")
+                return list(courses), reason
+
+    blocking = everything
+    for var in everything:
+        rest = [other for other in blocking if other != var]
+        possible = has_routine(reason, rest)
+        if out_of_time():
+            break
+        if not possible:
+            blocking = rest
+    debugprint(f"Courses {blocking} cannot be taken together: {reason}")
+    return blocking, reason
+
+
+def fewest_days_search(domains, section_fits, combination_valid, k=1, deadline=None, improved=None):
+    """The `k` valid routines of `domains` with the fewest campus days.
+
+    Arguments are those of backtracking_search(). Every routine is
+    considered, so the result is the true minimum; ties go to the first
+    routine in itertools.product order, the one generate_routine's stable
+    sort by campus days would pick. When `deadline` passes first, the best
+    routines found by then are returned. `improved` is called with the
+    best routines so far each time they change.
+    """
+    problem = _Problem(domains, section_fits=section_fits, combination_valid=combination_valid)
+    if k == 1:
+        # The first section of a schedule class meets on the same days as the rest
+        problem = problem.collapsed() or problem
+    report = None
+    if improved is not None:
+        report = lambda best: improved([combination for _, _, combination in best])
+    found = problem.fewest_days(k, deadline=deadline, improved=report)
+    if found:
+        debugprint(f"Fewest campus days: {found[0][0]}")
+    return [combination for _, _, combination in found]
+
+
+def campus_days(combination):
+    """How many distinct days the sections of `combination` meet on."""
+    days = 0
+    for section in combination:
+        days |= section.days
+    return _popcount(days)
+
+
+def best_routines(combinations, commute_preference, k=1):
+    """The `k` best of `combinations` for a commute preference, best first.
+
+    "far"/"Live Far" prefers fewer campus days, "near"/"Live Near" more and
+    anything else the days halfway between the fewest and the most found.
+    The order is that of a stable sort of every combination, but only the
+    first k combinations of each day count (at most eight) are held, so
+    the combinations can be streamed in.
+    """
+    earliest = {}  # campus days -> first k (order, combination) with that many days
+    for order, combination in enumerate(combinations):
+        bucket = earliest.setdefault(campus_days(combination), [])
+        if len(bucket) < k:
+            bucket.append((order, combination))
+    if not earliest:
+        return []
+    if commute_preference == "far" or commute_preference == "Live Far":
+        rank = lambda days: days
+    elif commute_preference == "near" or commute_preference == "Live Near":
+        rank = lambda days: -days
+    else:
+        target = (min(earliest) + max(earliest)) // 2
+        rank = lambda days: abs(days - target)
+    candidates = ((rank(days), order, combination)
+                  for days, bucket in earliest.items() for order, combination in bucket)
+    return [combination for _, _, combination in heapq.nsmallest(k, candidates, key=lambda c: c[:2])]
+
+
+class RoutineRanking:
+    """best_routines() of the combinations seen so far, for a search that streams them out.
+
+    add() takes the combinations in the order they are found; `best` is
+    what best_routines() would return for all of them. Only combinations
+    best_routines() would hold are kept (the first k of each day count),
+    so `best` is recomputed at most a few times however many are added.
+    """
+
+    def __init__(self, commute_preference, k=1):
+        self.commute_preference = commute_preference
+        self.k = k
+        self.seen = 0
+        self.best = []
+        self._held = []  # first k combinations of each day count, in the order they were added
+        self._counts = Counter()  # campus days -> combinations held with that many days
+
+    def add(self, combination):
+        """Rank one more combination; True if it changed the best routines."""
+        self.seen += 1
+        days = campus_days(combination)
+        if self._counts[days] >= self.k:
+            return False
+        self._counts[days] += 1
+        self._held.append(combination)
+        best = best_routines(self._held, self.commute_preference, self.k)
+        changed = best != self.best
+        self.best = best
+        return changed
+
+
+def _day_tiers(commute_preference, target):
+    """The numbers of campus days in best_routines() rank order, equal ranks grouped together."""
+    counts = range(len(DAY_NAMES) + 1)
+    if commute_preference == "far" or commute_preference == "Live Far":
+        return [{days} for days in counts]
+    if commute_preference == "near" or commute_preference == "Live Near":
+        return [{days} for days in reversed(counts)]
+    tiers = [{days for days in (target - distance, target + distance) if days in counts} for distance in counts]
+    return [tier for tier in tiers if tier]
+
+
+def routine_page(domains, section_fits, combination_valid, commute_preference, size, position=None, deadline=None):
+    """One page of all the valid routines of `domains`, best first.
+
+    Arguments are those of backtracking_search(). Routines come in the
+    order best_routines() would rank every one of them: by campus days for
+    the commute preference, then in itertools.product order. They are
+    searched one rank of campus days at a time, so a page only costs the
+    search up to its last routine. `position` is where the previous page
+    stopped (None for the first). Returns (routines, position of the next
+    page or None after the last); past `deadline` the page may be short,
+    and its position carries on where the search stopped.
+    """
+    problem = _Problem(domains, section_fits=section_fits, combination_valid=combination_valid)
+    fewest, most, tier, start = position or (None, None, 0, None)
+    target = None
+    if commute_preference not in ("far", "Live Far", "near", "Live Near"):
+        # The balanced preference aims halfway between the fewest and the most days of any
+        # routine; look for one routine with each number of days, upwards then downwards
+        counts = len(DAY_NAMES) + 1
+        while most is None:
+            days = tier if fewest is None else counts - 1 - tier
+            found, rest = problem.with_days({days}, 1, start, deadline)
+            if found:
+                if fewest is None:
+                    fewest = days
+                else:
+                    most = days
+                tier, start = 0, None
+            elif rest is not None:
+                return [], (fewest, most, tier, rest)
+            else:
+                tier, start = tier + 1, None
+                if tier == counts:
+                    return [], None
+        target = (fewest + most) // 2
+
+    tiers = _day_tiers(commute_preference, target)
+    routines = []
+    while tier < len(tiers):
+        found, rest = problem.with_days(tiers[tier], size - len(routines), start, deadline)
+        routines.extend(combination for _, combination in found)
+        if rest is not None:
+            return routines, (fewest, most, tier, rest)
+        tier, start = tier + 1, None
+    return routines, None
+
+
+def backtracking_search(domains, section_fits, combination_valid, limit=1000, deadline=None):
+    """Find the routines the product pipeline of generate_routine would keep.
+
+    `domains` are the candidate Sections per course, `section_fits` the
+    day/time preference check for one section and `combination_valid` the
+    full time-conflict check (is_valid_combination). Returns the first
+    `limit` valid combinations in itertools.product order; when there are
+    none, classify_failure() tells which check rejected them. When
+    `deadline` passes first, the routines found by then are returned.
+
+    Courses are assigned in request order, not smallest domain first
+    (MRV): the first `limit` routines in product order can only be found
+    without listing all of them by searching in that order. Forward
+    checking still drops a partial routine as soon as some later course
+    has no compatible section left. MRV is used by _Problem.solve(),
+    which only needs to know whether a routine exists (classify_failure,
+    minimal_conflict).
+    """
+    problem = _Problem(domains, section_fits=section_fits, combination_valid=combination_valid)
+    solutions = problem.in_order(limit, deadline=deadline)
+    debugprint(f"Backtracking search found {len(solutions)} routines")
+    return [combination for _, combination in solutions]
@@ -6,11 +6,20 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from routinez.config import DEBUG, DATA_URL
 from routinez.utils import debugprint
-from routinez.data_loader import load_data
+from routinez.data_loader import load_data, fetch_feed
 from routinez.time_utils import TimeUtils
-from routinez.exam_utils import ExamConflictChecker
+from routinez.exam_utils import ExamConflictChecker, check_exam_conflicts
 from routinez.ai_service import check_ai_availability
 from routinez.main import create_app
+from routinez.http_client import recent_timings
+from routinez.feed_parser import iter_sections
+from routinez.catalog import Catalog, Section, DAY_INDEX, mask_days, exam_conflict, time_conflict, combine_occupancy
+from routinez.snapshot import Snapshot, SnapshotManager, NOT_MODIFIED
+from routinez.parallel import SearchPool
+from routinez.result_cache import RoutineCache, SingleFlight, routine_cache_key
+from routinez.pagination import Cursor, decode_cursor, encode_cursor, request_digest
+import usisvercel
+from routinez.solver import Deadline, RoutineRanking, arc_consistency, backtracking_search, classify_failure, fewest_days_search, best_routines, minimal_conflict, routine_page, EXAM_CONFLICTS, TIME_CONFLICTS, PREFERENCE_MISMATCH
 
 def test_imports():
     """Test that all modules can be imported correctly."""
@@ -37,6 +46,1036 @@ def test_data_loader():
         print("✗ Failed to load data")
         return False
 
+def test_snapshot_single_flight():
+    """Test that concurrent callers share one upstream fetch."""
+    import threading
+    import time
+    print("\n=== Testing Snapshot Single-Flight ===")
+    calls = []
+
+    def slow_fetch(previous):
+        calls.append(1)
+        time.sleep(0.2)
+        return Snapshot([{"courseCode": "CSE110"}])
+
+    manager = SnapshotManager(slow_fetch, ttl=60, name="test", cache_dir=None)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(manager.get())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1, f"expected one fetch, got {len(calls)}"
+    assert all(result is results[0] for result in results)
+    assert manager.get() is results[0]  # still inside the TTL, no refetch
+    assert len(calls) == 1
+    print("✓ 8 concurrent callers shared a single fetch")
+    return True
+
+def test_snapshot_background_refresh():
+    """Test that a running refresher serves the last snapshot without waiting."""
+    import time
+    print("\n=== Testing Snapshot Background Refresh ===")
+    delays = [0, 0.5]
+
+    def fetch(previous):
+        time.sleep(delays[0])
+        return Snapshot([{"courseCode": "CSE110"}])
+
+    manager = SnapshotManager(fetch, ttl=0.01, name="test", cache_dir=None)
+    manager.start_background_refresh(interval=0.05)
+    first = manager.get()  # blocks only until the first fetch lands
+    delays[0] = delays[1]  # every later upstream fetch is slow
+    time.sleep(0.1)
+    started = time.time()
+    served = manager.get()
+    elapsed = time.time() - started
+    manager.stop_background_refresh()
+
+    assert first is not None and served is not None
+    assert elapsed < 0.1, f"get() waited {elapsed:.2f}s on the upstream"
+    assert manager.age() is not None
+    print(f"✓ Stale snapshot served in {elapsed * 1000:.1f}ms while refreshing")
+    return True
+
+def test_conditional_fetch():
+    """Test that an unchanged feed is answered with 304 and the snapshot is reused."""
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    print("\n=== Testing Conditional Fetch ===")
+    body = json.dumps({"data": [{"courseCode": "CSE110", "sectionName": "1"}]}).encode()
+    hits = {"200": 0, "304": 0}
+
+    class FeedHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.headers.get("If-None-Match") == '"v1"':
+                hits["304"] += 1
+                self.send_response(304)
+                self.end_headers()
+                return
+            hits["200"] += 1
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("ETag", '"v1"')
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), FeedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/feed"
+    try:
+        manager = SnapshotManager(lambda previous: fetch_feed(url, previous), ttl=0, name="test", cache_dir=None)
+        first = manager.refresh(force=True)
+        assert first is not None and first.etag == '"v1"'
+        assert fetch_feed(url, first) is NOT_MODIFIED
+        second = manager.refresh(force=True)
+        assert second is first, "a 304 must keep the already-parsed snapshot"
+        assert hits == {"200": 1, "304": 2}
+        timings = [t for t in recent_timings() if t["url"] == url]
+        assert timings and timings[0]["bytes"] == len(body) and timings[-1]["status"] == 304
+    finally:
+        server.shutdown()
+    print("✓ 304 reused the parsed snapshot")
+    return True
+
+def test_snapshot_persistence():
+    """Test that a new manager starts from the snapshot saved on disk."""
+    import tempfile
+    import time
+    print("\n=== Testing Snapshot Persistence ===")
+    sections = [{"courseCode": "CSE110", "sectionName": "1", "capacity": 40}]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        writer = SnapshotManager(lambda previous: Snapshot(sections, etag='"v1"'), ttl=60, name="test", cache_dir=cache_dir)
+        writer.refresh(force=True)
+        assert os.listdir(cache_dir) == ["test.snapshot"], "temp file left behind"
+
+        calls = []
+        started = time.time()
+        reader = SnapshotManager(lambda previous: calls.append(previous), ttl=60, name="test", cache_dir=cache_dir)
+        served = reader.get()
+        elapsed = time.time() - started
+        assert not calls, "a fresh persisted snapshot must not be refetched"
+        assert served.data == sections and served.etag == '"v1"'
+
+        # A 304 revalidation is written back, so the next process starts fresh too
+        writer._expires_at = 0.0
+        writer._fetch = lambda previous: NOT_MODIFIED
+        before = writer._validated_at
+        with open(writer.cache_path, "rb") as f:
+            saved = f.read()
+        time.sleep(0.01)
+        writer.refresh(force=True)
+        restarted = SnapshotManager(lambda previous: None, ttl=60, name="test", cache_dir=cache_dir)
+        assert restarted._validated_at > before, "a 304 must persist its validation time"
+        with open(writer.cache_path, "rb") as f:
+            assert f.read() == saved, "a 304 must not rewrite the saved feed"
+
+        # A 304 with nothing held is a failed fetch, not an empty snapshot
+        empty = SnapshotManager(lambda previous: NOT_MODIFIED, ttl=60, name="test", cache_dir=None)
+        assert empty.refresh(force=True) is None
+
+        with open(reader.cache_path, "wb") as f:
+            f.write(b"garbage")
+        assert SnapshotManager(lambda previous: None, name="test", cache_dir=cache_dir).snapshot is None
+    print(f"✓ Snapshot loaded from disk in {elapsed * 1000:.1f}ms")
+    return True
+
+def test_snapshot_generations():
+    """Test that snapshots are immutable and each refresh publishes a new generation."""
+    print("\n=== Testing Snapshot Generations ===")
+    responses = [Snapshot([{"courseCode": "CSE110"}]), NOT_MODIFIED, Snapshot([{"courseCode": "CSE111"}])]
+    manager = SnapshotManager(lambda previous: responses.pop(0), ttl=60, name="test", cache_dir=None)
+    first = manager.refresh(force=True)
+    assert manager.refresh(force=True) is first, "a 304 must keep the same snapshot"
+    second = manager.refresh(force=True)
+    assert second.generation > first.generation
+    assert first.data[0]["courseCode"] == "CSE110", "a held snapshot must not change under a refresh"
+    try:
+        first.data = []
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("snapshot attributes must be read-only")
+    print(f"✓ Generations {first.generation} -> {second.generation}")
+    return True
+
+def test_streaming_feed_parser():
+    """Test that the feed is parsed section by section from arbitrary chunks."""
+    import json
+    print("\n=== Testing Streaming Feed Parser ===")
+    sections = [
+        {"courseCode": "CSE110", "sectionName": str(i), "faculties": "ABC", "roomName": "UB3010 – Lab", "capacity": 40 + i}
+        for i in range(25)
+    ]
+    for feed in ({"meta": {"count": [1, 2.5]}, "data": sections}, sections):
+        body = json.dumps(feed, ensure_ascii=False, indent=1).encode()
+        for size in (1, 7, 4096):
+            chunks = (body[i:i + size] for i in range(0, len(body), size))
+            parsed = list(iter_sections(chunks))
+            assert parsed == sections, f"mismatch with {size}-byte chunks"
+    assert parsed[0]["courseCode"] is parsed[1]["courseCode"], "repeated strings should be shared"
+    for bad in (b'{"other": []}', b'"text"', b'[{"a": 1} {"b": 2}]'):
+        try:
+            list(iter_sections([bad]))
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad!r} should be rejected")
+    print("✓ Sections parsed identically from 1-byte to 4 KB chunks")
+    return True
+
+def test_section_catalog():
+    """Test that feed sections compile to the engine's Section model."""
+    print("\n=== Testing Section Catalog ===")
+    raw = {
+        "courseCode": "CSE110", "sectionName": "1", "sectionId": 7, "faculties": "ABC",
+        "capacity": 40, "consumedSeat": 38,
+        "sectionSchedule": {
+            "classSchedules": [
+                {"day": "SUNDAY", "startTime": "08:00:00", "endTime": "09:20:00"},
+                {"day": "Tuesday", "startTime": "08:00:00", "endTime": "09:20:00"},
+            ],
+            "midExamDate": "2025-03-01", "midExamStartTime": "09:00:00", "midExamEndTime": "",
+        },
+        "labSchedules": {"classSchedules": [{"day": "MONDAY", "startTime": "14:00:00", "endTime": "16:50:00"}]},
+    }
+    section = Catalog([raw, "not a section"]).sections[-1]
+    assert section.raw is raw and section.index == 0
+    assert section.course == "CSE110" and section.free_seats == 2
+    assert section.class_meetings[1] == (DAY_INDEX["TUESDAY"], 480, 560, True)
+    assert section.lab_meetings == ((DAY_INDEX["MONDAY"], 840, 1010, True),)
+    assert mask_days(section.days) == ["MONDAY", "SUNDAY", "TUESDAY"]
+    assert section.mid_exam[1:] == (540, None) and section.final_exam is None
+    assert section.intervals == tuple(sorted(m[:3] for m in section.class_meetings + section.lab_meetings))
+    assert not section.internal_conflict and section.lab_schedules[0]["room"] == "TBA"
+
+    other = Section(dict(raw, courseCode="MAT110", sectionId=8, sectionSchedule={
+        "midExamDate": "01-03-2025", "midExamStartTime": "10:00:00", "midExamEndTime": "12:00:00"}))
+    assert exam_conflict(section, other), "same date, two-hour default overlaps 10:00"
+    assert not exam_conflict(section, Section(dict(raw, courseCode="MAT110")))  # same sectionId
+    assert time_conflict(section, other) and not time_conflict(section, Section({"sectionSchedule": {
+        "classSchedules": [{"day": "SUNDAY", "startTime": "09:20:00", "endTime": "10:50:00"}]}}))
+    catalog = Catalog([raw, dict(raw, sectionName="2", sectionId=9), dict(raw, courseCode="MAT110", sectionId=10)])
+    assert [s.name for s in catalog.course_sections("CSE110")] == ["1", "2"]
+    assert catalog.by_id[9].name == "2" and catalog.section_by_name("MAT110", 1).section_id == 10
+    assert len(catalog.by_faculty["ABC"]) == 3 and catalog.course_sections("CSE999") == ()
+    assert catalog.find_section("2").section_id == 9 and catalog.find_section(10).course == "MAT110"
+    print("✓ Sections compiled with day indexes, minutes, exam ordinals and indexes")
+    return True
+
+def test_compatibility_table():
+    """Test that the per-snapshot compatibility bitsets agree with direct comparisons."""
+    import random
+    print("\n=== Testing Compatibility Table ===")
+    rnd = random.Random(3)
+    data = []
+    for sid in range(80):
+        start = rnd.choice(["08:00:00", "09:30:00", "11:00:00", "11:05:00"])
+        data.append({
+            "courseCode": f"C{sid % 9}", "sectionId": sid, "sectionName": str(sid),
+            "sectionSchedule": {
+                "classSchedules": [{"day": rnd.choice(["SUNDAY", "MONDAY"]), "startTime": start, "endTime": "10:50:00"}],
+                "midExamDate": rnd.choice(["2025-03-01", "2025-03-02"]),
+                "midExamStartTime": rnd.choice(["09:00:00", "11:00:00"]), "midExamEndTime": rnd.choice(["", "12:30:00"]),
+            },
+        })
+    catalog = Catalog(data)
+    for a in catalog.sections:
+        for b in catalog.sections:
+            standalone_a, standalone_b = Section(a.raw), Section(b.raw)
+            assert time_conflict(a, b) == time_conflict(standalone_a, standalone_b)
+            assert exam_conflict(a, b) == exam_conflict(standalone_a, standalone_b)
+
+    checker = ExamConflictChecker(catalog)
+    picked = [data[0], data[1], 2]
+    conflicts = checker.check_conflicts(picked)
+    expected = check_exam_conflicts(data[0], data[1]) + check_exam_conflicts(data[0], data[2]) \
+        + check_exam_conflicts(data[1], data[2])
+    assert conflicts == expected and all(c["type1"] == "Mid" for c in conflicts)
+
+    # The endpoint keeps reading 12-hour exam times and a fixed two-hour length
+    twelve_hour = [
+        {"courseCode": "CSE110", "sectionId": 1, "sectionSchedule": {
+            "midExamDate": "2025-03-01", "midExamStartTime": "2:00 PM", "midExamEndTime": "3:00 PM"}},
+        {"courseCode": "MAT110", "sectionId": 2, "sectionSchedule": {
+            "midExamDate": "2025-03-01", "midExamStartTime": "3:30 PM", "midExamEndTime": "4:30 PM"}},
+    ]
+    assert len(ExamConflictChecker(Catalog(twelve_hour)).check_conflicts(twelve_hour)) == 1
+    print(f"✓ {len(catalog) ** 2} pairs match, {len(conflicts)} exam conflicts reported")
+    return True
+
+def test_occupancy_masks():
+    """Test that occupancy masks find exactly the overlaps the interval checks do."""
+    import random
+    print("\n=== Testing Occupancy Masks ===")
+    rnd = random.Random(11)
+    times = ["08:00:00", "08:03:00", "09:20:00", "09:30:00", "10:50:00", "11:00:00", "12:20:00", "23:55:00"]
+
+    def random_section():
+        schedules = [{"day": rnd.choice(["SUNDAY", "MONDAY", "TUESDAY"]),
+                      "startTime": rnd.choice(times), "endTime": rnd.choice(times)}
+                     for _ in range(rnd.randint(1, 3))]
+        return Section({"sectionSchedule": {"classSchedules": schedules}})
+
+    def overlaps(s1, s2):
+        return any(d1 == d2 and a1 < b2 and a2 < b1
+                   for d1, a1, b1 in s1.intervals for d2, a2, b2 in s2.intervals)
+
+    sections = [random_section() for _ in range(60)]
+    assert any(s.occupancy_exact for s in sections) and not all(s.occupancy_exact for s in sections)
+    for s1 in sections:
+        for s2 in sections:
+            assert time_conflict(s1, s2) == overlaps(s1, s2), (s1.intervals, s2.intervals)
+    for _ in range(200):
+        group = rnd.sample(sections, 3)
+        expected = not any(s.internal_conflict for s in group) and not any(
+            overlaps(a, b) for i, a in enumerate(group) for b in group[i + 1:])
+        assert (combine_occupancy(group) is not None) == expected
+    print("✓ Masks agree with interval overlap checks")
+    return True
+
+def test_backtracking_search():
+    """Test that arc consistency and the backtracking search keep what a full product scan keeps."""
+    import itertools
+    import random
+    print("\n=== Testing Backtracking Search ===")
+    rnd = random.Random(5)
+    starts = ["08:00:00", "09:30:00", "11:00:00"]
+
+    def section(course, sid):
+        start = rnd.choice(starts)
+        end = f"{int(start[:2]) + 1:02d}:20:00"
+        return Section({
+            "courseCode": course, "sectionId": sid, "sectionName": str(sid),
+            "sectionSchedule": {
+                "classSchedules": [{"day": rnd.choice(["SUNDAY", "MONDAY"]), "startTime": start, "endTime": end}],
+                "finalExamDate": rnd.choice(["2025-05-01", "2025-05-02"]), "finalExamStartTime": rnd.choice(["09:00:00", "14:00:00", "18:00:00"]),
+                "finalExamEndTime": "",
+            },
+        })
+
+    def pairwise_ok(combination):
+        return not any(exam_conflict(a, b) or time_conflict(a, b)
+                       for i, a in enumerate(combination) for b in combination[i + 1:])
+
+    reasons = set()
+    for trial in range(40):
+        domains = [[section(f"C{c}", c * 10 + k) for k in range(rnd.randint(1, 4))] for c in range(4)]
+        blocked = {rnd.randrange(40) for _ in range(rnd.randint(0, 12))}
+        fits = lambda s: s.section_id not in blocked
+        expected = [c for c in itertools.product(*domains) if pairwise_ok(c) and all(fits(s) for s in c)]
+        found = backtracking_search(domains, fits, pairwise_ok, limit=5)
+        assert found == expected[:5], trial
+        reduced, emptied = arc_consistency(domains, fits)
+        assert all(set(combination) <= {s for domain in reduced for s in domain} for combination in expected)
+        assert sum(map(len, reduced)) <= sum(map(len, domains)) and (emptied is None or not expected)
+        assert backtracking_search(reduced, fits, pairwise_ok, limit=5) == found
+        reasons.add(classify_failure(domains, pairwise_ok) if not expected else None)
+        assert classify_failure(domains, pairwise_ok, Deadline(0)) is None
+        cancelled = Deadline(cancelled=lambda: True)
+        partial = backtracking_search(domains, fits, pairwise_ok, limit=5, deadline=cancelled)
+        assert set(partial) <= set(expected) and (cancelled.reached or partial == expected[:5])
+    assert reasons >= {None, EXAM_CONFLICTS} and reasons & {TIME_CONFLICTS, PREFERENCE_MISMATCH}
+    print(f"✓ Matched the product scan, failure reasons seen: {sorted(map(str, reasons))}")
+    return True
+
+def test_schedule_classes():
+    """Test that sections sharing a timetable and exams are searched as one class."""
+    import itertools
+    import random
+    print("\n=== Testing Schedule Classes ===")
+    rnd = random.Random(8)
+    data = []
+    for c in range(3):
+        for k in range(6):
+            start = rnd.choice(["08:00:00", "09:30:00"])
+            data.append({
+                "courseCode": f"C{c}", "sectionId": c * 10 + k, "sectionName": str(k + 1),
+                "faculties": rnd.choice(["ABC", "DEF"]), "capacity": 40, "consumedSeat": rnd.choice([10, 25, 40]),
+                "sectionSchedule": {
+                    "classSchedules": [{"day": ["SUNDAY", "MONDAY", "SUNDAY"][c], "startTime": start, "endTime": "09:20:00" if start < "09" else "10:50:00"}],
+                    "finalExamDate": "2025-05-01", "finalExamStartTime": rnd.choice([["09:00:00", "14:00:00"], ["14:00:00", "18:00:00"], ["09:00:00", "18:00:00"]][c]),
+                },
+            })
+    catalog = Catalog(data)
+    assert catalog.schedule_classes < len(catalog)
+    for a in catalog.sections:
+        for b in catalog.sections:
+            assert (a.schedule_class == b.schedule_class) == (a.schedule_key == b.schedule_key)
+
+    def pairwise_ok(combination):
+        return not any(exam_conflict(a, b) or time_conflict(a, b)
+                       for i, a in enumerate(combination) for b in combination[i + 1:])
+
+    domains = [[s for s in catalog.sections if s.course == f"C{c}"] for c in range(3)]
+    has_seats = lambda s: s.raw["consumedSeat"] < s.raw["capacity"]
+    expected = [c for c in itertools.product(*domains) if pairwise_ok(c) and all(map(has_seats, c))]
+    found = backtracking_search(domains, has_seats, pairwise_ok)
+    assert expected and found == expected, "sections sharing a class must each appear, in product order"
+    assert backtracking_search(domains, has_seats, pairwise_ok, limit=7) == expected[:7]
+    reduced, _ = arc_consistency(domains, has_seats)
+    assert {s for c in expected for s in c} <= {s for domain in reduced for s in domain}
+    print(f"✓ {len(catalog)} sections in {catalog.schedule_classes} classes, all {len(found)} routines found")
+    return True
+
+def test_fewest_days_search():
+    """Test that the fewest-days search, best_routines() and RoutineRanking order routines like a full sort does."""
+    import itertools
+    import random
+    print("\n=== Testing Fewest Days Search ===")
+    rnd = random.Random(16)
+    days = ["SUNDAY", "MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "SATURDAY"]
+
+    def section(course, sid):
+        start = rnd.choice(["08:00:00", "09:30:00", "11:00:00"])
+        return Section({
+            "courseCode": course, "sectionId": sid, "sectionName": str(sid),
+            "sectionSchedule": {
+                "classSchedules": [{"day": day, "startTime": start, "endTime": f"{int(start[:2]) + 1:02d}:20:00"}
+                                   for day in rnd.sample(days, 2)],
+                "finalExamDate": "2025-05-01", "finalExamStartTime": f"{8 + 3 * int(course[1:]):02d}:00:00",
+            },
+        })
+
+    def pairwise_ok(combination):
+        return not any(exam_conflict(a, b) or time_conflict(a, b)
+                       for i, a in enumerate(combination) for b in combination[i + 1:])
+
+    def day_count(combination):
+        union = 0
+        for s in combination:
+            union |= s.days
+        return bin(union).count("1")
+
+    for trial in range(30):
+        domains = []
+        for c in range(4):
+            domains.append([section(f"C{c}", c * 10 + k) for k in range(rnd.randint(1, 6))])
+        fits = lambda s: s.section_id % 7 != trial % 7
+        expected = [c for c in itertools.product(*domains) if pairwise_ok(c) and all(fits(s) for s in c)]
+        expected.sort(key=day_count)
+        assert fewest_days_search(domains, fits, pairwise_ok) == expected[:1], trial
+        assert fewest_days_search(domains, fits, pairwise_ok, k=4) == expected[:4], trial
+        improvements = []
+        fewest_days_search(domains, fits, pairwise_ok, improved=improvements.append)
+        assert [day_count(best[0]) for best in improvements] == sorted((day_count(best[0]) for best in improvements), reverse=True)
+        assert (improvements[-1] if improvements else []) == expected[:1], trial
+        assert best_routines(expected, "far", k=4) == expected[:4]
+        assert best_routines(expected[::-1], "Live Near", k=2) == sorted(expected[::-1], key=lambda c: -day_count(c))[:2]
+        if expected:
+            target = (day_count(expected[0]) + day_count(expected[-1])) // 2
+            balanced = sorted(expected, key=lambda c: abs(day_count(c) - target))
+            assert best_routines(expected, "", k=3) == balanced[:3]
+        for preference in ("far", "near", ""):
+            ranking = RoutineRanking(preference, k=2)
+            for i, combination in enumerate(expected):
+                ranking.add(combination)
+                if i == len(expected) // 2:
+                    assert ranking.best == best_routines(expected[:i + 1], preference, k=2), trial
+            assert ranking.best == best_routines(expected, preference, k=2) and ranking.seen == len(expected), trial
+    print("✓ Found the fewest campus days and the top routines in every trial, streamed or not")
+    return True
+
+def test_routine_pages():
+    """Test that routine pages list every valid routine in best_routines() order, across deadlines too."""
+    import base64
+    import itertools
+    import json
+    import random
+    print("\n=== Testing Routine Pages ===")
+    rnd = random.Random(24)
+    days = ["SUNDAY", "MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "SATURDAY"]
+
+    def section(course, sid):
+        start = rnd.choice(["08:00:00", "09:30:00", "11:00:00"])
+        return Section({
+            "courseCode": course, "sectionId": sid, "sectionName": str(sid),
+            "sectionSchedule": {
+                "classSchedules": [{"day": day, "startTime": start, "endTime": f"{int(start[:2]) + 1:02d}:20:00"}
+                                   for day in rnd.sample(days, rnd.randint(1, 2))],
+                "finalExamDate": "2025-05-01", "finalExamStartTime": f"{8 + 3 * int(course[1:]):02d}:00:00",
+            },
+        })
+
+    def pairwise_ok(combination):
+        return not any(exam_conflict(a, b) or time_conflict(a, b)
+                       for i, a in enumerate(combination) for b in combination[i + 1:])
+
+    def all_pages(domains, fits, preference, deadlines):
+        routines, position, calls = [], None, 0
+        while True:
+            calls += 1
+            assert calls < 5000, "pages stopped making progress"
+            page, position = routine_page(domains, fits, pairwise_ok, preference, 3, position, deadlines())
+            assert len(page) <= 3
+            routines.extend(page)
+            if position is None:
+                return routines
+
+    def flaky():
+        # Gives up every few nodes, as a short time budget would
+        polls = itertools.count()
+        deadline = Deadline(cancelled=lambda: next(polls) % 9 == 8)
+        deadline.CANCEL_CHECK_INTERVAL = 1
+        return deadline
+
+    for trial in range(20):
+        domains = [[section(f"C{c}", c * 10 + k) for k in range(rnd.randint(1, 6))] for c in range(4)]
+        fits = lambda s: s.section_id % 7 != trial % 7
+        expected = [c for c in itertools.product(*domains) if pairwise_ok(c) and all(fits(s) for s in c)]
+        for preference in ("far", "Live Near", ""):
+            ranked = best_routines(expected, preference, k=len(expected) or 1)
+            assert all_pages(domains, fits, preference, lambda: None) == ranked, (trial, preference)
+            assert all_pages(domains, fits, preference, flaky) == ranked, (trial, preference)
+
+    cursor = Cursor(7, "versions", request_digest({"courses": ["CSE110"]}), (2, 5, 1, (0, 2)))
+    assert decode_cursor(encode_cursor(cursor)) == cursor
+    assert request_digest({"courses": ["CSE110"], "cursor": "x", "pageSize": 5}) == cursor.request
+    assert decode_cursor("not a cursor") is None and decode_cursor(None) is None
+    # Cursors are signed: edited or foreign ones are refused, and so are impossible positions
+    text = encode_cursor(cursor)
+    payload, signature = text.split(".")
+    forged = json.dumps({"g": 7, "v": "versions", "r": cursor.request, "p": [2, 5, 9, [0, 2]]}, separators=(",", ":"))
+    assert decode_cursor(base64.urlsafe_b64encode(forged.encode()).decode() + "." + signature) is None
+    assert decode_cursor(text, secret=b"another server") is None
+    assert decode_cursor(encode_cursor(cursor._replace(position=(2, 5, 8, None)))) is None
+    assert decode_cursor(encode_cursor(cursor._replace(position=(None, 5, 0, None)))) is None
+    assert decode_cursor(encode_cursor(cursor._replace(position=(2, 99, 0, None)))) is None
+    print("✓ Pages listed every routine in rank order, with and without deadlines")
+    return True
+
+def test_minimal_conflict():
+    """Test that minimal_conflict() finds a blocking set of courses that no course can be dropped from."""
+    import itertools
+    import random
+    print("\n=== Testing Minimal Conflicts ===")
+    rnd = random.Random(25)
+    days = ["SUNDAY", "MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY"]
+
+    def section(course, sid):
+        start = rnd.choice(["08:00:00", "09:30:00", "11:00:00"])
+        return Section({
+            "courseCode": course, "sectionId": sid, "sectionName": str(sid),
+            "sectionSchedule": {
+                "classSchedules": [{"day": day, "startTime": start, "endTime": f"{int(start[:2]) + 1:02d}:20:00"}
+                                   for day in rnd.sample(days, 2)],
+                "finalExamDate": "2025-05-01", "finalExamStartTime": f"{rnd.choice([8, 11, 14, 17]):02d}:00:00",
+            },
+        })
+
+    def passes(stage, combination, fits):
+        pairs = [(a, b) for i, a in enumerate(combination) for b in combination[i + 1:]]
+        if any(exam_conflict(a, b) for a, b in pairs):
+            return False
+        if stage != EXAM_CONFLICTS and any(time_conflict(a, b) for a, b in pairs):
+            return False
+        return stage != PREFERENCE_MISMATCH or all(fits(s) for s in combination)
+
+    def blocked(stage, domains, fits):
+        return not any(passes(stage, c, fits) for c in itertools.product(*domains))
+
+    seen = set()
+    for trial in range(60):
+        domains = [[section(f"C{c}", c * 10 + k) for k in range(rnd.randint(1, 3))] for c in range(rnd.randint(2, 5))]
+        fits = lambda s: s.section_id % 5 != trial % 5
+        conflict = minimal_conflict(domains, fits, None)
+        routine_exists = not blocked(PREFERENCE_MISMATCH, domains, fits)
+        assert (conflict is None) == routine_exists, trial
+        if conflict is None:
+            continue
+        courses, reason = conflict
+        seen.add((reason, len(courses)))
+        assert reason == classify_failure(domains, None), trial
+        assert blocked(reason, [domains[var] for var in courses], fits), trial
+        for var in courses:
+            assert not blocked(reason, [domains[other] for other in courses if other != var], fits), (trial, var)
+        assert minimal_conflict(domains, fits, None, reason=reason) == conflict
+    assert {reason for reason, _ in seen} == {EXAM_CONFLICTS, TIME_CONFLICTS, PREFERENCE_MISMATCH}
+    print(f"✓ Found minimal blocking courses: {sorted(seen)}")
+    return True
+
+def test_no_routine_error():
+    """Test that a conflict narrowed down past the deadline is not reported as the final answer."""
+    from collections import Counter
+    print("\n=== Testing No Routine Error ===")
+    data = [
+        {"courseCode": code, "sectionId": i, "sectionName": "1",
+         "sectionSchedule": {"finalExamDate": "2025-05-01", "finalExamStartTime": "09:00:00"}}
+        for i, code in enumerate(["CSE110", "MAT110", "PHY111"])
+    ]
+    catalog = Catalog(data)
+    domains = [catalog.course_sections(code) for code in ("CSE110", "MAT110", "PHY111")]
+    fits = lambda section: True
+    with usisvercel.app.test_request_context():
+        error = usisvercel.no_routine_error(Counter(), 0, domains, fits, Deadline())
+        assert error["reason"] == EXAM_CONFLICTS and len(error["conflictingCourses"]) == 2
+        assert "complete" not in error
+        # Out of time while dropping courses: the set may not be the smallest
+        deadline = Deadline(cancelled=lambda: True)
+        deadline.CANCEL_CHECK_INTERVAL = 1
+        error = usisvercel.no_routine_error(Counter(), 0, domains, fits, deadline)
+        assert error["reason"] == EXAM_CONFLICTS and error["complete"] is False
+    print(f"✓ Cut-short conflict for {error['conflictingCourses']} marked incomplete")
+    return True
+
+def test_product_search():
+    """Test that the one-pass product search keeps routines past 1000 rejected combinations and tells why it failed."""
+    from collections import Counter
+    print("\n=== Testing Product Search ===")
+    starts = ["08:00:00", "09:30:00", "11:00:00"]
+
+    def section(course, sid, day, start, exam=None):
+        schedule = {"classSchedules": [{"day": day, "startTime": start, "endTime": f"{int(start[:2]) + 1:02d}:20:00"}]}
+        if exam:
+            schedule.update(finalExamDate="2025-05-01", finalExamStartTime=exam)
+        return {"courseCode": course, "sectionId": sid, "sectionName": str(sid), "sectionSchedule": schedule}
+
+    # 11**3 combinations pass the exam and time checks; only the last one is on a selected day.
+    # The old pipeline stopped each stage at 1000 and never reached it.
+    data = [section(f"C{c}", c * 100 + k, "SUNDAY" if k == 10 else "SATURDAY", starts[c])
+            for c in range(3) for k in range(11)]
+    catalog = Catalog(data)
+    domains = [catalog.course_sections(f"C{c}") for c in range(3)]
+    passed = Counter()
+    found = list(usisvercel.product_search(domains, [], usisvercel.day_mask(["SUNDAY"]), passed))
+    assert [[s.section_id for s in c] for c in found] == [[10, 110, 210]]
+    assert passed["examined"] == 11 ** 3 and passed[TIME_CONFLICTS] == 11 ** 3
+
+    # Each stage that rejects every combination is reported with its own error
+    cases = {
+        EXAM_CONFLICTS: ([section("A", 1, "SUNDAY", starts[0], "09:00:00"), section("B", 2, "MONDAY", starts[1], "09:00:00")],
+                         usisvercel.EXAM_CONFLICTS_ERROR),
+        TIME_CONFLICTS: ([section("A", 1, "SUNDAY", starts[0]), section("B", 2, "SUNDAY", starts[0])],
+                         usisvercel.TIME_CONFLICTS_ERROR),
+        PREFERENCE_MISMATCH: ([section("A", 1, "SUNDAY", starts[0]), section("B", 2, "SATURDAY", starts[1])],
+                              usisvercel.PREFERENCE_MISMATCH_ERROR),
+    }
+    fits = lambda s: usisvercel.section_matches_preferences(s, [], usisvercel.day_mask(["SUNDAY"]))
+    for stage, (sections, expected) in cases.items():
+        catalog = Catalog(sections)
+        domains = [catalog.course_sections(code) for code in ("A", "B")]
+        passed = Counter()
+        assert not list(usisvercel.product_search(domains, [], usisvercel.day_mask(["SUNDAY"]), passed))
+        assert usisvercel.product_failure(passed) == stage
+        error = usisvercel.no_routine_error(passed, 0, domains, fits, Deadline())
+        assert error["title"] == expected["title"] and error["reason"] == stage, stage
+        assert error["conflictingCourses"] == (["B"] if stage == PREFERENCE_MISMATCH else ["A", "B"]), stage
+    print(f"✓ Found the routine after {11 ** 3 - 1} rejected combinations, all three failure stages reported")
+    return True
+
+def test_parallel_search():
+    """Test that searches split over worker processes return what in-process searches do."""
+    import random
+    import time
+    print("\n=== Testing Parallel Search ===")
+    rnd = random.Random(19)
+    data = []
+    for c in range(5):
+        for k in range(rnd.randint(2, 6)):
+            start = rnd.choice(["08:00:00", "09:30:00", "11:00:00"])
+            data.append({
+                "courseCode": f"C{c}", "sectionId": c * 10 + k, "sectionName": str(k + 1),
+                "sectionSchedule": {
+                    "classSchedules": [{"day": day, "startTime": start, "endTime": f"{int(start[:2]) + 1:02d}:20:00"}
+                                       for day in rnd.sample(["SUNDAY", "MONDAY", "TUESDAY", "WEDNESDAY"], 2)],
+                    "finalExamDate": "2025-05-01", "finalExamStartTime": f"{8 + 3 * c:02d}:00:00",
+                },
+            })
+    snapshot = Snapshot(data)
+    domains = [snapshot.catalog.course_sections(f"C{c}") for c in range(5)]
+    fits = lambda s: True
+    pool = SearchPool(workers=2)
+    try:
+        expected = backtracking_search(domains, fits, None)
+        assert expected and pool.backtracking_search(snapshot, domains, fits, None) == expected
+        assert pool.backtracking_search(snapshot, domains, fits, None, limit=2) == expected[:2]
+        for k in (1, 3):
+            assert pool.fewest_days_search(snapshot, domains, fits, None, k) == fewest_days_search(domains, fits, None, k)
+        expired = Deadline(time.time() - 1)
+        assert pool.backtracking_search(snapshot, domains, fits, None, deadline=expired) == [] and expired.reached
+        # Sections sent by the client are not in the workers' catalog
+        assert pool.backtracking_search(snapshot, [[Section(data[0])]] + domains[1:], fits, None) is None
+        # A new snapshot reaches the same workers instead of a new pool
+        executor = pool._executor
+        changed = Snapshot(data[1:])
+        domains = [changed.catalog.course_sections(f"C{c}") for c in range(5)]
+        assert pool.backtracking_search(changed, domains, fits, None) == backtracking_search(domains, fits, None)
+        assert pool._executor is executor
+    finally:
+        pool.shutdown()
+    print(f"✓ {len(expected)} routines found in-process and by the workers")
+    return True
+
+def test_routine_cache():
+    """Test that cached routine answers survive snapshots until a requested course changes."""
+    import copy
+    print("\n=== Testing Routine Cache ===")
+    data = [
+        {"courseCode": code, "sectionId": i, "sectionName": "1", "capacity": 40, "consumedSeat": 10,
+         "sectionSchedule": {"classSchedules": [{"day": "SUNDAY", "startTime": "08:00:00", "endTime": "09:20:00"}]}}
+        for i, code in enumerate(["CSE110", "MAT110", "PHY111"])
+    ]
+    request_data = {"courses": ["CSE110", "MAT110"], "days": ["SUNDAY"], "times": [], "commutePreference": "far"}
+    key, courses = routine_cache_key(request_data)
+    as_objects = dict(request_data, courses=[{"course": "CSE110", "sections": {}}, {"course": "MAT110"}])
+    assert routine_cache_key(as_objects) == (key, courses) and courses == ("CSE110", "MAT110")
+    assert routine_cache_key(dict(request_data, courses=["MAT110", "CSE110"]))[0] != key
+    assert routine_cache_key(dict(request_data, useAI=True)) is None
+    assert routine_cache_key({"sections": ["1"]}) is None
+
+    cache = RoutineCache(capacity=2)
+    catalog = Catalog(data)
+    assert cache.get(key, catalog) is None
+    cache.put(key, catalog, courses, {"routine": []}, 200)
+    assert cache.get(key, catalog) == ({"routine": []}, 200)
+
+    other_changed = copy.deepcopy(data)
+    other_changed[2]["consumedSeat"] = 40
+    assert cache.get(key, Catalog(other_changed)) is not None
+    requested_changed = copy.deepcopy(data)
+    requested_changed[1]["consumedSeat"] = 11
+    assert cache.get(key, Catalog(requested_changed)) is None and cache.get(key, catalog) is None
+
+    for n in range(3):
+        cache.put(f"key{n}", catalog, courses, {}, 200)
+    assert cache.get("key0", catalog) is None and cache.get("key2", catalog) is not None
+    stats = cache.stats()
+    assert stats == {"size": 2, "capacity": 2, "hits": 3, "misses": 4, "invalidated": 1}, stats
+    print(f"✓ Cache stats: {stats}")
+    return True
+
+def test_single_flight():
+    """Test that concurrent identical computations run once and share the result."""
+    import threading
+    import time
+    print("\n=== Testing Single Flight ===")
+    flights = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return len(calls)
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.run("bundle", compute)))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=lambda: results.append(flights.run("bundle", compute))) for _ in range(5)]
+    for thread in followers:
+        thread.start()
+    for thread in [leader] + followers:
+        thread.join()
+    assert len(calls) == 1 and flights.coalesced == 5
+    assert sorted(results) == [(1, False)] + [(1, True)] * 5
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("search failed")
+
+    started.clear()
+    errors, recovered = [], []
+
+    def run_failing():
+        try:
+            flights.run("other", failing)
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run_failing)
+    thread.start()
+    started.wait()
+    recovered.append(flights.run("other", lambda: "own"))
+    thread.join()
+    assert errors and recovered == [("own", False)]
+
+    # A caller waits no longer than its own deadline, then answers itself past it
+    started.clear()
+    slow = threading.Thread(target=lambda: flights.run("slow", lambda: started.set() or time.sleep(0.5)))
+    slow.start()
+    started.wait()
+    deadline = Deadline.after(0.05)
+    waited = time.time()
+    answer = flights.run("slow", lambda: "timed out" if deadline.passed() else "searched", deadline)
+    waited = time.time() - waited
+    slow.join()
+    assert answer == ("timed out", False) and deadline.reached and waited < 0.4
+    print(f"✓ One computation served {len(results)} callers")
+    return True
+
+def routine_feed():
+    """A small fixed feed: three courses of eight sections that never clash with each other."""
+    days = ["SUNDAY", "MONDAY", "TUESDAY", "WEDNESDAY"]
+    starts = {"CSE110": "08:00:00", "MAT110": "09:30:00", "PHY111": "11:00:00"}
+    return [
+        {"courseCode": code, "sectionId": c * 10 + k, "sectionName": str(k + 1), "faculties": "ABC",
+         "capacity": 40, "consumedSeat": 10,
+         "sectionSchedule": {"classSchedules": [
+             {"day": day, "startTime": starts[code], "endTime": f"{int(starts[code][:2]) + 1:02d}:20:00"}
+             for day in {days[k % 4], days[k // 2 % 4]}]}}
+        for c, code in enumerate(starts) for k in range(8)
+    ]
+
+class routine_client:
+    """A test client of the usisvercel app serving `data` as a fixed snapshot, with an empty routine cache.
+
+    serve() swaps in another snapshot (a feed update); the app's own state is put back on exit.
+    """
+
+    def __init__(self, data):
+        self.serving = Snapshot(data)
+        self.manager = SnapshotManager(lambda previous: self.serving, ttl=3600, name="test", cache_dir=None)
+
+    def serve(self, data):
+        self.serving = Snapshot(data)
+        self.manager.refresh(force=True)
+        return self.serving
+
+    def __enter__(self):
+        self.manager.refresh(force=True)
+        self.saved = usisvercel.course_snapshots
+        usisvercel.course_snapshots = self.manager
+        usisvercel.routine_cache.clear()
+        return usisvercel.app.test_client()
+
+    def __exit__(self, *exc):
+        self.manager.stop_background_refresh()
+        usisvercel.course_snapshots = self.saved
+        usisvercel.routine_cache.clear()
+
+def test_routine_endpoint():
+    """Test /api/routine with ?k=, "timeBudgetMs" and an answer cut short by a client that left."""
+    import time
+    print("\n=== Testing Routine Endpoint ===")
+    request_data = {"courses": ["CSE110", "MAT110", "PHY111"], "days": ["Sunday", "Monday", "Tuesday", "Wednesday"],
+                    "times": [], "commutePreference": "far"}
+    with routine_client(routine_feed()) as client:
+        answer = client.post("/api/routine", json=request_data)
+        assert answer.status_code == 200
+        body = answer.get_json()
+        assert [s["courseCode"] for s in body["routine"]] == ["CSE110", "MAT110", "PHY111"]
+        assert "routines" not in body and "complete" not in body
+
+        top = client.post("/api/routine?k=3", json=request_data).get_json()
+        assert len(top["routines"]) == 3 and top["routine"] == top["routines"][0] == body["routine"]
+        assert len(client.post("/api/routine?k=500", json=request_data).get_json()["routines"]) == usisvercel.MAX_ROUTINES
+
+        # The product search polls the disconnect check every Deadline.CANCEL_CHECK_INTERVAL
+        # combinations, so it stops early with the best routine found by then
+        gone = {"waitress.client_disconnected": lambda: True}
+        partial = client.post("/api/routine", json=dict(request_data, commutePreference=""), environ_base=gone)
+        assert partial.status_code == 200
+        assert partial.get_json()["complete"] is False and partial.get_json()["routine"]
+
+    with usisvercel.app.test_request_context():
+        started = time.time()
+        assert abs(usisvercel.routine_deadline({"timeBudgetMs": 50}).at - started - 0.05) < 0.02
+        longest = usisvercel.ROUTINE_TIME_BUDGET_MS / 1000
+        assert usisvercel.routine_deadline({"timeBudgetMs": 10 ** 9}).at - started <= longest + 0.02
+        assert usisvercel.routine_deadline({"timeBudgetMs": "soon"}).at - started >= longest - 0.02
+    print(f"✓ /api/routine answered {len(top['routines'])} routines for ?k=3 and a partial routine for a lost client")
+    return True
+
+def test_routine_cache_endpoint():
+    """Test the X-Routine-Cache header of /api/routine and the /api/routine/cache counters."""
+    import copy
+    print("\n=== Testing Routine Cache Endpoint ===")
+    feed = routine_feed()
+    request_data = {"courses": ["CSE110", "MAT110"], "days": ["Sunday", "Monday", "Tuesday", "Wednesday"],
+                    "times": [], "commutePreference": "far"}
+    fixture = routine_client(feed)
+    with fixture as client:
+        before = client.get("/api/routine/cache").get_json()
+        first = client.post("/api/routine", json=request_data)
+        assert first.headers["X-Routine-Cache"] == "MISS"
+        again = client.post("/api/routine", json=request_data)
+        assert again.headers["X-Routine-Cache"] == "HIT" and again.get_json() == first.get_json()
+        assert client.post("/api/routine?k=2", json=request_data).headers["X-Routine-Cache"] == "MISS"
+
+        # A feed update for a course not in the request keeps the answer; one for a requested course drops it
+        changed = copy.deepcopy(feed)
+        for section in changed:
+            if section["courseCode"] == "PHY111":
+                section["consumedSeat"] = 11
+        fixture.serve(changed)
+        assert client.post("/api/routine", json=request_data).headers["X-Routine-Cache"] == "HIT"
+        changed = copy.deepcopy(changed)
+        changed[0]["consumedSeat"] = 12
+        fixture.serve(changed)
+        assert client.post("/api/routine", json=request_data).headers["X-Routine-Cache"] == "MISS"
+
+        # Answers cut short are not cached
+        gone = {"waitress.client_disconnected": lambda: True}
+        everything = dict(request_data, courses=["CSE110", "MAT110", "PHY111"], commutePreference="")
+        assert client.post("/api/routine", json=everything, environ_base=gone).get_json()["complete"] is False
+        assert client.post("/api/routine", json=everything).headers["X-Routine-Cache"] == "MISS"
+
+        stats = client.get("/api/routine/cache").get_json()
+        counted = {name: stats[name] - before[name] for name in ("hits", "misses", "invalidated")}
+        assert counted == {"hits": 2, "misses": 5, "invalidated": 1} and stats["size"] == 3
+    print(f"✓ Cache stats: {stats}")
+    return True
+
+def test_shared_routine_search():
+    """Test that identical /api/routine requests in flight together share one search, within their deadlines."""
+    import threading
+    import time
+    print("\n=== Testing Shared Routine Search ===")
+    request_data = {"courses": ["CSE110", "MAT110", "PHY111"], "days": ["Sunday", "Monday", "Tuesday", "Wednesday"],
+                    "times": [], "commutePreference": "far"}
+    build_routine = usisvercel.build_routine
+    release = threading.Event()
+    calls = []
+
+    def held_build_routine(deadline=None):
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(5)  # the first search runs until every follower is waiting for it
+        return build_routine(deadline)
+
+    answers = []
+
+    def post(body):
+        answer = usisvercel.app.test_client().post("/api/routine", json=body)
+        answers.append((answer.headers["X-Routine-Cache"], answer.get_json()))
+
+    def wait_for(condition):
+        for _ in range(500):
+            if condition():
+                return
+            time.sleep(0.01)
+        raise AssertionError("timed out")
+
+    usisvercel.build_routine = held_build_routine
+    coalesced = usisvercel.routine_flights.coalesced
+    try:
+        with routine_client(routine_feed()):
+            leader = threading.Thread(target=post, args=(request_data,))
+            leader.start()
+            wait_for(lambda: calls)
+            followers = [threading.Thread(target=post, args=(request_data,)) for _ in range(2)]
+            for thread in followers:
+                thread.start()
+            wait_for(lambda: usisvercel.routine_flights.coalesced == coalesced + 2)
+
+            # A follower with less time answers on its own once its deadline passes
+            post(dict(request_data, timeBudgetMs=50))
+            assert answers[0][0] == "MISS" and answers[0][1]["complete"] is False
+            assert answers[0][1]["title"] == usisvercel.SEARCH_TIMEOUT_ERROR["title"]
+
+            release.set()
+            for thread in [leader] + followers:
+                thread.join()
+    finally:
+        usisvercel.build_routine = build_routine
+        release.set()
+    statuses = sorted(status for status, _ in answers[1:])
+    assert statuses == ["MISS", "SHARED", "SHARED"] and len(calls) == 2
+    assert all(body == answers[1][1] for _, body in answers[1:]) and "routine" in answers[1][1]
+    print(f"✓ One search answered {statuses}, the impatient caller timed out on its own")
+    return True
+
+def test_routine_stream():
+    """Test the Server-Sent Events of /api/routine/stream and that its last event is the /api/routine answer."""
+    import json
+    print("\n=== Testing Routine Stream ===")
+    request_data = {"courses": ["CSE110", "MAT110", "PHY111"], "days": ["Sunday", "Monday", "Tuesday", "Wednesday"],
+                    "times": []}
+    seen = 0
+    with routine_client(routine_feed()) as client:
+        for preference in ("far", "near", ""):
+            for engine in ("product", "backtracking"):
+                body = dict(request_data, commutePreference=preference, engine=engine)
+                expected = client.post("/api/routine?k=3", json=body).get_json()
+                stream = client.post("/api/routine/stream?k=3", json=body)
+                assert stream.status_code == 200 and stream.mimetype == "text/event-stream"
+                assert stream.headers["Cache-Control"] == "no-cache"
+                text = stream.get_data(as_text=True)
+                assert text.endswith("\n\n")
+                events = []
+                for block in text[:-2].split("\n\n"):
+                    event, data = block.split("\n")
+                    assert event.startswith("event: ") and data.startswith("data: ")
+                    events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+                assert events[0][0] == "progress" and [name for name, _ in events].count("done") == 1
+                name, done = events[-1]
+                assert name == "done" and done["complete"] is True
+                assert done["routine"] == expected["routine"] and done["routines"] == expected["routines"]
+                routines = [data for name, data in events if name == "routine"]
+                assert routines and routines[-1]["routines"] == done["routines"], (preference, engine)
+                if preference == "far":
+                    assert [r["campusDays"] for r in routines] == sorted((r["campusDays"] for r in routines), reverse=True)
+                seen += len(events)
+
+        # Requests /api/routine rejects get its JSON error instead of a stream
+        invalid = client.post("/api/routine/stream", json={"courses": 5})
+        assert invalid.status_code == 400 and invalid.get_json()["error"] is True
+    print(f"✓ {seen} events streamed, each stream ending with the /api/routine answer")
+    return True
+
+def test_routine_page_endpoint():
+    """Test paging through /api/routine/page with its cursors, and the cursors it refuses."""
+    import base64
+    import copy
+    import json
+    print("\n=== Testing Routine Page Endpoint ===")
+    feed = routine_feed()
+    request_data = {"courses": ["CSE110", "MAT110", "PHY111"], "days": ["Sunday", "Monday", "Tuesday", "Wednesday"],
+                    "times": [], "commutePreference": "far", "pageSize": 20}
+    fixture = routine_client(feed)
+    with fixture as client:
+        best = client.post("/api/routine?k=20", json=request_data).get_json()["routines"]
+        routines, cursors = [], []
+        body = request_data
+        while True:
+            page = client.post("/api/routine/page", json=body)
+            assert page.status_code == 200
+            page = page.get_json()
+            assert len(page["routines"]) == 20 or page["cursor"] is None
+            routines.extend(page["routines"])
+            if page["cursor"] is None:
+                break
+            cursors.append(page["cursor"])
+            body = dict(request_data, cursor=page["cursor"])
+        assert len(routines) == 8 ** 3 and routines[:20] == best
+        assert len({tuple(s["sectionId"] for s in routine) for routine in routines}) == len(routines)
+
+        cursor = cursors[0]
+        # The same position moved one routine on, under the original signature
+        payload, signature = cursor.split(".")
+        position = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        position["p"][3][-1] += 1
+        edited = json.dumps(position, separators=(",", ":")).encode()
+        tampered = base64.urlsafe_b64encode(edited).decode().rstrip("=") + "." + signature
+        for refused in (tampered, "not a cursor", 42):
+            answer = client.post("/api/routine/page", json=dict(request_data, cursor=refused))
+            assert answer.status_code == 400 and answer.get_json()["title"] == usisvercel.INVALID_CURSOR_ERROR["title"]
+        # A cursor only continues the request it was made for
+        other = dict(request_data, days=["Sunday", "Monday"], cursor=cursor)
+        assert client.post("/api/routine/page", json=other).status_code == 400
+
+        # Feed updates to other courses keep the cursor; one to a requested course makes it stale
+        changed = copy.deepcopy(feed)
+        changed.append(dict(copy.deepcopy(feed[0]), courseCode="CHE101", sectionId=99))
+        fixture.serve(changed)
+        resumed = client.post("/api/routine/page", json=dict(request_data, cursor=cursor))
+        assert resumed.status_code == 200 and resumed.get_json()["routines"] == routines[20:40]
+        changed = copy.deepcopy(changed)
+        changed[0]["consumedSeat"] = 11
+        fixture.serve(changed)
+        stale = client.post("/api/routine/page", json=dict(request_data, cursor=cursor))
+        assert stale.status_code == 409
+    print(f"✓ {len(routines)} routines over {len(cursors) + 1} pages, tampered and stale cursors refused")
+    return True
+
 def test_time_utils():
     """Test time utility functions."""
     print("\n=== Testing Time Utils ===")
@@ -76,6 +1115,30 @@ def run_all_tests():
         test_imports,
         test_config,
         test_data_loader,
+        test_snapshot_single_flight,
+        test_snapshot_background_refresh,
+        test_conditional_fetch,
+        test_snapshot_persistence,
+        test_snapshot_generations,
+        test_streaming_feed_parser,
+        test_section_catalog,
+        test_compatibility_table,
+        test_occupancy_masks,
+        test_backtracking_search,
+        test_schedule_classes,
+        test_fewest_days_search,
+        test_routine_pages,
+        test_minimal_conflict,
+        test_no_routine_error,
+        test_product_search,
+        test_parallel_search,
+        test_routine_cache,
+        test_single_flight,
+        test_routine_endpoint,
+        test_routine_cache_endpoint,
+        test_shared_routine_search,
+        test_routine_stream,
+        test_routine_page_endpoint,
         test_time_utils,
         test_ai_service,
         test_app_creation
@@ -1,5 +1,5 @@
 import requests
-from flask import Flask, jsonify, request, send_file, abort
+from flask import Flask, jsonify, request, send_file, abort, g, has_request_context
 from flask_cors import CORS
 import re
 from datetime import datetime, timezone, timedelta
@@ -8,14 +8,37 @@ import pytz
 import demjson3
 import json as pyjson
 import os
+import sys
 from itertools import product
+from collections import Counter
 import time
+import threading
+import queue
 import traceback
 import logging
 import itertools
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 
+# Make the shared routinez package importable whether this file is run by
+# Vercel (api/ as the working directory) or imported as api.usisvercel by wsgi.py
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from routinez.snapshot import SnapshotManager, SNAPSHOT_AGE_HEADER, SNAPSHOT_GENERATION_HEADER
+from routinez.data_loader import fetch_feed
+from routinez.catalog import (
+    DAY_NAMES, Catalog, Section, combine_occupancy, day_mask, exam_conflict, lab_conflict, mask_days, time_conflict,
+)
+from routinez.solver import (
+    EXAM_CONFLICTS, PREFERENCE_MISMATCH, TIME_CONFLICTS, Deadline, RoutineRanking, arc_consistency,
+    backtracking_search, best_routines, campus_days, fewest_days_search, minimal_conflict,
+    routine_page,
+)
+from routinez.config import ROUTINE_TIME_BUDGET_MS
+from routinez.parallel import SearchPool
+from routinez.result_cache import ROUTINE_CACHE_HEADER, RoutineCache, SingleFlight, routine_cache_key
+from routinez.pagination import Cursor, courses_digest, decode_cursor, encode_cursor, request_digest
+from routinez import http_client
+
 # Global debug flag - set to True for development, False for production
 DEBUG = False
 
@@ -34,7 +57,7 @@ debugprint("Using hardcoded GOOGLE_API_KEY")
 debugprint("✓ GOOGLE_API_KEY is set and has a value")
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+CORS(app, expose_headers=[SNAPSHOT_AGE_HEADER, SNAPSHOT_GENERATION_HEADER])  # Enable CORS for all routes
 
 # Disable Flask's default access logs
 log = logging.getLogger('werkzeug')
@@ -79,11 +102,14 @@ def check_ai_availability():
 @app.route("/api/connapi-status")
 def check_connapi_status():
     try:
-        # Use a simpler approach - just check if the API is reachable
-        response = requests.get("https://connect-api.badda-tracker.workers.dev/raw-schedule", timeout=10)
+        # Use a simpler approach - just check if the API is reachable.
+        # Sending the current snapshot's validators lets an unchanged feed answer 304.
+        snapshot = course_snapshots.snapshot
+        headers = snapshot.conditional_headers() if snapshot else None
+        response = http_client.get(DATA_URL, headers=headers, timeout=(5, 10))
         
         # If we can reach the API, consider it online regardless of content
-        if response.status_code == 200:
+        if response.status_code in (200, 304):
             return jsonify({
                 "status": "online",
                 "cached": False,
@@ -129,56 +155,69 @@ def test():
         }
     })
 
+
+# (generation, course list) of the last snapshot summarised by /api/courses.
+# Replaced as a whole, so readers never see a half-built entry.
+_course_summaries = (None, None)
+
+
+def course_summaries(snapshot):
+    """Per-course seat totals of a snapshot, computed once per generation."""
+    global _course_summaries
+    generation, courses_list = _course_summaries
+    if generation == snapshot.generation:
+        return courses_list
+
+    data = snapshot.data
+    courses_data = {}
+    for section in data:
+        code = section.get("courseCode")
+        name = section.get("courseName", code)
+        available_seats = section.get("capacity", 0) - section.get("consumedSeat", 0)
+        
+        # Always process the course and include it in the response
+        if code not in courses_data:
+            courses_data[code] = {
+                "code": code, 
+                "name": name, 
+                "totalAvailableSeats": 0,
+                "hasAvailableSeats": False  # Add flag to indicate if course has any seats
+            }
+        # Only add positive available seats to the total
+        if section.get("capacity", 0) - section.get("consumedSeat", 0) > 0:
+            courses_data[code]["totalAvailableSeats"] += available_seats
+            courses_data[code]["hasAvailableSeats"] = True
+                
+    # Make sure all courses are properly processed
+    # This code ensures all courses from the data are included in the response
+    missing_courses = set(section.get("courseCode") for section in data if section.get("courseCode")) - set(courses_data.keys())
+    for code in missing_courses:
+        sections = [section for section in data if section.get("courseCode") == code]
+        if sections:
+            # Only count positive available seats
+            total_available = sum(max(0, section.get("capacity", 0) - section.get("consumedSeat", 0)) for section in sections)
+            courses_data[code] = {
+                "code": code,
+                "name": sections[0].get("courseName", code),
+                "totalAvailableSeats": total_available,
+                "hasAvailableSeats": total_available > 0
+            }
+                
+    courses_list = list(courses_data.values())
+    _course_summaries = (snapshot.generation, courses_list)
+    return courses_list
+
+
 @app.route("/api/courses")
 def get_courses():
     try:
         # Get show_all parameter from query string, default to False
         show_all = request.args.get("show_all", "false").lower() == "true"
         
-        data = load_data()  # Load data directly in the route
-        if data is None:
+        snapshot = current_snapshot()
+        if snapshot is None:
             return jsonify({"error": "Failed to load course data. Please try again later."}), 503
-            
-        courses_data = {}
-        for section in data:
-            code = section.get("courseCode")
-            name = section.get("courseName", code)
-            available_seats = section.get("capacity", 0) - section.get("consumedSeat", 0)
-            
-            # Always process the course and include it in the response
-            if code not in courses_data:
-                courses_data[code] = {
-                    "code": code, 
-                    "name": name, 
-                    "totalAvailableSeats": 0,
-                    "hasAvailableSeats": False  # Add flag to indicate if course has any seats
-                }
-            # Only add positive available seats to the total
-            if section.get("capacity", 0) - section.get("consumedSeat", 0) > 0:
-                courses_data[code]["totalAvailableSeats"] += available_seats
-                courses_data[code]["hasAvailableSeats"] = True
-                
-        # No debug prints for ACT201 - removed to clean up logs
-        
-        # Make sure all courses are properly processed
-        # This code ensures all courses from the data are included in the response
-        missing_courses = set(section.get("courseCode") for section in data if section.get("courseCode")) - set(courses_data.keys())
-        for code in missing_courses:
-            sections = [section for section in data if section.get("courseCode") == code]
-            if sections:
-                # Only count positive available seats
-                total_available = sum(max(0, section.get("capacity", 0) - section.get("consumedSeat", 0)) for section in sections)
-                courses_data[code] = {
-                    "code": code,
-                    "name": sections[0].get("courseName", code),
-                    "totalAvailableSeats": total_available,
-                    "hasAvailableSeats": total_available > 0
-                }
-        
-        # No special handling for ACT201 anymore
-                
-        courses_list = list(courses_data.values())
-        return jsonify(courses_list)
+        return jsonify(course_summaries(snapshot))
     except Exception as e:
         print(f"Error in /api/courses: {e}")
         return jsonify({"error": "Failed to process courses data. Please try again later."}), 503
@@ -210,69 +249,80 @@ def courses_sse():
     return app.response_class(generate(), mimetype='text/event-stream')
 
 
-# Initialize data as None
-data = None
-
 # SSE clients set
 sse_clients = set()
 
+DATA_URL = "https://connect-api.badda-tracker.workers.dev/raw-schedule"  # Using Vercel deployment
+
+
+def fetch_course_data(previous=None):
+    """Fetch and parse the raw schedule feed from upstream (with retries).
+
+    Sends the validators of `previous` so an unchanged feed costs a 304.
+    """
+    return fetch_feed(DATA_URL, previous)
+
+
+# One in-memory copy of the feed shared by every request and thread; it is
+# refetched at most once per TTL no matter how many requests arrive. The last
+# good copy is also kept on disk and loaded here, so cold starts skip the fetch.
+course_snapshots = SnapshotManager(fetch_course_data, name="raw-schedule")
+
+# Worker processes for "engine": "parallel", started on the first such request
+search_pool = SearchPool()
+# Answers to /api/routine requests, reused until a requested course changes in the feed
+routine_cache = RoutineCache()
+# Identical routine requests in flight at the same time share one search
+routine_flights = SingleFlight()
+
+
+@app.before_request
+def start_snapshot_refresh():
+    """Refresh the feed in the background once this process serves requests, so they
+    never wait on the upstream once warm. Not at import: the search workers import
+    this module too (see routinez.parallel) and must not poll the upstream."""
+    if not course_snapshots.background:
+        course_snapshots.start_background_refresh()
+
+
+@app.after_request
+def add_snapshot_age(response):
+    """Expose how old (and which generation) the course data behind this response is."""
+    age = course_snapshots.age()
+    if age is not None:
+        response.headers[SNAPSHOT_AGE_HEADER] = str(int(age))
+    snapshot = g.get("snapshot")
+    if snapshot is not None:
+        response.headers[SNAPSHOT_GENERATION_HEADER] = str(snapshot.generation)
+    return response
+
+
+def current_snapshot():
+    """The snapshot this request is served from.
+
+    The first call in a request pins the current snapshot on flask.g; later
+    calls in the same request get that same snapshot even if a refresh
+    publishes a newer one meanwhile, so one response never mixes two feeds.
+    Outside a request (e.g. inside a streaming generator) the latest
+    snapshot is returned.
+    """
+    if not has_request_context():
+        return course_snapshots.get()
+    if "snapshot" not in g:
+        g.snapshot = course_snapshots.get()
+    return g.snapshot
+
+
 def load_data():
-    try:
-        DATA_URL = "https://connect-api.badda-tracker.workers.dev/raw-schedule"  # Using Vercel deployment
-        debugprint(f"\n=== Loading Fresh Data from {DATA_URL} ===")
-        
-        # Add retry logic
-        max_retries = 3
-        retry_delay = 2  # seconds
-        
-        for attempt in range(max_retries):
-            try:
-                debugprint(f"Attempt {attempt + 1}/{max_retries}...")
-                response = requests.get(DATA_URL, timeout=30)  # Increased timeout
-                response.raise_for_status()
-                raw_json = response.json()
-                
-                debugprint(f"Raw response type: {type(raw_json)}")
-                
-                # Handle both direct list and {data: [...]} formats
-                if isinstance(raw_json, dict) and "data" in raw_json:
-                    debugprint("Response is a dict with 'data' key")
-                    fresh_data = raw_json["data"]
-                else:
-                    debugprint("Response is a direct list")
-                    fresh_data = raw_json  # If it's already a list
-                
-                if not isinstance(fresh_data, list):
-                    debugprint(f"Warning: Expected list data, got {type(fresh_data)}")
-                    continue
-                
-                # Count sections by course
-                course_counts = {}
-                for section in fresh_data:
-                    course = section.get("courseCode")
-                    if course:
-                        course_counts[course] = course_counts.get(course, 0) + 1
-                
-                debugprint(f"Successfully loaded {len(fresh_data)} total sections")
-                debugprint("Sections per course:")
-                for course, count in sorted(course_counts.items()):
-                    debugprint(f"  {course}: {count} sections")
-                
-                return fresh_data
-            except requests.exceptions.RequestException as e:
-                debugprint(f"Error on attempt {attempt + 1}: {e}")
-                if attempt < max_retries - 1:  # Don't sleep on the last attempt
-                    time.sleep(retry_delay)
-            except json.JSONDecodeError as e:
-                debugprint(f"JSON decode error on attempt {attempt + 1}: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-        
-        debugprint("All retry attempts failed")
-        return None
-    except Exception as e:
-        debugprint(f"Critical error in load_data: {e}")
-        return None
+    """Return the cached course sections, refreshing them once the TTL has passed."""
+    snapshot = current_snapshot()
+    return snapshot.data if snapshot else None
+
+
+def load_catalog():
+    """Return the compiled sections and lookup indexes of the current snapshot."""
+    snapshot = current_snapshot()
+    return snapshot.catalog if snapshot else Catalog([])
 
 
 # Add at the top of usis.py
@@ -491,6 +541,10 @@ def slot_to_minutes(slot):
         return 0, 0
 
 
+# (start minute, end minute) of every time slot, parsed once
+TIME_SLOT_RANGES = {slot: slot_to_minutes(slot) for slot in TIME_SLOTS}
+
+
 def schedules_overlap(start1, end1, start2, end2):
     """Check if two time ranges overlap."""
     overlap = max(start1, start2) < min(end1, end2)
@@ -715,9 +769,28 @@ def has_internal_conflicts(section):
     return False
 
 
+def copy_section_for_response(section):
+    """Copy of a feed section whose fields and schedules can be edited freely."""
+    section = dict(section)
+    schedule = section.get("sectionSchedule")
+    if isinstance(schedule, dict):
+        schedule = section["sectionSchedule"] = dict(schedule)
+        if isinstance(schedule.get("classSchedules"), list):
+            schedule["classSchedules"] = [
+                dict(entry) if isinstance(entry, dict) else entry
+                for entry in schedule["classSchedules"]
+            ]
+    if isinstance(section.get("labSchedules"), list):
+        section["labSchedules"] = [
+            dict(entry) if isinstance(entry, dict) else entry
+            for entry in section["labSchedules"]
+        ]
+    return section
+
+
 @app.route("/api/course_details")
 def course_details():
-    data = load_data()
+    catalog = load_catalog()
     code = request.args.get("course")
     show_all = request.args.get("show_all", "false").lower() == "true"  # Get show_all parameter
     
@@ -725,7 +798,7 @@ def course_details():
     debugprint(f"Show All: {show_all}")
     
     # Get all sections for the course
-    all_sections = [section for section in data if section.get("courseCode") == code]
+    all_sections = [section.raw for section in catalog.course_sections(code)]
     debugprint(f"Found {len(all_sections)} total sections for {code}")
 
     # Filter sections based on show_all parameter
@@ -733,6 +806,8 @@ def course_details():
     for section in all_sections:
         available_seats = section.get("capacity", 0) - section.get("consumedSeat", 0)
         if show_all or section.get("capacity", 0) - section.get("consumedSeat", 0) > 0:  # Include all sections if show_all is true
+            # Decorate a copy; the feed dicts are shared by every request
+            section = copy_section_for_response(section)
             # Add available seats information
             section["availableSeats"] = available_seats
             debugprint(f"Including section {section.get('sectionName')} with {available_seats} seats")
@@ -817,25 +892,21 @@ def course_details():
 
 @app.route("/api/faculty")
 def get_faculty():
-    # Get unique faculty names from all sections
-    faculty = set()
-    for section in data:
-        if section.get("faculties"):
-            faculty.add(section.get("faculties"))
-    return jsonify(list(faculty))
+    # Unique faculty names across all sections
+    return jsonify(list(load_catalog().by_faculty))
 
 
 @app.route("/api/faculty_for_courses")
 def get_faculty_for_courses():
     course_codes = request.args.get("courses", "").split(",")
+    catalog = load_catalog()
     faculty = set()
 
     # Get faculty for each course
     for code in course_codes:
-        sections = [section for section in data if section.get("courseCode") == code]
-        for section in sections:
-            if section.get("faculties"):
-                faculty.add(section.get("faculties"))
+        for section in catalog.course_sections(code):
+            if section.faculty:
+                faculty.add(section.faculty)
 
     return jsonify(list(faculty))
 
@@ -960,27 +1031,10 @@ def get_lab_schedule_bd(section):
 def check_lab_conflicts(section1, section2):
     """Check if two sections have conflicting lab schedules."""
     debugprint(f"\nChecking lab conflicts between {section1.get('courseCode')} and {section2.get('courseCode')}")
-    labs1 = get_lab_schedule(section1)
-    labs2 = get_lab_schedule(section2)
-
-    debugprint(f"Found {len(labs1)} labs for {section1.get('courseCode')} and {len(labs2)} labs for {section2.get('courseCode')}")
-
-    for lab1 in labs1:
-        for lab2 in labs2:
-            if lab1["day"] == lab2["day"]:
-                debugprint(f"Checking overlap for {lab1['day']}:")
-                debugprint(f"{section1.get('courseCode')}: {lab1['formattedTime']} in {lab1['room']}")
-                debugprint(f"{section2.get('courseCode')}: {lab2['formattedTime']} in {lab2['room']}")
-                if schedules_overlap(
-                    lab1["startMinutes"],
-                    lab1["endMinutes"],
-                    lab2["startMinutes"],
-                    lab2["endMinutes"],
-                ):
-                    debugprint("Found lab conflict!")
-                    return True
-                else:
-                    debugprint("No overlap found")
+    # Compares the labs' weekly occupancy masks
+    if lab_conflict(Section(section1), Section(section2)):
+        debugprint("Found lab conflict!")
+        return True
     
     debugprint("No lab conflicts found")
     return False
@@ -1081,6 +1135,19 @@ def get_required_days_for_course(sections):
     return required_days
 
 
+def has_exam_conflicts(sections):
+    """True if any two sections of different courses have overlapping exams."""
+    for i, section1 in enumerate(sections):
+        for j in range(i + 1, len(sections)):
+            section2 = sections[j]
+            # Different sections of the same course may have different exam schedules
+            if section1.course == section2.course:
+                continue
+            if exam_conflict(section1, section2):
+                return True
+    return False
+
+
 def check_exam_compatibility(sections):
     """Check if a set of sections has any exam conflicts. Returns (has_conflicts, error_message)."""
     exam_conflicts = []
@@ -1092,14 +1159,12 @@ def check_exam_compatibility(sections):
             
             # Skip conflict checking between different sections of the same course
             # since they can have different exam schedules
-            course1 = section1.get('courseCode', '')
-            course2 = section2.get('courseCode', '')
-            if course1 == course2:
+            if section1.course == section2.course:
                 continue
                 
-            conflicts = check_exam_conflicts(section1, section2)
-            if conflicts:
-                exam_conflicts.extend(conflicts)
+            if exam_conflict(section1, section2):
+                # Build the detailed conflict entries from the feed data for the message
+                exam_conflicts.extend(check_exam_conflicts(section1.raw, section2.raw))
 
     if exam_conflicts:
         error_message = format_exam_conflicts_message(exam_conflicts)
@@ -1170,143 +1235,37 @@ def normalize_time(time_str):
 
 def filter_section_by_time(section, selected_times):
     """Check if section schedules fit within selected time ranges."""
-    debugprint(f"\nFiltering section {section.get('courseCode')} {section.get('sectionName')} by time")
+    debugprint(f"\nFiltering section {section.course} {section.name} by time")
     if not selected_times:  # If no times selected, accept all
         debugprint("No time restrictions, accepting section")
         return True, "No time restrictions"
 
-    def time_in_ranges(schedule_type, day, start_time, end_time):
-        try:
-            if not start_time or not end_time:
-                debugprint(f"Missing time data for {schedule_type}, accepting schedule")
-                return True, None  # Accept if missing time data
-
-            # Normalize times
-            start_time = normalize_time(start_time)
-            end_time = normalize_time(end_time)
-            debugprint(f"Checking {schedule_type} schedule: {day} {start_time}-{end_time}")
-
-            start_minutes = TimeUtils.time_to_minutes(start_time)
-            end_minutes = TimeUtils.time_to_minutes(end_time)
-
-            # Use selected times as-is (they should match TIME_SLOTS format)
-            normalized_selected_times = selected_times
-
-            # For lab sessions, we need to ensure ALL required time slots are
-            # selected
-            if schedule_type == "Lab":
-                debugprint("Processing lab schedule")
-                # Validate lab duration (allow any reasonable duration)
-                lab_duration = end_minutes - start_minutes
-                if lab_duration < 60:  # Allow labs as short as 1 hour
-                    debugprint(f"Lab duration ({lab_duration} minutes) is too short")
-                    return (
-                        False,
-                        f"Lab session duration ({lab_duration} minutes) is too short",
-                    )
-
-                # Get all time slots that this lab session spans
-                required_slots = []
-                for time_slot in TIME_SLOTS:
-                    slot_start, slot_end = time_slot.split("-")
-                    # Parse 12-hour format directly without normalizing
-                    start_dt = datetime.strptime(slot_start.strip(), "%I:%M %p")
-                    end_dt = datetime.strptime(slot_end.strip(), "%I:%M %p")
-                    range_start = start_dt.hour * 60 + start_dt.minute
-                    range_end = end_dt.hour * 60 + end_dt.minute
-
-                    # If this slot overlaps with the lab session, it's required
-                    if start_minutes <= range_end and end_minutes >= range_start:
-                        required_slots.append(time_slot)
-                        debugprint(f"Found required time slot: {time_slot}")
-
-                # Check if all required slots are selected
-                if not all(slot in normalized_selected_times for slot in required_slots):
-                    missing_slots = [slot for slot in required_slots if slot not in normalized_selected_times]
-                    debugprint(f"Missing required time slots: {', '.join(missing_slots)}")
-                    return (
-                        False,
-                        f"Lab session requires all time slots it spans to be selected: {', '.join(required_slots)}",
-                    )
-                debugprint("All required time slots are selected")
-                return True, None
-
-            # For regular classes, check if the schedule overlaps with selected time slots
-            debugprint("Processing regular class schedule")
-            schedule_fits = False
-            
-            # Map TIME_SLOTS to minutes for comparison
-            time_slot_ranges = {}
-            for time_slot in TIME_SLOTS:
-                slot_start, slot_end = time_slot.split("-")
-                # Parse 12-hour format directly without normalizing
-                start_dt = datetime.strptime(slot_start.strip(), "%I:%M %p")
-                end_dt = datetime.strptime(slot_end.strip(), "%I:%M %p")
-                range_start = start_dt.hour * 60 + start_dt.minute
-                range_end = end_dt.hour * 60 + end_dt.minute
-                time_slot_ranges[time_slot] = {
-                    'start': range_start,
-                    'end': range_end
-                }
-
-            # Check which time slots are selected
-            debugprint(f"Selected times: {normalized_selected_times}")
-            debugprint(f"Available time slots: {list(time_slot_ranges.keys())}")
-            
-            # Check if schedule overlaps with any selected time slot
-            for time_slot in normalized_selected_times:
-                if time_slot in time_slot_ranges:
-                    range_start = time_slot_ranges[time_slot]['start']
-                    range_end = time_slot_ranges[time_slot]['end']
-                    
-                    debugprint(f"Checking overlap with time slot {time_slot} ({range_start}-{range_end})")
-                    
-                    # Check if the schedule overlaps with this time slot
-                    if start_minutes < range_end and end_minutes > range_start:
-                        debugprint(f"Schedule overlaps with selected time slot {time_slot}")
-                        schedule_fits = True
-                        break
-
-            if not schedule_fits:
-                debugprint(f"Schedule {start_time}-{end_time} doesn't overlap with any selected time slot")
-                return (
-                    False,
-                    f"{schedule_type} time {start_time}-{end_time} doesn't overlap with any selected time slot",
-                )
-            
-            debugprint("Schedule fits within selected time slot")
-            return True, None
-
-        except Exception as e:
-            debugprint(f"Error in time_in_ranges: {e}")
-            return True, None  # Accept the section if there's an error in time parsing
+    # Regular classes must overlap at least one selected time slot
+    selected_ranges = [TIME_SLOT_RANGES[slot] for slot in selected_times if slot in TIME_SLOT_RANGES]
+    for _, start_minutes, end_minutes, has_times in section.class_meetings:
+        if not has_times:
+            continue  # Accept if missing time data
+        if not any(start_minutes < range_end and end_minutes > range_start
+                   for range_start, range_end in selected_ranges):
+            error = (f"Class time {TimeUtils.minutes_to_time(start_minutes)}-{TimeUtils.minutes_to_time(end_minutes)} "
+                     "doesn't overlap with any selected time slot")
+            debugprint(f"Class schedule invalid: {error}")
+            return False, error
 
-    # Check class schedules
-    debugprint("Checking class schedules")
-    if section.get("sectionSchedule") and section["sectionSchedule"].get(
-        "classSchedules"
-    ):
-        for schedule in section["sectionSchedule"]["classSchedules"]:
-            valid, error = time_in_ranges(
-                "Class",
-                schedule.get("day", ""),
-                schedule.get("startTime", ""),
-                schedule.get("endTime", ""),
-            )
-            if not valid:
-                debugprint(f"Class schedule invalid: {error}")
-                return False, error
-
-    # Check lab schedules
-    debugprint("Checking lab schedules")
-    for lab in get_lab_schedules_flat(section):
-        valid, error = time_in_ranges(
-            "Lab",
-            lab.get("day", ""),
-            lab.get("startTime", ""),
-            lab.get("endTime", ""),
-        )
-        if not valid:
+    # Lab sessions need ALL the time slots they span to be selected
+    for _, start_minutes, end_minutes, has_times in section.lab_meetings:
+        if not has_times:
+            continue
+        lab_duration = end_minutes - start_minutes
+        if lab_duration < 60:  # Allow labs as short as 1 hour
+            debugprint(f"Lab duration ({lab_duration} minutes) is too short")
+            return False, f"Lab session duration ({lab_duration} minutes) is too short"
+        required_slots = [
+            slot for slot, (range_start, range_end) in TIME_SLOT_RANGES.items()
+            if start_minutes <= range_end and end_minutes >= range_start
+        ]
+        if not all(slot in selected_times for slot in required_slots):
+            error = f"Lab session requires all time slots it spans to be selected: {', '.join(required_slots)}"
             debugprint(f"Lab schedule invalid: {error}")
             return False, error
 
@@ -1377,119 +1336,56 @@ def is_valid_combination(sections):
     if len(sections) <= 1:
         return True
     
-    # Pre-process all sections and their schedules with optimization
-    section_data = []
-    
     # Use sets for O(1) lookups
     seen_courses = set()
-    seen_faculty = set()
+    checked = []
     
     for section in sections:
-        schedules = get_all_schedules(section)
-        if schedules:
-            course_code = section.get('courseCode')
-            faculties = section.get('faculties')
-            
-            # O(1) duplicate detection
-            course_key = f"{course_code}|{faculties}"
-            if course_key in seen_courses:
-                debugprint(f"Skipping schedule compatibility check between sections of the same course and faculty: {course_code} ({faculties})")
-                continue
-            seen_courses.add(course_key)
-            
-            # Pre-group schedules by day for O(1) lookups
-            day_schedules = {}
-            for sched in schedules:
-                day = sched.get('day', '').upper()
-                if day:
-                    if day not in day_schedules:
-                        day_schedules[day] = []
-                    # Convert times once and store for reuse
-                    start_time = TimeUtils.time_to_minutes(sched.get('startTime', ''))
-                    end_time = TimeUtils.time_to_minutes(sched.get('endTime', ''))
-                    day_schedules[day].append((start_time, end_time, sched))
-            
-            section_data.append({
-                'section': section,
-                'day_schedules': day_schedules,
-                'course_code': course_code,
-                'faculties': faculties
-            })
-    
-    # Check for internal conflicts in each section - optimized
-    debugprint("Checking for internal conflicts")
-    for data in section_data:
-        day_schedules = data['day_schedules']
-        
-        # Check conflicts within each day using sorted intervals
-        for day, day_scheds in day_schedules.items():
-            if len(day_scheds) > 1:
-                # Sort by start time for efficient overlap detection
-                day_scheds.sort(key=lambda x: x[0])
-                
-                # Single pass overlap detection
-                prev_end = day_scheds[0][1]
-                for start, end, _ in day_scheds[1:]:
-                    if start < prev_end:
-                        debugprint(f"Found internal conflict in {data['course_code']} section")
-                        return False
-                    prev_end = max(prev_end, end)
+        if not section.has_schedules:
+            continue
+        # O(1) duplicate detection
+        course_key = (section.course, section.faculty)
+        if course_key in seen_courses:
+            debugprint(f"Skipping schedule compatibility check between sections of the same course and faculty: {section.course} ({section.faculty})")
+            continue
+        seen_courses.add(course_key)
+        # Overlaps between a section's own meetings are found once, at compile time
+        if section.internal_conflict:
+            debugprint(f"Found internal conflict in {section.course} section")
+            return False
+        checked.append(section)
     
-    # Check conflicts between different sections - optimized
+    # Check conflicts between different sections with their weekly occupancy masks
     debugprint("Checking conflicts with other sections")
-    
-    # Use day-based conflict detection
-    for i, data1 in enumerate(section_data):
-        day_schedules1 = data1['day_schedules']
-        course_code1 = data1['course_code']
-        
-        for j in range(i + 1, len(section_data)):
-            data2 = section_data[j]
-            day_schedules2 = data2['day_schedules']
-            course_code2 = data2['course_code']
-            
-            # Find common days efficiently
-            common_days = set(day_schedules1.keys()) & set(day_schedules2.keys())
-            
-            # Check conflicts on common days only
-            for day in common_days:
-                scheds1 = day_schedules1[day]
-                scheds2 = day_schedules2[day]
-                
-                # Optimize by sorting both lists and using two-pointer technique
-                scheds1.sort(key=lambda x: x[0])
-                scheds2.sort(key=lambda x: x[0])
-                
-                # Efficient overlap detection between two sorted lists
-                ptr1 = ptr2 = 0
-                while ptr1 < len(scheds1) and ptr2 < len(scheds2):
-                    start1, end1, _ = scheds1[ptr1]
-                    start2, end2, _ = scheds2[ptr2]
-                    
-                    # Check for overlap
-                    if start1 < end2 and start2 < end1:
-                        debugprint(f"Found conflict between {course_code1} and {course_code2}")
-                        return False
-                    
-                    # Move pointer with smaller end time
-                    if end1 <= end2:
-                        ptr1 += 1
-                    else:
-                        ptr2 += 1
+    if combine_occupancy(checked) is None:
+        debugprint("Found conflict between sections")
+        return False
     
     debugprint("No conflicts found, combination is valid")
     return True
 
 
-def try_all_section_combinations(course_sections_map, selected_days, selected_times):
-    """Try all possible combinations of sections to find a valid routine."""
+def try_all_section_combinations(course_sections_map, selected_days, selected_times, deadline=None):
+    """Try all possible combinations of sections to find a valid routine.
+
+    The map's values may be feed dicts or compiled Sections; the first valid
+    combination is returned in the same form it was given. Gives up when
+    `deadline` (a Deadline) passes.
+    """
     try:
         debugprint("\n=== Trying Section Combinations ===")
         
-        # Get all possible combinations
+        # Compile dict sections once instead of re-parsing their times per combination
         courses = list(course_sections_map.keys())
-        all_combinations = list(itertools.product(*[course_sections_map[course] for course in courses]))
-        print(f"Generated {len(all_combinations)} possible combinations")
+        compiled = [
+            [(section, section if isinstance(section, Section) else Section(section))
+             for section in course_sections_map[course]]
+            for course in courses
+        ]
+        total = 1
+        for options in compiled:
+            total *= len(options)
+        print(f"Generated {total} possible combinations")
         
         # Convert selected times to minutes for easier comparison
         time_ranges = []
@@ -1502,200 +1398,51 @@ def try_all_section_combinations(course_sections_map, selected_days, selected_ti
         print(f"\nSelected time ranges:")
         for start, end in time_ranges:
             print(f"• {TimeUtils.minutes_to_time(start)} - {TimeUtils.minutes_to_time(end)}")
-            
-        # Iterate through combinations
-        print("\nChecking combinations for conflicts...")
-        valid_combinations = []
         
-        # Pre-compute selected days and time ranges for O(1) lookups
         selected_days_set = set(selected_days)
-        time_ranges_tuples = [(start, end) for start, end in time_ranges]
-        
-        for idx, combination in enumerate(all_combinations, 1):
-            print(f"\nTrying combination {idx}/{len(all_combinations)}")
-            
-            # Check if all sections are within selected days and times
-            valid = True
-            conflicts = []
-            
-            # Use set for O(1) course code lookups
-            seen_courses = set()
-            
-            # Check for time conflicts using optimized algorithm
-            # Build schedule map for O(1) conflict detection
-            schedule_map = {}
-            
-            for section in combination:
-                course_code = section.get("courseCode")
-                
-                # O(1) course duplicate check
-                if course_code in seen_courses:
-                    valid = False
-                    conflicts.append(f"Cannot take multiple sections of {course_code}")
-                    break
-                seen_courses.add(course_code)
-                
-                # Collect all schedules for this section
-                section_schedules = []
-                
-                # Process class schedules
-                if section.get("sectionSchedule"):
-                    for schedule in section["sectionSchedule"].get("classSchedules", []):
-                        day = schedule.get("day", "").upper()
-                        if day not in selected_days_set:
-                            valid = False
-                            conflicts.append(f"{course_code} requires {day}")
-                            break
-                            
-                        start_time = TimeUtils.time_to_minutes(schedule.get("startTime", ""))
-                        end_time = TimeUtils.time_to_minutes(schedule.get("endTime", ""))
-                        
-                        # O(1) time range check
-                        time_valid = any(
-                            start_time >= time_start and end_time <= time_end
-                            for time_start, time_end in time_ranges_tuples
-                        )
-                        
-                        if not time_valid:
-                            valid = False
-                            conflicts.append(f"{course_code} time conflict")
-                            break
-                            
-                        # Add to schedule map for conflict detection
-                        if day not in schedule_map:
-                            schedule_map[day] = []
-                        schedule_map[day].append((start_time, end_time, course_code))
-                
-                if not valid:
-                    break
-                
-                # Process lab schedules
-                lab_schedules = get_lab_schedules_flat(section)
-                for lab in lab_schedules:
-                    day = lab.get("day", "").upper()
-                    if day not in selected_days_set:
-                        valid = False
-                        conflicts.append(f"{course_code} Lab requires {day}")
-                        break
-                        
-                    start_time = TimeUtils.time_to_minutes(lab.get("startTime", ""))
-                    end_time = TimeUtils.time_to_minutes(lab.get("endTime", ""))
-                    
-                    time_valid = any(
-                        start_time >= time_start and end_time <= time_end
-                        for time_start, time_end in time_ranges_tuples
-                    )
-                    
-                    if not time_valid:
-                        valid = False
-                        conflicts.append(f"{course_code} Lab time conflict")
-                        break
-                        
-                    # Add to schedule map for conflict detection
-                    if day not in schedule_map:
-                        schedule_map[day] = []
-                    schedule_map[day].append((start_time, end_time, course_code))
-                
-                if not valid:
-                    break
-                
-                # O(n) conflict detection using sorted intervals
-                for day, schedules in schedule_map.items():
-                    if len(schedules) > 1:
-                        # Sort schedules by start time for efficient conflict detection
-                        schedules.sort(key=lambda x: x[0])
-                        prev_end = schedules[0][1]
-                        for start, end, course in schedules[1:]:
-                            if start < prev_end:
-                                valid = False
-                                conflicts.append(f"Time conflict on {day}")
-                                break
-                            prev_end = end
-                        if not valid:
-                            break
-                
-                if not valid:
-                    break
-            
-            if not valid:
-                print("\nConflicts found:")
-                for conflict in conflicts:
-                    print(f"• {conflict}")
+
+        def section_fits(section):
+            # Every class and lab must be on a selected day and inside one selected time range
+            for day, start_time, end_time, _ in section.class_meetings + section.lab_meetings:
+                if (DAY_NAMES[day] if day is not None else "") not in selected_days_set:
+                    return False
+                if not any(start_time >= time_start and end_time <= time_end
+                           for time_start, time_end in time_ranges):
+                    return False
+            return True
+
+        # Sections outside the selected days/times can never be part of a valid combination
+        fitting = [[(original, section) for original, section in options if section_fits(section)]
+                   for options in compiled]
+        all_exact = all(section.occupancy_exact for options in fitting for _, section in options)
+
+        print("\nChecking combinations for conflicts...")
+        for idx, combination in enumerate(itertools.product(*fitting), 1):
+            if deadline is not None and deadline.passed():
+                print(f"\n❌ Ran out of time after {idx - 1} combinations")
+                return None, "Ran out of time looking for a valid combination. Please try fewer courses or sections."
+            debugprint(f"\nTrying combination {idx}/{total}")
+            sections = [section for _, section in combination]
+            if len({section.course for section in sections}) < len(sections):
+                debugprint("• Cannot take multiple sections of the same course")
                 continue
             
-            # Check if sections fit within selected days and times
-            for section in combination:
-                course_code = section.get("courseCode")
-                section_name = section.get("sectionName")
-                print(f"\nChecking {course_code} Section {section_name}")
-                
-                # Check class schedules
-                if section.get("sectionSchedule"):
-                    for schedule in section["sectionSchedule"].get("classSchedules", []):
-                        day = schedule.get("day", "").upper()
-                        if day not in selected_days:
-                            print(f"❌ Class day {day} not in selected days")
-                            valid = False
-                            conflicts.append(f"{course_code} requires {day}")
-                            break
-                            
-                        start_time = TimeUtils.time_to_minutes(schedule.get("startTime", ""))
-                        end_time = TimeUtils.time_to_minutes(schedule.get("endTime", ""))
-                        
-                        # Check if class time is within any selected time slot
-                        time_valid = False
-                        for time_start, time_end in time_ranges:
-                            if start_time >= time_start and end_time <= time_end:
-                                time_valid = True
-                                break
-                                
-                        if not time_valid:
-                            print(f"❌ Class time {schedule.get('startTime')} - {schedule.get('endTime')} outside selected times")
-                            valid = False
-                            conflicts.append(f"{course_code} time conflict")
-                            break
-                            
-                # Check lab schedules
-                lab_schedules = get_lab_schedules_flat(section)
-                for lab in lab_schedules:
-                    day = lab.get("day", "").upper()
-                    if day not in selected_days:
-                        print(f"❌ Lab day {day} not in selected days")
-                        valid = False
-                        conflicts.append(f"{course_code} Lab requires {day}")
-                        break
-                        
-                    start_time = TimeUtils.time_to_minutes(lab.get("startTime", ""))
-                    end_time = TimeUtils.time_to_minutes(lab.get("endTime", ""))
-                    
-                    # Check if lab time is within any selected time slot
-                    time_valid = False
-                    for time_start, time_end in time_ranges:
-                        if start_time >= time_start and end_time <= time_end:
-                            time_valid = True
-                            break
-                            
-                    if not time_valid:
-                        print(f"❌ Lab time {lab.get('startTime')} - {lab.get('endTime')} outside selected times")
+            if all_exact:
+                # Every class and lab of the combination, or'ed into one weekly mask
+                valid = combine_occupancy(sections) is not None
+            else:
+                # Sorted sweep per day over every class and lab in the combination
+                schedule = sorted(interval for section in sections for interval in section.intervals)
+                valid = True
+                for (day1, _, end1), (day2, start2, _) in zip(schedule, schedule[1:]):
+                    if day1 == day2 and start2 < end1:
+                        debugprint(f"• Time conflict on {DAY_NAMES[day1]}")
                         valid = False
-                        conflicts.append(f"{course_code} Lab time conflict")
                         break
-                        
-                if not valid:
-                    break
             
             if valid:
                 print("\n✅ Found valid combination!")
-                valid_combinations.append(list(combination))
-                
-            if not valid:
-                print("\nConflicts in combination {idx}:")
-                for conflict in conflicts:
-                    print(f"• {conflict}")
-        
-        if valid_combinations:
-            # Return the first valid combination
-            return valid_combinations[0], None
+                return [original for original, _ in combination], None
                 
         print("\n❌ No valid combination found")
         return None, "Could not find a valid combination without conflicts. Please try different sections or time slots."
@@ -1706,417 +1453,814 @@ def try_all_section_combinations(course_sections_map, selected_days, selected_ti
         return None, f"Error finding valid combinations: {e}"
 
 
+DATA_LOADING_ERROR = {
+    "error": True,
+    "title": "Data Loading Error",
+    "message": "We couldn't load the current course data from the server.",
+    "suggestion": "Please try again later or contact support if the issue persists."
+}
+
+MISSING_REQUEST_ERROR = {
+    "error": True,
+    "title": "Missing Request Data",
+    "message": "No data was provided in your request.",
+    "suggestion": "Please ensure you're submitting course selections and preferences."
+}
+
+EXAM_CONFLICTS_ERROR = {
+    "error": True,
+    "title": "Exam Conflicts",
+    "message": "Exam Conflicts\n\nAll possible combinations have exam schedule conflicts.\n\nTry selecting courses with non-overlapping exam schedules, choose different sections of the same courses, or remove one of the conflicting courses.",
+    "suggestion": "Try selecting courses with non-overlapping exam schedules, choose different sections of the same courses, or remove one of the conflicting courses."
+}
+
+TIME_CONFLICTS_ERROR = {
+    "error": True,
+    "title": "Time Conflicts Detected",
+    "message": "All possible combinations have class time conflicts.",
+    "suggestion": "Some of your selected courses have overlapping class times. Try choosing different sections of the same courses or select courses with complementary schedules."
+}
+
+PREFERENCE_MISMATCH_ERROR = {
+    "error": True,
+    "title": "Preference Mismatch",
+    "message": "No combinations match your day and time preferences.",
+    "suggestion": "Your day/time preferences are too restrictive. Try selecting more days, expanding your preferred time ranges, or choose courses with more flexible scheduling options."
+}
+
+
+INVALID_CURSOR_ERROR = {
+    "error": True,
+    "title": "Invalid Cursor",
+    "message": "The page cursor is not one returned for this request.",
+    "suggestion": "Send the cursor of the previous page with the same courses and preferences, or leave it out for the first page."
+}
+
+SEARCH_TIMEOUT_ERROR = {
+    "error": True,
+    "title": "Search Timed Out",
+    "message": "No routine was found within the time allowed for the search.",
+    "suggestion": "Try selecting fewer courses or narrowing your faculty choices so there are fewer combinations to check.",
+    "complete": False
+}
+
+
+# Most routines one /api/routine request can ask for with ?k=, and one page of /api/routine/page
+MAX_ROUTINES = 20
+# Routines per page of /api/routine/page unless the request sets "pageSize"
+PAGE_SIZE = 10
+# Most valid routines the product and backtracking searches list before ranking them
+SEARCH_LIMIT = 1000
+
+
+def routine_response(combination):
+    """The section dicts of a routine as returned to the client, one section per course."""
+    routine = []
+    course_codes_seen = set()
+    for section in combination:
+        if section.course not in course_codes_seen:
+            routine.append(section.raw)
+            course_codes_seen.add(section.course)
+            debugprint(f"Selected {section.course} section with faculty {section.faculty}")
+    return routine
+
+
+def section_matches_preferences(section, times, selected_days_mask):
+    """True if every class and lab of a section is on a selected day and in the selected times."""
+    # Check if section schedules fit within selected times
+    valid_time, error = filter_section_by_time(section, times)
+    if not valid_time:
+        return False
+    # Check if section days are in selected days
+    return not (section.blank_day or section.days & ~selected_days_mask)
+
+
+def course_names(codes):
+    """Course codes as "A", "A and B" or "A, B and C"."""
+    if len(codes) == 1:
+        return codes[0]
+    return f"{', '.join(codes[:-1])} and {codes[-1]}"
+
+
+def conflict_error(candidates, courses, reason):
+    """The error naming the courses of `candidates` that minimal_conflict() found cannot be taken together."""
+    domains = [candidates[var] for var in courses]
+    codes = [domain[0].course for domain in domains]
+    names = course_names(codes)
+    if reason == EXAM_CONFLICTS:
+        # Every combination of these courses has an exam clash, so their first sections show one
+        _, message = check_exam_compatibility([domain[0] for domain in domains])
+        error = dict(EXAM_CONFLICTS_ERROR, message=message or EXAM_CONFLICTS_ERROR["message"])
+    elif reason == TIME_CONFLICTS:
+        error = dict(TIME_CONFLICTS_ERROR, message=(
+            f"{names} cannot be taken together: every combination of their sections has a class time "
+            "or exam conflict."))
+    elif len(codes) == 1:
+        error = dict(PREFERENCE_MISMATCH_ERROR, message=f"No section of {names} matches your day and time preferences.")
+    else:
+        error = dict(PREFERENCE_MISMATCH_ERROR, message=(
+            f"{names} cannot be taken together within your day and time preferences: the sections "
+            "that match them conflict with each other."))
+    error["conflictingCourses"] = codes
+    error["reason"] = reason
+    return error
+
+
+def product_search(domains, times, selected_days_mask, passed, deadline=None, limit=SEARCH_LIMIT):
+    """Yield the valid routines among all combinations of the candidate sections.
+
+    One pass over the combinations: each is checked for exam conflicts,
+    then time conflicts, then day/time preferences, and dropped at the
+    first check it fails. `passed` (a Counter) records how many got
+    through the exam and time checks, see product_failure(), and under
+    "examined" how many were looked at so far. Stops after `limit`
+    routines or when `deadline` (a Deadline) passes.
+    """
+    debugprint("\n=== Checking Exam Conflicts, Time Conflicts and Preferences ===")
+    processed_count = 0
+    found = 0
+    start_time = time.time()
+
+    for combination in itertools.product(*domains):
+        if deadline is not None and deadline.passed():
+            debugprint(f"Stopped after {time.time() - start_time:.2f} seconds")
+            break
+        processed_count += 1
+        passed["examined"] += 1
+
+        if has_exam_conflicts(combination):
+            continue
+        passed[EXAM_CONFLICTS] += 1
+        if not is_valid_combination(combination):
+            continue
+        passed[TIME_CONFLICTS] += 1
+        if not all(section_matches_preferences(section, times, selected_days_mask) for section in combination):
+            continue
+
+        yield combination
+        found += 1
+        if found >= limit:
+            break
+
+    debugprint(f"Total combinations processed: {processed_count}, routines: {found}, time: {time.time() - start_time:.2f}s")
+
+
+def product_failure(passed):
+    """The check that rejected every combination product_search() looked at."""
+    if not passed[EXAM_CONFLICTS]:
+        return EXAM_CONFLICTS
+    if not passed[TIME_CONFLICTS]:
+        return TIME_CONFLICTS
+    return PREFERENCE_MISMATCH
+
+
+def no_routine_error(passed, pruned, prefiltered_combinations, section_fits, deadline):
+    """The error to answer with when a search found no routine.
+
+    `passed` is the Counter of product_search() or None if another search
+    ran, `pruned` how many sections arc consistency removed beforehand. The
+    error names the fewest courses that cannot be taken together and why
+    (see minimal_conflict()); if the deadline passed while those were being
+    narrowed down, it is marked "complete": false, as the set may not be
+    the smallest.
+    """
+    if deadline.reached:
+        return SEARCH_TIMEOUT_ERROR
+    # The product search already knows the stage the pipeline failed at unless sections were pruned
+    failure = product_failure(passed) if passed is not None and not pruned else None
+    conflict = minimal_conflict(prefiltered_combinations, section_fits, is_valid_combination, failure, deadline)
+    if conflict is None:
+        return SEARCH_TIMEOUT_ERROR if deadline.reached else PREFERENCE_MISMATCH_ERROR
+    error = conflict_error(prefiltered_combinations, *conflict)
+    if deadline.reached:
+        # Out of time while narrowing the courses down: not the real answer, so not cached
+        error["complete"] = False
+    return error
+
+
+def requested_k():
+    """?k=N asks for the N best routines as "routines" besides the best one; None if not given."""
+    k = request.args.get("k", type=int)
+    if k is not None:
+        k = max(1, min(k, MAX_ROUTINES))
+    return k
+
+
+def routine_deadline(request_data, cancelled=None):
+    """The Deadline of a routine search: "timeBudgetMs" of the request, at most ROUTINE_TIME_BUDGET_MS."""
+    time_budget_ms = request_data.get("timeBudgetMs")
+    if not isinstance(time_budget_ms, (int, float)) or isinstance(time_budget_ms, bool) or time_budget_ms <= 0:
+        time_budget_ms = ROUTINE_TIME_BUDGET_MS
+    return Deadline.after(min(time_budget_ms, ROUTINE_TIME_BUDGET_MS) / 1000, cancelled)
+
+
+def routine_sections(catalog, request_data):
+    """The candidate Sections of every course of a routine request.
+
+    Returns (sections per course, None), or (None, error response) when the
+    request names no usable course or section.
+    """
+    if "courses" in request_data:
+        courses = request_data["courses"]
+        # Handle the case where courses is a list of objects with course and sections properties
+        if courses and isinstance(courses, list) and isinstance(courses[0], dict) and "course" in courses[0]:
+            debugprint("Detected course objects format")
+            # This is already in the expected format
+            pass
+        # Handle the case where courses is a list of course codes
+        elif courses and isinstance(courses, list) and isinstance(courses[0], str):
+            debugprint("Detected course codes format, converting to course objects")
+            # Convert to course objects format
+            courses = [{"course": course, "sections": {}} for course in courses]
+            debugprint(f"Converted course codes to course objects: {courses}")
+        else:
+            return None, (jsonify({
+                "error": True,
+                "title": "Invalid Format",
+                "message": "The courses data format in your request is invalid.",
+                "suggestion": "Please ensure you're using the correct format for course selections."
+            }), 400)
+    elif "sections" in request_data:
+        # Handle direct section IDs from regular routine generation
+        section_ids = request_data["sections"]
+        debugprint(f"\n=== Processing Direct Section IDs: {section_ids} ===")
+
+        # Find all sections in fresh data
+        all_sections = []
+        for section_id in section_ids:
+            # Match the "section" field, then sectionName, then sectionId
+            matching_section = catalog.find_section(section_id)
+            if matching_section:
+                all_sections.append(matching_section)
+                debugprint(f"Found section: {matching_section.course} - {matching_section.name}")
+            else:
+                debugprint(f"Section not found: {section_id}")
+
+        if not all_sections:
+            return None, (jsonify({"error": "No valid sections found"}), 400)
+
+        # Group sections by course code
+        courses_map = {}
+        for section in all_sections:
+            course_code = section.course
+            if course_code not in courses_map:
+                courses_map[course_code] = []
+            courses_map[course_code].append(section)
+
+        # Format courses for processing
+        courses = []
+        for course_code, sections in courses_map.items():
+            courses.append({
+                "course": course_code,
+                "sections": {section.faculty: {"value": section.name} for section in sections},
+                "locked": True  # Mark as locked since sections were provided directly
+            })
+
+        debugprint(f"Formatted courses from sections: {courses}")
+    else:
+        return None, (jsonify({
+            "error": True,
+            "title": "Missing Course Information",
+            "message": "No courses or sections were provided in your request.",
+            "suggestion": "Please select at least one course or section to generate a routine."
+        }), 400)
+
+    # Get all possible combinations
+    all_combinations = []
+
+    # Collect the candidate sections of every course, narrowed to the selected faculties if any
+    for course in courses:
+        course_code = course["course"]
+        sections_by_faculty = course.get("sections", {})
+
+        debugprint(f"\n=== Processing Course: {course_code} ===")
+
+        # Find all sections for the course
+        available_sections = catalog.course_sections(course_code)
+
+        if not available_sections:
+            debugprint(f"❌ Course not found in fresh data: {course_code}")
+            return None, (jsonify({
+                "error": True,
+                "title": "Course Not Found",
+                "message": f"We couldn't find {course_code} in the current course offerings. Please check the course code and try again.",
+                "suggestion": "Try searching for a different course or check if the semester offerings have changed."
+            }), 400)
+
+        # Global faculty optimization: evaluate all faculty combinations across all courses
+        if sections_by_faculty and any(faculty for faculty in sections_by_faculty.keys()):
+            debugprint("\n=== Global Faculty Optimization: Finding Minimum Days Across All Courses ===")
+
+            # Build faculty-to-sections mapping for this course
+            faculty_sections = {}
+            for section in available_sections:
+                # Check if this section is explicitly locked or course is locked
+                is_locked = any(
+                    section.name == info.get("value") 
+                    for info in sections_by_faculty.values()
+                )
+
+                if is_locked or course.get("locked", False) or section.free_seats > 0:
+                    faculty_name = section.faculty or "TBA"
+                    if faculty_name.upper() == "TBA" or not faculty_name.strip():
+                        faculty_name = "TBA"
+
+                    # Check if this faculty was requested
+                    if faculty_name in sections_by_faculty or "TBA" in sections_by_faculty:
+                        if faculty_name not in faculty_sections:
+                            faculty_sections[faculty_name] = []
+                        faculty_sections[faculty_name].append(section)
+
+            # Instead of optimizing per course, collect all sections from all requested faculties
+            # Check if we have explicitly provided sections to use instead of fresh data
+            sections_by_faculty = course.get("sections", {})
+            has_provided_sections = any(section_info.get("section") for section_info in sections_by_faculty.values())
+
+            if has_provided_sections:
+                # Use provided section data directly, ignoring fresh data
+                debugprint(f"=== Using provided section data for {course_code} ===")
+                course_sections = []
+                for faculty, section_info in sections_by_faculty.items():
+                    section_data = section_info.get("section")
+                    if section_data:
+                        # Use the exact provided section regardless of seat availability
+                        course_sections.append(Section(section_data))
+                        debugprint(f"Added provided section: {section_data.get('sectionName')} with faculty {faculty}")
+                all_combinations.append(course_sections)
+            elif faculty_sections:
+                # Collect all sections from all requested faculties for this course (fresh data)
+                course_sections = []
+                for faculty, sections in faculty_sections.items():
+                    course_sections.extend(sections)
+
+                debugprint(f"Collected {len(course_sections)} sections from {len(faculty_sections)} faculties for {course_code}")
+                all_combinations.append(course_sections)
+            else:
+                # Fallback to fresh data with seat availability check
+                course_sections = []
+                for faculty, section_info in sections_by_faculty.items():
+                    section_name = section_info.get("value")
+                    if section_name:
+                        if faculty.upper() == "TBA":
+                            matching_sections = [
+                                s for s in available_sections 
+                                if s.name == section_name 
+                                and (not s.faculty or s.faculty.strip() == "" or s.faculty.upper() == "TBA")
+                            ]
+                        else:
+                            matching_sections = [
+                                s for s in available_sections 
+                                if s.name == section_name 
+                                and s.faculty == faculty
+                            ]
+                        course_sections.extend(matching_sections)
+                    else:
+                        if faculty.upper() == "TBA":
+                            faculty_sections = [
+                                s for s in available_sections 
+                                if (not s.faculty or s.faculty.strip() == "" or s.faculty.upper() == "TBA")
+                            ]
+                        else:
+                            faculty_sections = [
+                                s for s in available_sections 
+                                if s.faculty == faculty
+                            ]
+                        course_sections.extend(faculty_sections)
+                all_combinations.append(course_sections)
+        else:
+            # Check if we have explicitly provided sections to use instead of fresh data
+            sections_by_faculty = course.get("sections", {})
+            has_provided_sections = any(section_info.get("section") for section_info in sections_by_faculty.values())
+
+            if has_provided_sections:
+                # Use provided section data directly
+                debugprint(f"=== Using provided section data for {course_code} ===")
+                course_sections = []
+
+                for faculty, section_info in sections_by_faculty.items():
+                    section_data = section_info.get("section")
+                    if section_data:
+                        # Use the exact provided section regardless of seat availability
+                        course_sections.append(Section(section_data))
+                        debugprint(f"Added provided section: {section_data.get('sectionName')} with faculty {faculty}")
+
+                all_combinations.append(course_sections)
+            else:
+                # No specific sections provided - use fresh data with availability check
+                is_locked_course = course.get("locked", False)
+                course_sections = []
+                for section in available_sections:
+                    is_locked_section = any(
+                        section.name == info.get("value") 
+                        for info in sections_by_faculty.values()
+                    )
+                    if is_locked_course or is_locked_section or section.free_seats > 0:
+                        course_sections.append(section)
+
+                all_combinations.append(course_sections)
+
+    if not course_sections:
+        msg = "No available sections found"
+        if sections_by_faculty:
+            msg += " matching your selection"
+        msg += f" for {course_code}"
+        debugprint(f"❌ {msg}")
+        return None, (jsonify({
+            "error": True,
+            "title": "No Available Sections",
+            "message": msg,
+            "suggestion": "Try selecting a different faculty or check if the course has available seats in other sections."
+        }), 400)
+
+    debugprint(f"\nFinal sections selected for {course_code}: {len(course_sections)}")
+    for section in course_sections:
+        debugprint(f"- Section {section.name} with faculty {section.faculty}")
+
+    # Check if we have any valid combinations after processing all courses
+    if not all_combinations:
+        return None, (jsonify({
+            "error": True,
+            "title": "No Valid Sections",
+            "message": "We couldn't find any valid sections for your selected courses.",
+            "suggestion": "Try selecting different courses or check if the courses have available seats."
+        }), 400)
+
+    # Filter out courses with no valid sections before generating combinations
+    valid_course_combinations = [course_sections for course_sections in all_combinations if course_sections]
+    if not valid_course_combinations:
+        return None, (jsonify({
+            "error": True,
+            "title": "No Valid Sections",
+            "message": "We couldn't find any valid sections for your selected courses.",
+            "suggestion": "Try selecting different courses or check if the courses have available seats."
+        }), 400)
+    return valid_course_combinations, None
+
+
+def prefilter_sections(valid_course_combinations, days, selected_days_mask):
+    """Drop the sections meeting on none of the selected days, unless that empties a course."""
+    prefiltered_combinations = []
+    for course_sections in valid_course_combinations:
+        filtered_sections = []
+        for section in course_sections:
+            # Quick pre-filter based on days if provided
+            if days and days != ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday"]:
+                # Skip sections that don't match day preferences
+                if not section.days & selected_days_mask:
+                    continue
+
+            filtered_sections.append(section)
+
+        # Only keep courses that have sections after filtering
+        if filtered_sections:
+            prefiltered_combinations.append(filtered_sections)
+        else:
+            prefiltered_combinations.append(course_sections)  # Fallback to original
+    return prefiltered_combinations
+
+
 @app.route("/api/routine", methods=["POST"])
 def generate_routine():
+    """Answer a routine request, from routine_cache if the same one was answered before.
+
+    Identical requests arriving while one is being searched wait for that
+    search (routine_flights) instead of starting their own.
+    """
+    snapshot = current_snapshot()
+    request_data = request.get_json(silent=True)
+    cache_key = None
+    if snapshot is not None:
+        cache_key = routine_cache_key(request_data, request.args.get("k", type=int))
+    if cache_key is None:
+        return build_routine()
+    key, courses = cache_key
+    cached = routine_cache.get(key, snapshot.catalog)
+    if cached is not None:
+        return routine_answer(cached, "HIT")
+    # One time budget for waiting on an identical search and for searching ourselves
+    deadline = routine_deadline(request_data, request.environ.get("waitress.client_disconnected"))
+
+    def search():
+        rv = build_routine(deadline)
+        response, status = rv if isinstance(rv, tuple) else (rv, 200)
+        body = response.get_json()
+        # Answers cut short by the deadline are not the real answer to the request
+        if status == 200 and body.get("complete", True):
+            routine_cache.put(key, snapshot.catalog, courses, body, status)
+        return body, status
+
+    answer, shared = routine_flights.run((key, snapshot.generation), search, deadline)
+    if shared and answer[0].get("complete") is False and not deadline.passed():
+        # The search we waited for lost its client or had less time than us; go on with what is left of ours
+        answer, shared = search(), False
+    return routine_answer(answer, "SHARED" if shared else "MISS")
+
+
+def routine_answer(answer, cache_status):
+    body, status = answer
+    response = jsonify(body)
+    response.headers[ROUTINE_CACHE_HEADER] = cache_status
+    return response, status
+
+
+@app.route("/api/routine/cache")
+def routine_cache_stats():
+    """Hit/miss counters of the routine answer cache, and how many requests shared a search."""
+    return jsonify(dict(routine_cache.stats(), coalesced=routine_flights.coalesced))
+
+
+# Seconds between "progress" events of /api/routine/stream
+STREAM_PROGRESS_INTERVAL = 0.5
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/api/routine/stream", methods=["POST"])
+def stream_routine():
+    """Search a routine like /api/routine, reporting on the search as Server-Sent Events.
+
+    Takes the same request (and ?k=) and runs the same search as
+    build_routine for its commute preference and "engine". Events:
+      progress - every STREAM_PROGRESS_INTERVAL seconds: combinations
+                 "examined" (product search only), valid routines "found"
+                 (for the fewest-days search, those that improved on the
+                 best so far), sections "pruned" before the search and
+                 "elapsedMs"
+      routine  - each time the best routine found so far improves, with its
+                 "campusDays" (and "routines" with ?k=); the backtracking
+                 and parallel searches only report the routines they end with
+      done     - the last event: the final progress counts and "complete",
+                 plus the answer /api/routine gives ("routine"/"routines" or
+                 its error fields)
+    Invalid requests get the JSON error of /api/routine instead of a
+    stream. The search stops at the time budget or when the client goes
+    away; "complete" is false then, and also when it stopped after
+    SEARCH_LIMIT routines without looking at the rest.
+    """
+    snapshot = current_snapshot()
+    if not snapshot or not snapshot.data:
+        return jsonify(DATA_LOADING_ERROR), 503
+    request_data = request.get_json(silent=True)
+    if not request_data or not isinstance(request_data, dict):
+        return jsonify(MISSING_REQUEST_ERROR), 400
+
+    days = request_data.get("days", [])
+    times = request_data.get("times", [])
+    commute_preference = request_data.get("commutePreference", "")
+    engine = request_data.get("engine", "product")
+    k = requested_k()
+    valid_course_combinations, error = routine_sections(snapshot.catalog, request_data)
+    if error is not None:
+        return error
+    selected_days_mask = day_mask(days)
+    prefiltered_combinations = prefilter_sections(valid_course_combinations, days, selected_days_mask)
+    section_fits = lambda section: section_matches_preferences(section, times, selected_days_mask)
+    domains, emptied = arc_consistency(prefiltered_combinations, section_fits)
+    pruned = sum(map(len, prefiltered_combinations)) - sum(map(len, domains))
+
+    # The search runs on its own thread so progress is reported while it finds nothing;
+    # closing the stream (the client went away) stops it
+    closed = threading.Event()
+    disconnected = request.environ.get("waitress.client_disconnected")
+    deadline = routine_deadline(request_data, lambda: closed.is_set() or bool(disconnected and disconnected()))
+    passed = Counter()  # product search counts, see product_search()
+    searched = Counter()  # "found" routines, and "capped" when a search stopped at SEARCH_LIMIT
+    found = queue.Queue()  # the best routines each time they improve, then None
+    failed = []
+
+    def improved(best):
+        searched["found"] += 1
+        found.put(best)
+
+    def search():
+        try:
+            if emptied is not None:
+                return
+            if commute_preference == "far" or commute_preference == "Live Far":
+                best = None
+                if engine == "parallel":
+                    best = search_pool.fewest_days_search(
+                        snapshot, domains, section_fits, is_valid_combination, k or 1, deadline)
+                if best is None:
+                    best = fewest_days_search(
+                        domains, section_fits, is_valid_combination, k or 1, deadline, improved=improved)
+                found.put(best)
+            elif engine == "backtracking" or engine == "parallel":
+                combinations = None
+                if engine == "parallel":
+                    combinations = search_pool.backtracking_search(
+                        snapshot, domains, section_fits, is_valid_combination, SEARCH_LIMIT, deadline)
+                if combinations is None:
+                    combinations = backtracking_search(
+                        domains, section_fits, is_valid_combination, SEARCH_LIMIT, deadline)
+                searched["found"] = len(combinations)
+                searched["capped"] = len(combinations) >= SEARCH_LIMIT
+                found.put(best_routines(combinations, commute_preference, k or 1))
+            else:
+                ranking = RoutineRanking(commute_preference, k or 1)
+                for combination in product_search(domains, times, selected_days_mask, passed, deadline):
+                    searched["found"] += 1
+                    if ranking.add(combination):
+                        found.put(ranking.best)
+                searched["capped"] = searched["found"] >= SEARCH_LIMIT
+        except Exception as e:
+            failed.append(e)
+        finally:
+            found.put(None)
+
+    def routines_event(best):
+        routines = [routine_response(combination) for combination in best]
+        event = {"routine": routines[0], "campusDays": campus_days(best[0])}
+        if k is not None:
+            event["routines"] = routines
+        return event
+
+    def generate():
+        start = time.time()
+
+        def progress():
+            return {
+                "examined": passed["examined"],
+                "found": searched["found"],
+                "pruned": pruned,
+                "elapsedMs": int((time.time() - start) * 1000),
+            }
+
+        threading.Thread(target=search, daemon=True).start()
+        try:
+            yield sse_event("progress", progress())
+            last_progress = time.time()
+            best = []
+            while True:
+                try:
+                    routines = found.get(timeout=STREAM_PROGRESS_INTERVAL)
+                except queue.Empty:
+                    pass
+                else:
+                    if routines is None:
+                        break
+                    if routines and routines != best:
+                        best = routines
+                        yield sse_event("routine", routines_event(best))
+                if time.time() - last_progress >= STREAM_PROGRESS_INTERVAL:
+                    yield sse_event("progress", progress())
+                    last_progress = time.time()
+            if failed:
+                raise failed[0]
+
+            summary = progress()
+            if best:
+                summary.update(routines_event(best))
+            else:
+                product = emptied is None and commute_preference not in ("far", "Live Far") \
+                    and engine not in ("backtracking", "parallel")
+                summary.update(no_routine_error(
+                    passed if product else None, pruned, prefiltered_combinations, section_fits, deadline))
+            summary["complete"] = not deadline.reached and not searched["capped"]
+            yield sse_event("done", summary)
+        except Exception as e:
+            debugprint(f"Error in stream_routine: {str(e)}")
+            yield sse_event("error", {
+                "error": True,
+                "title": "Routine Generation Error",
+                "message": "We encountered an unexpected error while generating your routine.",
+                "suggestion": "Please try again with different course selections or contact support if the issue persists."
+            })
+        finally:
+            closed.set()
+
+    response = app.response_class(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route("/api/routine/page", methods=["POST"])
+def routine_pages():
+    """One page of every valid routine for a request, best first.
+
+    Takes the request of /api/routine plus "pageSize" (default PAGE_SIZE,
+    at most MAX_ROUTINES) and the "cursor" returned with the previous page.
+    Routines are ranked for the commute preference as /api/routine ranks
+    them, but over all of them, and each page carries on the search where
+    the previous one stopped instead of starting over. The cursor holds
+    that position and the snapshot generation, and stays valid on newer
+    snapshots until one of the requested courses changes; "cursor" is null
+    after the last page. A page cut short by the time budget has
+    "complete": false and a cursor that continues from there.
+    """
+    snapshot = current_snapshot()
+    if not snapshot or not snapshot.data:
+        return jsonify(DATA_LOADING_ERROR), 503
+    request_data = request.get_json(silent=True)
+    if not request_data or not isinstance(request_data, dict):
+        return jsonify(MISSING_REQUEST_ERROR), 400
+
+    page_size = request_data.get("pageSize", PAGE_SIZE)
+    if not isinstance(page_size, int) or isinstance(page_size, bool) or page_size < 1:
+        page_size = PAGE_SIZE
+    page_size = min(page_size, MAX_ROUTINES)
+    digest = request_digest(request_data)
+    cursor = None
+    if request_data.get("cursor") is not None:
+        cursor = decode_cursor(request_data["cursor"])
+        if cursor is None or cursor.request != digest:
+            return jsonify(INVALID_CURSOR_ERROR), 400
+
+    days = request_data.get("days", [])
+    times = request_data.get("times", [])
+    commute_preference = request_data.get("commutePreference", "")
+    deadline = routine_deadline(request_data, request.environ.get("waitress.client_disconnected"))
+    valid_course_combinations, error = routine_sections(snapshot.catalog, request_data)
+    if error is not None:
+        return error
+    selected_days_mask = day_mask(days)
+    prefiltered_combinations = prefilter_sections(valid_course_combinations, days, selected_days_mask)
+    section_fits = lambda section: section_matches_preferences(section, times, selected_days_mask)
+    domains, emptied = arc_consistency(prefiltered_combinations, section_fits)
+    pruned = sum(map(len, prefiltered_combinations)) - sum(map(len, domains))
+    versions = courses_digest(snapshot.catalog, [section.course for domain in valid_course_combinations for section in domain])
+    position = None
+    if cursor is not None:
+        # A newer snapshot only matters if it changed one of the requested courses
+        if cursor.generation != snapshot.generation and cursor.courses != versions:
+            return jsonify({
+                "error": True,
+                "title": "Course Data Changed",
+                "message": "Seats or schedules of your courses changed since the previous page, so the routines have to be ranked again.",
+                "suggestion": "Request the first page again without a cursor."
+            }), 409
+        position = cursor.position
+        if position[3] is not None and len(position[3]) > len(domains):
+            return jsonify(INVALID_CURSOR_ERROR), 400
+
+    combinations, next_position = [], None
+    if emptied is None:
+        combinations, next_position = routine_page(
+            domains, section_fits, is_valid_combination, commute_preference, page_size, position, deadline)
+    if not combinations and position is None and next_position is None:
+        # Not a single routine: say why, as /api/routine does
+        error = no_routine_error(None, pruned, prefiltered_combinations, section_fits, deadline)
+        return jsonify(error), 200
+
+    response = {
+        "routines": [routine_response(combination) for combination in combinations],
+        "cursor": None,
+    }
+    if next_position is not None:
+        response["cursor"] = encode_cursor(Cursor(snapshot.generation, versions, digest, next_position))
+    if deadline.reached:
+        response["complete"] = False
+    return jsonify(response), 200
+
+
+def build_routine(deadline=None):
+    """Search the routine for the request being served (see generate_routine).
+
+    `deadline` is the Deadline of the search, by default routine_deadline() of the request.
+    """
     try:
         # Load fresh data for each routine generation request
         debugprint("\n=== Loading Fresh Course Data ===")
-        fresh_data = load_data()  # Get fresh data from the API
+        snapshot = current_snapshot()  # Pinned feed snapshot, compiled for the engine
+        fresh_data = snapshot.data if snapshot else None
         if not fresh_data:
-            return jsonify({
-                "error": True,
-                "title": "Data Loading Error",
-                "message": "We couldn't load the current course data from the server.",
-                "suggestion": "Please try again later or contact support if the issue persists."
-            }), 503
+            return jsonify(DATA_LOADING_ERROR), 503
         
+        catalog = snapshot.catalog
+
         # Get request data
         request_data = request.get_json()
         debugprint("\n=== Request Data ===")
         debugprint("Raw request data:", request_data)
         
         if not request_data:
-            return jsonify({
-                "error": True,
-                "title": "Missing Request Data",
-                "message": "No data was provided in your request.",
-                "suggestion": "Please ensure you're submitting course selections and preferences."
-            }), 400
+            return jsonify(MISSING_REQUEST_ERROR), 400
 
         # Handle both old and new request formats
         days = request_data.get("days", [])
         times = request_data.get("times", [])
         use_ai = request_data.get("useAI", False)
         commute_preference = request_data.get("commutePreference", "")
-        
-        if "courses" in request_data:
-            courses = request_data["courses"]
-            # Handle the case where courses is a list of objects with course and sections properties
-            if courses and isinstance(courses, list) and isinstance(courses[0], dict) and "course" in courses[0]:
-                debugprint("Detected course objects format")
-                # This is already in the expected format
-                pass
-            # Handle the case where courses is a list of course codes
-            elif courses and isinstance(courses, list) and isinstance(courses[0], str):
-                debugprint("Detected course codes format, converting to course objects")
-                # Convert to course objects format
-                courses = [{"course": course, "sections": {}} for course in courses]
-                debugprint(f"Converted course codes to course objects: {courses}")
-            else:
-                return jsonify({
-                    "error": True,
-                    "title": "Invalid Format",
-                    "message": "The courses data format in your request is invalid.",
-                    "suggestion": "Please ensure you're using the correct format for course selections."
-                }), 400
-        elif "sections" in request_data:
-            # Handle direct section IDs from regular routine generation
-            section_ids = request_data["sections"]
-            debugprint(f"\n=== Processing Direct Section IDs: {section_ids} ===")
-            
-            # Find all sections in fresh data
-            all_sections = []
-            for section_id in section_ids:
-                matching_section = next((s for s in fresh_data if s.get("section") == section_id), None)
-                # If not found by section ID, try matching by sectionName
-                if not matching_section:
-                    matching_section = next((s for s in fresh_data if s.get("sectionName") == section_id), None)
-                if matching_section:
-                    all_sections.append(matching_section)
-                    debugprint(f"Found section: {matching_section.get('courseCode')} - {matching_section.get('sectionName')}")
-                else:
-                    debugprint(f"Section not found: {section_id}")
-            
-            if not all_sections:
-                return jsonify({"error": "No valid sections found"}), 400
-                
-            # Group sections by course code
-            courses_map = {}
-            for section in all_sections:
-                course_code = section.get("courseCode")
-                if course_code not in courses_map:
-                    courses_map[course_code] = []
-                courses_map[course_code].append(section)
-                
-            # Format courses for processing
-            courses = []
-            for course_code, sections in courses_map.items():
-                courses.append({
-                    "course": course_code,
-                    "sections": {section.get("faculties"): {"value": section.get("sectionName")} for section in sections},
-                    "locked": True  # Mark as locked since sections were provided directly
-                })
-            
-            debugprint(f"Formatted courses from sections: {courses}")
-        else:
-            return jsonify({
-                "error": True,
-                "title": "Missing Course Information",
-                "message": "No courses or sections were provided in your request.",
-                "suggestion": "Please select at least one course or section to generate a routine."
-            }), 400
-            
-        # Get all possible combinations
-        all_combinations = []
-        
-        # Check if we need to optimize faculty selection for minimum days
-        optimize_faculty = (commute_preference == "far" and 
-                           all(len(course.get("sections", {})) == 0 for course in courses))
-        
-        if optimize_faculty:
-            debugprint("=== Optimizing faculty selection for minimum campus days ===")
-            
-            # Build faculty options for each course
-            course_faculty_options = {}
-            for course in courses:
-                course_code = course["course"]
-                available_sections = [s for s in fresh_data if s.get("courseCode") == course_code]
-                
-                # Group sections by faculty
-                faculty_sections = {}
-                for section in available_sections:
-                    # Skip seat availability check for explicitly provided sections or locked courses
-                    if course.get("locked", False) or section.get("capacity", 0) - section.get("consumedSeat", 0) > 0:
-                        faculty = section.get("faculties", "TBA") or "TBA"
-                        if faculty not in faculty_sections:
-                            faculty_sections[faculty] = []
-                        faculty_sections[faculty].append(section)
-                
-                course_faculty_options[course_code] = faculty_sections
-                debugprint(f"{course_code}: {len(faculty_sections)} faculty options")
-            
-            # Use a more efficient approach - evaluate faculty combinations lazily
-            course_codes = [course["course"] for course in courses]
-            
-            # Generate all faculty combinations
-            from itertools import product
-            faculty_lists = [list(course_faculty_options[code].keys()) for code in course_codes]
-            total_combinations = 1
-            for fl in faculty_lists:
-                total_combinations *= len(fl)
-            
-            debugprint(f"Evaluating {total_combinations} faculty combinations...")
-            
-            best_combination = None
-            min_days = float('inf')
-            
-            # Evaluate faculty combinations in batches to avoid memory issues
-            evaluated = 0
-            for faculty_combo in product(*faculty_lists):
-                evaluated += 1
-                if evaluated % 100 == 0:
-                    debugprint(f"Evaluated {evaluated}/{total_combinations} combinations...")
-                
-                # Build sections for this faculty combination
-                temp_sections = []
-                for i, course_code in enumerate(course_codes):
-                    faculty = faculty_combo[i]
-                    sections = course_faculty_options[course_code][faculty]
-                    temp_sections.append(sections)
-                
-                # Calculate campus days for this combination
-                try:
-                    # Quick evaluation using first available combination
-                    test_combination = next(itertools.product(*temp_sections))
-                    unique_days = set()
-                    
-                    for section in test_combination:
-                        # Add class days
-                        if section.get("sectionSchedule") and section["sectionSchedule"].get("classSchedules"):
-                            for schedule in section["sectionSchedule"]["classSchedules"]:
-                                unique_days.add(schedule["day"].upper())
-                        
-                        # Add lab days
-                        for lab in get_lab_schedules_flat(section):
-                            unique_days.add(lab["day"].upper())
-                    
-                    days_count = len(unique_days)
-                    
-                    if days_count < min_days:
-                        min_days = days_count
-                        best_combination = temp_sections
-                        debugprint(f"New best: {faculty_combo} = {days_count} days")
-                        
-                        # Early exit if we found the absolute minimum
-                        if days_count <= 1:
-                            break
-                            
-                except StopIteration:
-                    continue
-            
-            debugprint(f"Evaluation complete. Best combination: {min_days} days")
-            
-            if best_combination:
-                all_combinations = best_combination
-            else:
-                # Fallback to original behavior
-                for course in courses:
-                    course_code = course["course"]
-                    available_sections = [s for s in fresh_data if s.get("courseCode") == course_code]
-                    
-                    # Check if course is locked (sections provided directly)
-                    is_locked_course = course.get("locked", False)
-                    sections_by_faculty = course.get("sections", {})
-                    course_sections = []
-                    for section in available_sections:
-                        is_locked_section = any(
-                            section.get("sectionName") == info.get("value") 
-                            for info in sections_by_faculty.values()
-                        )
-                        if is_locked_course or is_locked_section or section.get("capacity", 0) - section.get("consumedSeat", 0) > 0:
-                            course_sections.append(section)
-                    
-                    all_combinations.append(course_sections)
-        else:
-            # Enhanced logic for when specific faculties are selected - evaluate all combinations globally
-            for course in courses:
-                course_code = course["course"]
-                sections_by_faculty = course.get("sections", {})
-                
-                debugprint(f"\n=== Processing Course: {course_code} ===")
-                
-                # Find all sections for the course
-                available_sections = [s for s in fresh_data if s.get("courseCode") == course_code]
-                
-                if not available_sections:
-                    debugprint(f"❌ Course not found in fresh data: {course_code}")
-                    return jsonify({
-                        "error": True,
-                        "title": "Course Not Found",
-                        "message": f"We couldn't find {course_code} in the current course offerings. Please check the course code and try again.",
-                        "suggestion": "Try searching for a different course or check if the semester offerings have changed."
-                    }), 400
-
-                # Global faculty optimization: evaluate all faculty combinations across all courses
-                if sections_by_faculty and any(faculty for faculty in sections_by_faculty.keys()):
-                    debugprint("\n=== Global Faculty Optimization: Finding Minimum Days Across All Courses ===")
-                    
-                    # Build faculty-to-sections mapping for this course
-                    faculty_sections = {}
-                    for section in available_sections:
-                        # Check if this section is explicitly locked or course is locked
-                        is_locked = any(
-                            section.get("sectionName") == info.get("value") 
-                            for info in sections_by_faculty.values()
-                        )
-                        
-                        if is_locked or course.get("locked", False) or section.get("capacity", 0) - section.get("consumedSeat", 0) > 0:
-                            faculty_name = section.get("faculties", "TBA")
-                            if faculty_name.upper() == "TBA" or not faculty_name.strip():
-                                faculty_name = "TBA"
-                            
-                            # Check if this faculty was requested
-                            if faculty_name in sections_by_faculty or "TBA" in sections_by_faculty:
-                                if faculty_name not in faculty_sections:
-                                    faculty_sections[faculty_name] = []
-                                faculty_sections[faculty_name].append(section)
-                    
-                    # Instead of optimizing per course, collect all sections from all requested faculties
-                    # Check if we have explicitly provided sections to use instead of fresh data
-                    sections_by_faculty = course.get("sections", {})
-                    has_provided_sections = any(section_info.get("section") for section_info in sections_by_faculty.values())
-                    
-                    if has_provided_sections:
-                        # Use provided section data directly, ignoring fresh data
-                        debugprint(f"=== Using provided section data for {course_code} ===")
-                        course_sections = []
-                        for faculty, section_info in sections_by_faculty.items():
-                            section_data = section_info.get("section")
-                            if section_data:
-                                # Use the exact provided section regardless of seat availability
-                                course_sections.append(section_data)
-                                debugprint(f"Added provided section: {section_data.get('sectionName')} with faculty {faculty}")
-                        all_combinations.append(course_sections)
-                    elif faculty_sections:
-                        # Collect all sections from all requested faculties for this course (fresh data)
-                        course_sections = []
-                        for faculty, sections in faculty_sections.items():
-                            course_sections.extend(sections)
-                        
-                        debugprint(f"Collected {len(course_sections)} sections from {len(faculty_sections)} faculties for {course_code}")
-                        all_combinations.append(course_sections)
-                    else:
-                        # Fallback to fresh data with seat availability check
-                        course_sections = []
-                        for faculty, section_info in sections_by_faculty.items():
-                            section_name = section_info.get("value")
-                            if section_name:
-                                if faculty.upper() == "TBA":
-                                    matching_sections = [
-                                        s for s in available_sections 
-                                        if s.get("sectionName") == section_name 
-                                        and (not s.get("faculties") or s.get("faculties").strip() == "" or s.get("faculties").upper() == "TBA")
-                                    ]
-                                else:
-                                    matching_sections = [
-                                        s for s in available_sections 
-                                        if s.get("sectionName") == section_name 
-                                        and s.get("faculties") == faculty
-                                    ]
-                                course_sections.extend(matching_sections)
-                            else:
-                                if faculty.upper() == "TBA":
-                                    faculty_sections = [
-                                        s for s in available_sections 
-                                        if (not s.get("faculties") or s.get("faculties").strip() == "" or s.get("faculties").upper() == "TBA")
-                                    ]
-                                else:
-                                    faculty_sections = [
-                                        s for s in available_sections 
-                                        if s.get("faculties") == faculty
-                                    ]
-                                course_sections.extend(faculty_sections)
-                        all_combinations.append(course_sections)
-                else:
-                    # Check if we have explicitly provided sections to use instead of fresh data
-                    sections_by_faculty = course.get("sections", {})
-                    has_provided_sections = any(section_info.get("section") for section_info in sections_by_faculty.values())
-                    
-                    if has_provided_sections:
-                        # Use provided section data directly
-                        debugprint(f"=== Using provided section data for {course_code} ===")
-                        course_sections = []
-                        
-                        for faculty, section_info in sections_by_faculty.items():
-                            section_data = section_info.get("section")
-                            if section_data:
-                                # Use the exact provided section regardless of seat availability
-                                course_sections.append(section_data)
-                                debugprint(f"Added provided section: {section_data.get('sectionName')} with faculty {faculty}")
-                        
-                        all_combinations.append(course_sections)
-                    else:
-                        # No specific sections provided - use fresh data with availability check
-                        is_locked_course = course.get("locked", False)
-                        course_sections = []
-                        for section in available_sections:
-                            is_locked_section = any(
-                                section.get("sectionName") == info.get("value") 
-                                for info in sections_by_faculty.values()
-                            )
-                            if is_locked_course or is_locked_section or section.get("capacity", 0) - section.get("consumedSeat", 0) > 0:
-                                course_sections.append(section)
-                        
-                        all_combinations.append(course_sections)
-            
-            if not course_sections:
-                msg = "No available sections found"
-                if sections_by_faculty:
-                    msg += " matching your selection"
-                msg += f" for {course_code}"
-                debugprint(f"❌ {msg}")
-                return jsonify({
-                    "error": True,
-                    "title": "No Available Sections",
-                    "message": msg,
-                    "suggestion": "Try selecting a different faculty or check if the course has available seats in other sections."
-                }), 400
-            
-            debugprint(f"\nFinal sections selected for {course_code}: {len(course_sections)}")
-            for section in course_sections:
-                debugprint(f"- Section {section.get('sectionName')} with faculty {section.get('faculties')}")
-            all_combinations.append(course_sections)
-
-        # Check if we have any valid combinations after processing all courses
-        if not all_combinations:
-            return jsonify({
-                "error": True,
-                "title": "No Valid Sections",
-                "message": "We couldn't find any valid sections for your selected courses.",
-                "suggestion": "Try selecting different courses or check if the courses have available seats."
-            }), 400
+        # "product" checks every combination in turn, "backtracking" searches them course by course,
+        # "parallel" runs the backtracking search on the worker processes of search_pool
+        engine = request_data.get("engine", "product")
+        k = requested_k()
+        # The search stops at the time budget, or when the client goes away (under waitress),
+        # and answers with the best routine found so far marked "complete": false
+        if deadline is None:
+            deadline = routine_deadline(request_data, request.environ.get("waitress.client_disconnected"))
+        
+        valid_course_combinations, error = routine_sections(catalog, request_data)
+        if error is not None:
+            return error
 
         # Generate all possible combinations with lazy evaluation
         try:
-            # Filter out courses with no valid sections before generating combinations
-            valid_course_combinations = [course_sections for course_sections in all_combinations if course_sections]
-            
-            if not valid_course_combinations:
-                return jsonify({
-                    "error": True,
-                    "title": "No Valid Sections",
-                    "message": "We couldn't find any valid sections for your selected courses.",
-                    "suggestion": "Try selecting different courses or check if the courses have available seats."
-                }), 400
-                
             # Pre-filter sections based on day/time preferences to reduce combination space
-            prefiltered_combinations = []
-            for course_sections in valid_course_combinations:
-                filtered_sections = []
-                for section in course_sections:
-                    # Quick pre-filter based on days if provided
-                    if days and days != ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday"]:
-                        section_days = set()
-                        if section.get("sectionSchedule") and section["sectionSchedule"].get("classSchedules"):
-                            section_days.update(schedule["day"].upper() 
-                                for schedule in section["sectionSchedule"]["classSchedules"])
-                        for lab in get_lab_schedules_flat(section):
-                            section_days.add(lab["day"].upper())
-                        
-                        # Skip sections that don't match day preferences
-                        if not any(day.upper() in [d.upper() for d in days] for day in section_days):
-                            continue
-                    
-                    filtered_sections.append(section)
-                
-                # Only keep courses that have sections after filtering
-                if filtered_sections:
-                    prefiltered_combinations.append(filtered_sections)
-                else:
-                    prefiltered_combinations.append(course_sections)  # Fallback to original
-            
-            # Use lazy generator instead of materializing all combinations upfront
-            combination_generator = itertools.product(*prefiltered_combinations)
+            selected_days_mask = day_mask(days)
+            prefiltered_combinations = prefilter_sections(valid_course_combinations, days, selected_days_mask)
             debugprint(f"Starting lazy evaluation for {len(prefiltered_combinations)} courses")
         except Exception as e:
             debugprint(f"Error generating combinations: {str(e)}")
@@ -2127,316 +2271,55 @@ def generate_routine():
                 "suggestion": "Try selecting fewer courses or different sections to reduce complexity."
             }), 400
 
-        if not all_combinations:
-            return jsonify({
-                "error": True,
-                "title": "No Valid Combinations",
-                "message": "We couldn't generate any valid combinations with your selected courses.",
-                "suggestion": "Try selecting fewer courses at once, choose different sections, or expand your day/time preferences to increase compatibility."
-            }), 400
-
-        # STEP 1: Check exam conflicts with lazy evaluation and caching
-        debugprint("\n=== STEP 1: Checking Exam Conflicts ===")
-        combinations_without_exam_conflicts = []
-        processed_count = 0
-        valid_count = 0
-        start_time = time.time()
-        max_processing_time = 30  # Maximum processing time in seconds
-        
-        # Cache for exam conflict checks to avoid recomputation
-        exam_cache = {}
-        
-        # Process combinations lazily with batch processing
-        batch_size = 100  # Process in smaller batches to avoid memory issues
-        for combination in combination_generator:
-            # Check time limit
-            if time.time() - start_time > max_processing_time:
-                debugprint(f"Processing timeout after {max_processing_time} seconds")
-                break
-                
-            processed_count += 1
-            
-            # Validate combination structure
-            if not all(isinstance(section, dict) and "courseCode" in section for section in combination):
-                continue
-
-            # Create cache key for this combination
-            cache_key = tuple(section.get("sectionId", "") for section in combination)
-            
-            # Check cache first
-            if cache_key in exam_cache:
-                has_exam_conflicts, exam_error = exam_cache[cache_key]
-            else:
-                has_exam_conflicts, exam_error = check_exam_compatibility(combination)
-                exam_cache[cache_key] = (has_exam_conflicts, exam_error)
-            
-            if not has_exam_conflicts:
-                combinations_without_exam_conflicts.append(combination)
-                valid_count += 1
-                
-                # Early exit if we have enough valid combinations
-                if valid_count >= 1000:  # Limit to prevent memory overflow
-                    debugprint(f"Found {valid_count} valid combinations after processing {processed_count}")
-                    break
-            
-            # Progress logging
-            if processed_count % batch_size == 0:
-                debugprint(f"Processed {processed_count} combinations, found {valid_count} valid so far...")
-                
-            # Quick validation for extremely large datasets
-            if processed_count >= 10000 and valid_count == 0:
-                debugprint("Warning: Processed 10,000+ combinations with no valid results, stopping early")
-                break
-
-        debugprint(f"Total combinations processed: {processed_count}, valid combinations: {valid_count}, time: {time.time() - start_time:.2f}s")
-
-        if not combinations_without_exam_conflicts:
-            # For error reporting, we need to process remaining combinations
-            debugprint("No valid combinations found, collecting detailed conflict information...")
-            remaining_conflicts = []
-            
-            # Reset generator and process remaining combinations
-            combination_generator = itertools.product(*valid_course_combinations)
-            for combination in combination_generator:
-                cache_key = tuple(section.get("sectionId", "") for section in combination)
-                if cache_key not in exam_cache:
-                    has_exam_conflicts, exam_error = check_exam_compatibility(combination)
-                    exam_cache[cache_key] = (has_exam_conflicts, exam_error)
-                else:
-                    has_exam_conflicts, exam_error = exam_cache[cache_key]
-                    
-                if has_exam_conflicts and exam_error:
-                    remaining_conflicts.append(exam_error)
-                    if len(remaining_conflicts) >= 10:  # Limit conflict details
-                        break
-            
-            # Return the first detailed conflict message
-            if remaining_conflicts:
-                return jsonify({
-                    "error": True,
-                    "title": "Exam Conflicts",
-                    "message": remaining_conflicts[0],
-                    "suggestion": "Try selecting courses with non-overlapping exam schedules, choose different sections of the same courses, or remove one of the conflicting courses."
-                }), 200
-            else:
-                return jsonify({
-                    "error": True,
-                    "title": "Exam Conflicts",
-                    "message": "Exam Conflicts\n\nAll possible combinations have exam schedule conflicts.\n\nTry selecting courses with non-overlapping exam schedules, choose different sections of the same courses, or remove one of the conflicting courses.",
-                    "suggestion": "Try selecting courses with non-overlapping exam schedules, choose different sections of the same courses, or remove one of the conflicting courses."
-                }), 200
-
-        # STEP 2: Check time conflicts with streaming processing
-        debugprint("\n=== STEP 2: Checking Time Conflicts ===")
-        valid_combinations = []
-        valid_count = 0
-        
-        # Cache for time conflict checks
-        time_cache = {}
-        
-        for combination in combinations_without_exam_conflicts:
-            # Create cache key
-            cache_key = tuple(section.get("sectionId", "") for section in combination)
-            
-            # Check cache first
-            if cache_key in time_cache:
-                is_valid = time_cache[cache_key]
-            else:
-                is_valid = is_valid_combination(combination)
-                time_cache[cache_key] = is_valid
-                
-            if is_valid:
-                valid_combinations.append(combination)
-                valid_count += 1
-                
-                # Limit valid combinations to prevent memory issues
-                if valid_count >= 1000:
-                    debugprint(f"Found {valid_count} valid combinations after time conflict check")
-                    break
-
-        if not valid_combinations:
-            return jsonify({
-                "error": True,
-                "title": "Time Conflicts Detected",
-                "message": "All possible combinations have class time conflicts.",
-                "suggestion": "Some of your selected courses have overlapping class times. Try choosing different sections of the same courses or select courses with complementary schedules."
-            }), 200
-
-        # STEP 2.5: Cross-course faculty optimization for minimum days
-        debugprint("\n=== STEP 2.5: Cross-Course Faculty Optimization ===")
-        
-        # When faculty is specified for multiple courses, find optimal combination
-        has_faculty_specified = any(
-            course.get("sections") and any(faculty for faculty in course["sections"].keys())
-            for course in courses
-        )
-        
-        if has_faculty_specified and commute_preference in ["far", "Live Far"]:
-            debugprint("Optimizing faculty combinations for minimum campus days...")
-            
-            # Build faculty options for each course
-            course_faculty_map = {}
-            for course in courses:
-                course_code = course["course"]
-                course_faculty_map[course_code] = {}
-                
-                available_sections = [s for s in fresh_data if s.get("courseCode") == course_code
-                                    and s.get("capacity", 0) - s.get("consumedSeat", 0) > 0]
-                
-                sections_by_faculty = course.get("sections", {})
-                for faculty in sections_by_faculty.keys():
-                    faculty_name = faculty if faculty.upper() != "TBA" else "TBA"
-                    faculty_sections = [
-                        s for s in available_sections 
-                        if (faculty_name == "TBA" and (not s.get("faculties") or s.get("faculties").strip() == "" or s.get("faculties").upper() == "TBA")) or
-                           (faculty_name != "TBA" and s.get("faculties") == faculty_name)
-                    ]
-                    if faculty_sections:
-                        course_faculty_map[course_code][faculty_name] = faculty_sections
-            
-            # Find optimal faculty combination across all courses
-            if all(course_faculty_map.values()):
-                best_combination = None
-                min_days = float('inf')
-                
-                # Generate all possible faculty combinations
-                faculty_combinations = list(itertools.product(
-                    *[list(course_faculty_map[code].items()) for code in course_faculty_map]
-                ))
-                
-                for combo in faculty_combinations:
-                    # Build test combination - use all sections for each faculty
-                    test_sections = []
-                    for _, sections in combo:
-                        test_sections.extend(sections)
-                    
-                    if test_sections:  # Only process non-empty combinations
-                        days_count, _ = calculate_campus_days(test_sections)
-                        
-                        if days_count < min_days:
-                            min_days = days_count
-                            best_combination = [sections for _, sections in combo]
-                
-                if best_combination:
-                    debugprint(f"Found optimal faculty combination: {min_days} days")
-                    # Flatten the best combination for processing
-                    all_combinations = []
-                    for sections in best_combination:
-                        all_combinations.extend(sections)
-                    
-                    # Remove duplicates based on courseCode and sectionName
-                    seen = set()
-                    unique_combinations = []
-                    for section in all_combinations:
-                        key = (section.get("courseCode"), section.get("sectionName"))
-                        if key not in seen:
-                            seen.add(key)
-                            unique_combinations.append(section)
-                    
-                    all_combinations = unique_combinations
-                else:
-                    debugprint("No optimal faculty combination found, using original logic")
-
-        # STEP 3: Check day/time preferences with streaming processing
-        debugprint("\n=== STEP 3: Checking Day/Time Preferences ===")
-        final_combinations = []
-        final_count = 0
-        
-        # Cache for preference checks
-        preference_cache = {}
-        
-        for combination in valid_combinations:
-            # Create cache key
-            cache_key = tuple(section.get("sectionId", "") for section in combination)
-            
-            # Check cache first
-            if cache_key in preference_cache:
-                is_valid = preference_cache[cache_key]
-            else:
-                is_valid = True
-                for section in combination:
-                    # Check if section schedules fit within selected times
-                    valid_time, error = filter_section_by_time(section, times)
-                    if not valid_time:
-                        is_valid = False
-                        break
-
-                    # Check if section days are in selected days
-                    section_days = set()
-                    if section.get("sectionSchedule") and section["sectionSchedule"].get("classSchedules"):
-                        section_days.update(schedule["day"].upper() 
-                            for schedule in section["sectionSchedule"]["classSchedules"])
-                    for lab in get_lab_schedules_flat(section):
-                        section_days.add(lab["day"].upper())
-                    
-                    if not all(day.upper() in [d.upper() for d in days] for day in section_days):
-                        is_valid = False
-                        break
-                
-                preference_cache[cache_key] = is_valid
-                
-            if is_valid:
-                final_combinations.append(combination)
-                final_count += 1
-                
-                # Limit final combinations
-                if final_count >= 1000:
-                    debugprint(f"Found {final_count} valid combinations after preference check")
-                    break
+        # Drop sections that cannot be part of any valid routine before enumerating
+        section_fits = lambda section: section_matches_preferences(section, times, selected_days_mask)
+        domains, emptied = arc_consistency(prefiltered_combinations, section_fits)
+        pruned = sum(map(len, prefiltered_combinations)) - sum(map(len, domains))
+        debugprint(f"Arc consistency removed {pruned} sections")
+
+        passed = None
+        if emptied is not None:
+            # Some course has no usable section left, so no routine exists
+            final_combinations = []
+        elif commute_preference == "far" or commute_preference == "Live Far":
+            # Only the routines with the fewest campus days are used, so search for them directly
+            debugprint("\n=== Fewest Campus Days Search ===")
+            final_combinations = None
+            if engine == "parallel":
+                final_combinations = search_pool.fewest_days_search(
+                    snapshot, domains, section_fits, is_valid_combination, k or 1, deadline)
+            if final_combinations is None:
+                final_combinations = fewest_days_search(domains, section_fits, is_valid_combination, k or 1, deadline)
+        elif engine == "backtracking" or engine == "parallel":
+            # Assign one course at a time, pruning partial routines that already conflict
+            debugprint("\n=== Backtracking Search ===")
+            final_combinations = None
+            if engine == "parallel":
+                final_combinations = search_pool.backtracking_search(
+                    snapshot, domains, section_fits, is_valid_combination, deadline=deadline)
+            if final_combinations is None:
+                final_combinations = backtracking_search(domains, section_fits, is_valid_combination, deadline=deadline)
+        else:
+            passed = Counter()
+            final_combinations = product_search(domains, times, selected_days_mask, passed, deadline)
 
-        if not final_combinations:
-            return jsonify({
-                "error": True,
-                "title": "Preference Mismatch",
-                "message": "No combinations match your day and time preferences.",
-                "suggestion": "Your day/time preferences are too restrictive. Try selecting more days, expanding your preferred time ranges, or choose courses with more flexible scheduling options."
-            }), 200
+        # Rank combinations by campus days as they stream in, holding only the best ones
+        debugprint(f"\nApplying commute preference: '{commute_preference}'")
+        best_combinations = best_routines(final_combinations, commute_preference, k or 1)
 
-        # Sort combinations by campus days with streaming processing
-        debugprint("\n=== Sorting Combinations Based on Commute Preference ===")
-        
-        # Process ALL combinations to find the actual minimum/maximum days
-        combinations_with_days = []
-        
-        # Process all valid combinations to ensure we find the optimal ones
-        for combination in final_combinations:
-            days_count, days_list = calculate_campus_days(combination)
-            combinations_with_days.append({
-                "combination": combination,
-                "campus_days": days_count,
-                "days_list": days_list
-            })
+        if not best_combinations:
+            error = no_routine_error(passed, pruned, prefiltered_combinations, section_fits, deadline)
+            return jsonify(error), 200
 
-        # Sort based on commute preference
-        debugprint(f"\nApplying commute preference: '{commute_preference}'")
-        if commute_preference == "far" or commute_preference == "Live Far":
-            combinations_with_days.sort(key=lambda x: x["campus_days"])
-            debugprint("\nSorted combinations by ascending campus days (fewer days is better)")
-        elif commute_preference == "near" or commute_preference == "Live Near":
-            combinations_with_days.sort(key=lambda x: -x["campus_days"])
-            debugprint("\nSorted combinations by descending campus days (more days is better)")
-        else:
-            # Balanced approach
-            if combinations_with_days:
-                all_campus_days = [combo["campus_days"] for combo in combinations_with_days]
-                target_days = (min(all_campus_days) + max(all_campus_days)) // 2
-                combinations_with_days.sort(key=lambda x: abs(x["campus_days"] - target_days))
-                debugprint(f"\nNo preference: sorted combinations by balanced days (target: {target_days} days)")
-                    
-        # Use the best combination, but limit to prevent memory issues
-        max_results = min(100, len(combinations_with_days))  # Limit final results
-        best_combination = combinations_with_days[0]["combination"]
-        debugprint(f"Selected best combination with {combinations_with_days[0]['campus_days']} campus days")
-        debugprint(f"Total combinations processed: {len(combinations_with_days)}")
-        debugprint(f"Top 5 combinations by preference:")
-        for i, combo in enumerate(combinations_with_days[:5]):
-            debugprint(f"  {i+1}. {combo['campus_days']} days: {sorted(combo['days_list'])}")
+        best_combination = best_combinations[0]
+        days_count, days_list = calculate_campus_days(best_combination)
+        debugprint(f"Selected best combination with {days_count} campus days")
         
         # Print detailed info about the selected combination
         debugprint("\n=== DETAILED INFO ABOUT SELECTED COMBINATION ===")
         debugprint(f"Commute Preference: {commute_preference}")
-        debugprint(f"Campus Days: {combinations_with_days[0]['campus_days']}")
-        debugprint(f"Days List: {', '.join(combinations_with_days[0]['days_list'])}")
+        debugprint(f"Campus Days: {days_count}")
+        debugprint(f"Days List: {', '.join(days_list)}")
         
         # If using AI, pass to AI routine generation
         if use_ai:
@@ -2445,22 +2328,17 @@ def generate_routine():
         
         # Return the best combination based on commute preference
         debugprint("\n=== Using Manual Routine Generation with Commute Preference ===")
-        
-        # Filter to ensure only one faculty per course
-        filtered_combination = []
-        course_codes_seen = set()
-        
-        for section in best_combination:
-            course_code = section.get("courseCode")
-            if course_code not in course_codes_seen:
-                filtered_combination.append(section)
-                course_codes_seen.add(course_code)
-                debugprint(f"Selected {course_code} section with faculty {section.get('faculties')}")
-        
-        return jsonify({"routine": filtered_combination}), 200
+        routines = [routine_response(combination) for combination in best_combinations]
+        response = {"routine": routines[0]}
+        if k is not None:
+            response["routines"] = routines
+        if deadline.reached:
+            # Out of time (or the client left): these are the best routines found so far
+            response["complete"] = False
+        return jsonify(response), 200
 
     except Exception as e:
-        debugprint(f"Error in generate_routine: {str(e)}")
+        debugprint(f"Error in build_routine: {str(e)}")
         return jsonify({
             "error": True,
             "title": "Routine Generation Error",
@@ -2470,7 +2348,9 @@ def generate_routine():
         }), 500
 
 def try_ai_routine_generation(valid_combination, selected_days, selected_times, commute_preference):
-    """AI-assisted routine generation using Gemini AI."""
+    """AI-assisted routine generation using Gemini AI for a combination of compiled Sections."""
+    sections = valid_combination
+    valid_combination = [section.raw for section in sections]
     try:
         debugprint("\n=== Using AI for Best Routine ===")
         
@@ -2481,7 +2361,7 @@ def try_ai_routine_generation(valid_combination, selected_days, selected_times,
             return jsonify({"routine": valid_combination}), 200
 
         # Calculate routine score
-        score = calculate_routine_score(valid_combination, selected_days, selected_times, commute_preference)
+        score = calculate_routine_score(sections, selected_days, selected_times, commute_preference)
         debugprint(f"Routine score: {score}")
 
         # Get feedback
@@ -2729,6 +2609,22 @@ def check_exam_conflicts_ai():
         return jsonify({"error": "Failed to check exam conflicts"}), 500
 
 
+def catalog_section(catalog, section):
+    """The snapshot's compiled copy of a section dict sent by the client, or None.
+
+    Only returned when the client's copy is identical to the feed's and has
+    no schedule entry without a day (those are compared as blank days by
+    the detailed checks, never by the compatibility table).
+    """
+    try:
+        found = catalog.by_id.get(section.get("sectionId"))
+    except (AttributeError, TypeError):
+        return None
+    if found is None or found.blank_day or found.raw != section:
+        return None
+    return found
+
+
 @app.route("/api/check_time_conflicts_ai", methods=["POST"])
 def check_time_conflicts_ai():
     try:
@@ -2742,12 +2638,18 @@ def check_time_conflicts_ai():
 
         debugprint(f"Checking {len(routine)} sections for time conflicts")
 
+        # Sections unchanged from the current snapshot are answered from its compatibility table
+        catalog = load_catalog()
+        compiled = [catalog_section(catalog, section) for section in routine]
+
         # Check for time conflicts
         time_conflicts = []
         for i in range(len(routine)):
             section1 = routine[i]
             for j in range(i + 1, len(routine)):
                 section2 = routine[j]
+                if compiled[i] and compiled[j] and not time_conflict(compiled[i], compiled[j]):
+                    continue
                 debugprint(f"\nComparing {section1.get('courseCode')} with {section2.get('courseCode')}")
 
                 # Check class schedules
@@ -2909,39 +2811,35 @@ def get_exam_schedule():
         return jsonify({"error": "Missing courseCode or sectionName"}), 400
 
     # Find the section in the data
-    for section in data:
-        if section.get("courseCode") == course_code and str(
-            section.get("sectionName")
-        ) == str(section_name):
-            # Return only the exam fields
-            return jsonify(
-                {
-                    "courseCode": section.get("courseCode"),
-                    "sectionName": section.get("sectionName"),
-                    "midExamDate": section.get("midExamDate"),
-                    "midExamStartTime": section.get("midExamStartTime"),
-                    "midExamEndTime": section.get("midExamEndTime"),
-                    "finalExamDate": section.get("finalExamDate"),
-                    "finalExamStartTime": section.get("finalExamStartTime"),
-                    "finalExamEndTime": section.get("finalExamEndTime"),
-                }
-            )
-    return jsonify({"error": "Section not found"}), 404
+    found = load_catalog().section_by_name(course_code, section_name)
+    if found is None:
+        return jsonify({"error": "Section not found"}), 404
+
+    # Return only the exam fields, preferring the ones inside sectionSchedule
+    section = found.raw
+    section_schedule = section.get("sectionSchedule") or {}
+    exam_fields = [
+        "midExamDate", "midExamStartTime", "midExamEndTime",
+        "finalExamDate", "finalExamStartTime", "finalExamEndTime",
+    ]
+    exam_schedule = {
+        "courseCode": section.get("courseCode"),
+        "sectionName": section.get("sectionName"),
+    }
+    for field in exam_fields:
+        exam_schedule[field] = section_schedule.get(field) or section.get(field)
+    return jsonify(exam_schedule)
 
 
 def calculate_routine_score(
     combination, selected_days, selected_times, commute_preference
 ):
-    """Calculate a score for a routine combination based on various factors."""
-    score = 0
+    """Calculate a score for a routine combination based on various factors.
 
-    # Convert selected times to minutes for easier comparison
-    time_ranges = []
-    for time_slot in selected_times:
-        start, end = time_slot.split("-")
-        start_mins = TimeUtils.time_to_minutes(start.strip())
-        end_mins = TimeUtils.time_to_minutes(end.strip())
-        time_ranges.append((start_mins, end_mins))
+    `combination` is a list of compiled Sections; their precomputed minutes
+    and day indexes are used directly.
+    """
+    score = 0
 
     # Score factors
     day_distribution = {day: [] for day in selected_days}  # Track classes per day
@@ -2950,37 +2848,20 @@ def calculate_routine_score(
     late_classes = 0  # Count of late afternoon classes
 
     for section in combination:
-        # Process class schedules
-        if section.get("sectionSchedule") and section["sectionSchedule"].get(
-            "classSchedules"
-        ):
-            for schedule in section["sectionSchedule"]["classSchedules"]:
-                day = schedule.get("day", "").upper()
-                if day in day_distribution:
-                    start_time = TimeUtils.time_to_minutes(
-                        schedule.get("startTime", "")
-                    )
-                    end_time = TimeUtils.time_to_minutes(schedule.get("endTime", ""))
-                    day_distribution[day].append((start_time, end_time))
-
-                    # Check timing preferences
-                    if start_time < 540:  # Before 9:00 AM
-                        early_classes += 1
-                    if end_time > 960:  # After 4:00 PM
-                        late_classes += 1
-
-        # Process lab schedules
-        for lab in get_lab_schedules_flat(section):
-            day = lab.get("day", "").upper()
-            if day in day_distribution:
-                start_time = TimeUtils.time_to_minutes(lab.get("startTime", ""))
-                end_time = TimeUtils.time_to_minutes(lab.get("endTime", ""))
-                day_distribution[day].append((start_time, end_time))
+        # Class schedules, then lab schedules
+        for day, start_time, end_time, _ in section.class_meetings + section.lab_meetings:
+            if day is None:
+                continue
+            day_schedules = day_distribution.get(DAY_NAMES[day])
+            if day_schedules is None:
+                continue
+            day_schedules.append((start_time, end_time))
 
-                if start_time < 540:
-                    early_classes += 1
-                if end_time > 960:
-                    late_classes += 1
+            # Check timing preferences
+            if start_time < 540:  # Before 9:00 AM
+                early_classes += 1
+            if end_time > 960:  # After 4:00 PM
+                late_classes += 1
 
     # Calculate scores for different factors
 
@@ -3024,23 +2905,11 @@ def calculate_routine_score(
         # Override all other scoring factors to ensure minimum days are selected
         
         # Calculate the theoretical minimum possible days
-        all_required_days = set()
+        all_required_days = 0
         for section in combination:
-            # Get all days this section requires
-            section_days = set()
-            if section.get("sectionSchedule") and section["sectionSchedule"].get("classSchedules"):
-                for schedule in section["sectionSchedule"]["classSchedules"]:
-                    if schedule.get("day"):
-                        section_days.add(schedule.get("day").upper())
-            
-            # Add lab days
-            for lab in get_lab_schedules_flat(section):
-                if lab.get("day"):
-                    section_days.add(lab.get("day").upper())
-            
-            all_required_days.update(section_days)
+            all_required_days |= section.days
         
-        theoretical_min_days = len(all_required_days)
+        theoretical_min_days = bin(all_required_days).count("1")
         
         # Give MASSIVE bonus for achieving the absolute minimum possible days
         if days_on_campus == theoretical_min_days:
@@ -3063,15 +2932,6 @@ def calculate_routine_score(
             penalty = (len(selected_days) - days_on_campus) * 1000  # Heavy penalty for missing days
             score -= penalty  # Heavily penalize missing days
             debugprint(f"Applied penalty of {penalty} for missing {len(selected_days) - days_on_campus} days")
-    elif commute_preference == "near" or commute_preference == "Live Near":
-        # Strongly prefer routines that use all available days
-        if days_on_campus == len(selected_days):
-            score += 2000  # Huge bonus for using all available days
-            debugprint(f"Added huge bonus for using all {len(selected_days)} available days")
-        else:
-            penalty = (len(selected_days) - days_on_campus) * 100
-            score -= penalty  # Heavily penalize missing days
-            debugprint(f"Applied penalty of {penalty} for missing {len(selected_days) - days_on_campus} days")
     else:
         # For no preference, prefer a balanced number of days
         # Ideal is roughly half the available days (rounded up)
@@ -3120,101 +2980,42 @@ def get_days_used_in_routine(routine):
 
 def calculate_campus_days(combination):
     """Calculate the total number of unique days a student needs to be on campus."""
-    debugprint("\n==== Calculating Campus Days for Combination ====")
-    days = set()
-    
-    # Print course codes in this combination
-    course_codes = [section.get('courseCode', 'Unknown') for section in combination]
-    debugprint(f"Courses in combination: {', '.join(course_codes)}")
-    
+    days = 0
     for section in combination:
-        if not isinstance(section, dict):
-            debugprint(f"Warning: Invalid section format: {type(section)}")
-            continue
-
-        course_code = section.get('courseCode', 'Unknown')
-        section_name = section.get('sectionName', 'Unknown')
-        debugprint(f"\nProcessing section {course_code} {section_name}")
-        
-        # Check class schedules
-        section_schedule = section.get("sectionSchedule", {})
-        if isinstance(section_schedule, dict):
-            class_schedules = section_schedule.get("classSchedules", [])
-            if isinstance(class_schedules, list):
-                debugprint(f"Processing {len(class_schedules)} class schedules for {course_code}")
-                for schedule in class_schedules:
-                    if isinstance(schedule, dict) and schedule.get("day"):
-                        day = schedule["day"].upper()
-                        days_before = days.copy()
-                        days.add(day)
-                        if day not in days_before:
-                            debugprint(f"Added NEW class day: {day} for {course_code}")
-                        else:
-                            debugprint(f"Day {day} already counted (class for {course_code})")
-
-        # Check lab schedules using the normalized helper function
-        lab_schedules = get_lab_schedules_flat(section)
-        debugprint(f"Processing {len(lab_schedules)} lab schedules for {course_code}")
-        for lab_schedule in lab_schedules:
-            if isinstance(lab_schedule, dict) and lab_schedule.get("day"):
-                day = lab_schedule["day"].upper()
-                days_before = days.copy()
-                days.add(day)
-                if day not in days_before:
-                    debugprint(f"Added NEW lab day: {day} for {course_code}")
-                else:
-                    debugprint(f"Day {day} already counted (lab for {course_code})")
-
-    days_list = sorted(list(days))
-    debugprint(f"Total campus days: {len(days_list)}")
-    debugprint(f"Days: {', '.join(days_list)}")
-    return len(days), days_list
+        days |= section.days
+    days_list = mask_days(days)
+    debugprint(f"Campus days for {', '.join(str(section.course) for section in combination)}: {', '.join(days_list)}")
+    return len(days_list), days_list
 
 
 # Helper to normalize labSchedules to a flat array, supporting both array and object (with classSchedules) formats
 def get_lab_schedules_flat(section):
     """Helper to normalize labSchedules to a flat array of schedules.
-    Handles both old format (array of schedules) and new format (object with classSchedules)."""
-    debugprint(f"\nGetting flat lab schedules for section {section.get('courseCode')} {section.get('sectionName')}")
+    Handles both old format (array of schedules) and new format (object with classSchedules).
+    Compiled Sections already carry the flattened list, built once per snapshot."""
+    if isinstance(section, Section):
+        return list(section.lab_schedules)
     labSchedules = section.get("labSchedules")
     if not labSchedules:
-        debugprint("No lab schedules found")
         return []
 
-    # Handle old format: array of schedule objects
+    # Old format: array of schedule objects; new format: object with classSchedules array
     if isinstance(labSchedules, list):
-        debugprint("Processing old format (array of schedules)")
-        schedules = [
-            {
-                **schedule,
-                "room": section.get("labRoomName") or schedule.get("room") or "TBA",
-                "faculty": section.get("labFaculties") or "TBA"
-            }
-            for schedule in labSchedules
-        ]
-        debugprint(f"Found {len(schedules)} lab schedules")
-        for schedule in schedules:
-            debugprint(f"Lab schedule: {schedule.get('day')} {schedule.get('startTime')}-{schedule.get('endTime')} in {schedule.get('room')}")
-        return schedules
-
-    # Handle new format: object with classSchedules array
-    if isinstance(labSchedules, dict) and isinstance(labSchedules.get("classSchedules"), list):
-        debugprint("Processing new format (object with classSchedules)")
-        schedules = [
-            {
-                **schedule,
-                "room": section.get("labRoomName") or schedule.get("room") or "TBA",
-                "faculty": section.get("labFaculties") or "TBA"
-            }
-            for schedule in labSchedules["classSchedules"]
-        ]
-        debugprint(f"Found {len(schedules)} lab schedules")
-        for schedule in schedules:
-            debugprint(f"Lab schedule: {schedule.get('day')} {schedule.get('startTime')}-{schedule.get('endTime')} in {schedule.get('room')}")
-        return schedules
+        schedules = labSchedules
+    elif isinstance(labSchedules, dict) and isinstance(labSchedules.get("classSchedules"), list):
+        schedules = labSchedules["classSchedules"]
+    else:
+        debugprint(f"Warning: Unrecognized lab schedule format: {type(labSchedules)}")
+        return []
 
-    debugprint(f"Warning: Unrecognized lab schedule format: {type(labSchedules)}")
-    return []
+    return [
+        {
+            **schedule,
+            "room": section.get("labRoomName") or schedule.get("room") or "TBA",
+            "faculty": section.get("labFaculties") or "TBA"
+        }
+        for schedule in schedules
+    ]
 
 
 def convert_time_24_to_12(time_str):
@@ -3284,52 +3085,13 @@ def format_section_times(section):
         return []
 
 def has_time_conflict(section1, section2):
-    """Check if two sections have time conflicts using optimized algorithm."""
+    """Check if two sections have time conflicts using their weekly occupancy masks."""
     try:
         debugprint(f"\nChecking time conflicts between {section1.get('courseCode')} and {section2.get('courseCode')}")
         
-        # Get all schedules for both sections
-        schedules1 = get_all_schedules(section1)
-        schedules2 = get_all_schedules(section2)
-        
-        if not schedules1 or not schedules2:
-            return False
-            
-        # Optimize by grouping schedules by day using hash maps
-        day_schedules1 = {}
-        day_schedules2 = {}
-        
-        # Group schedules by day for section1
-        for sched in schedules1:
-            day = sched.get('day', '').upper()
-            if day:
-                if day not in day_schedules1:
-                    day_schedules1[day] = []
-                day_schedules1[day].append(sched)
-        
-        # Group schedules by day for section2
-        for sched in schedules2:
-            day = sched.get('day', '').upper()
-            if day:
-                if day not in day_schedules2:
-                    day_schedules2[day] = []
-                day_schedules2[day].append(sched)
-        
-        # Only check days that exist in both sections
-        common_days = set(day_schedules1.keys()) & set(day_schedules2.keys())
-        
-        for day in common_days:
-            schedules_day1 = day_schedules1[day]
-            schedules_day2 = day_schedules2[day]
-            
-            # Check for conflicts on this day
-            for sched1 in schedules_day1:
-                for sched2 in schedules_day2:
-                    if not check_schedule_compatibility(sched1, sched2):
-                        debugprint(f"Found time conflict:")
-                        debugprint(f"Section 1: {section1.get('courseCode')} {sched1.get('day')} {sched1.get('startTime')}-{sched1.get('endTime')}")
-                        debugprint(f"Section 2: {section2.get('courseCode')} {sched2.get('day')} {sched2.get('startTime')}-{sched2.get('endTime')}")
-                        return True
+        if time_conflict(Section(section1), Section(section2)):
+            debugprint("Found time conflict")
+            return True
         
         debugprint("No time conflicts found")
         return False
@@ -3341,27 +3103,16 @@ def has_time_conflict(section1, section2):
 def get_course_details(course_code, show_all=False):
     """Get details for a specific course."""
     try:
-        course_data = load_data()
-        if not course_data:
-            return None
-            
-        course_details = None
-        for course in course_data:
-            if course["courseCode"] == course_code:
-                course_details = course
-                break
-                
-        if not course_details:
+        catalog = load_catalog()
+        sections = catalog.course_sections(course_code)
+        if not sections:
             return None
-            
-        sections = course_details.get("sections", [])
         
         # Filter sections based on availability if show_all is False
         filtered_sections = []
         for section in sections:
-            seats = section.get("availableSeats", 0)
-            if show_all or seats > 0:
-                filtered_sections.append(section)
+            if show_all or section.free_seats > 0:
+                filtered_sections.append(section.raw)
                 
         return filtered_sections
         
@@ -3400,6 +3151,7 @@ if __name__ == "__main__":
     log.setLevel(logging.INFO)
     
     # Run the app with debug mode disabled
+    course_snapshots.start_background_refresh()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False, use_reloader=False)  # Debug mode disabled
 
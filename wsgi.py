@@ -1,4 +1,4 @@
-from api.usisvercel import app
+from api.usisvercel import app, course_snapshots
 from waitress import serve
 import logging
 
@@ -23,12 +23,20 @@ if __name__ == "__main__":
     print("\n=== Starting Production Server with Debug Logging ===")
     print("Server URL: http://0.0.0.0:5000")
     print("Debug logging enabled")
+    if course_snapshots.snapshot is not None:
+        print(f"Course data: {len(course_snapshots.snapshot.data)} sections loaded from {course_snapshots.cache_path}")
+    else:
+        print("Course data: no saved snapshot, fetching from upstream")
     print("Press Ctrl+C to stop the server\n")
+    # Keep the feed fresh off the request path from the start
+    course_snapshots.start_background_refresh()
     serve(
         app,
         host='0.0.0.0',
         port=5000,
         threads=4,
+        # Keep reading while a request runs so long routine searches notice a client that left
+        channel_request_lookahead=1,
         log_socket_errors=True,
         clear_untrusted_proxy_headers=True
     )